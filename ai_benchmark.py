@@ -0,0 +1,1253 @@
+"""
+Benchmark and load-test harness for the AI integration module
+Replays a message corpus through AICog against fake Discord objects and a local mock upstream
+
+Usage:
+    python ai_benchmark.py --synthetic 20000 --rate 2000 --output bench.json
+    python ai_benchmark.py --corpus messages.jsonl --compare bench.json
+    python ai_benchmark.py --shards 2  # one process per shard sharing state through a RESP stand-in
+    python ai_benchmark.py --startup  # cog import, construction and load cost, features off vs on
+    python ai_benchmark.py --faq 100000  # FAQ index build and top-k lookup latency, CPU only
+    python ai_benchmark.py --rules 100000  # compiled rule engine vs per-pattern scans, msgs/sec
+    python ai_benchmark.py --lexicon 20000  # keyword index vs substring scans, 20 terms up to N
+    python ai_benchmark.py --flood 200000  # FloodDetector paced at 10k msg/s from 100k users
+    python ai_benchmark.py --entities 2000  # single-scan entity extraction vs the four findall passes
+    python ai_benchmark.py --image-memory  # peak allocation decoding and uploading 512px to 2048px images
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any
+
+from aiohttp import web
+
+import ai_integration
+from ai_integration import (
+    DEFAULT_LEXICON, AIConfig, AICog, AIHTTPClient, AIModeration, Base64ArtifactDecoder, EntityExtractor, FAQIndex,
+    FAQResponder, HashingEmbedder, ImageGeneration, KeywordIndex, MetricsRegistry, ModerationRuleEngine,
+    RESPStateBackend
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# 1x1 transparent PNG returned by the mock image endpoint
+PNG_PIXEL = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+_ids = itertools.count(1)
+
+
+class FakeUser:
+    """Stand-in for discord.Member"""
+    
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.bot = False
+        self.mention = f"<@{user_id}>"
+        self.display_name = f"user{user_id}"
+        self.removed: Optional[str] = None
+    
+    async def kick(self, reason: Optional[str] = None):
+        self.removed = 'kick'
+    
+    async def ban(self, reason: Optional[str] = None):
+        self.removed = 'ban'
+
+
+class FakeGuild:
+    """Stand-in for discord.Guild"""
+    
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+
+class FakeSentMessage:
+    """Message returned by FakeChannel.send"""
+    
+    def __init__(self, channel: 'FakeChannel', content: Optional[str]):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+    
+    async def edit(self, content: Optional[str] = None, **kwargs):
+        await asyncio.sleep(self.channel.api_delay)
+        self.content = content
+        self.channel.stats['edits'] += 1
+
+
+class FakeChannel:
+    """Stand-in for discord.TextChannel with a simulated REST round trip"""
+    
+    def __init__(self, channel_id: int, api_delay: float = 0.0):
+        self.id = channel_id
+        self.api_delay = api_delay
+        self.stats = {'sends': 0, 'edits': 0}
+    
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeSentMessage:
+        await asyncio.sleep(self.api_delay)
+        self.stats['sends'] += 1
+        return FakeSentMessage(self, content)
+    
+    @asynccontextmanager
+    async def typing(self):
+        yield
+
+
+class FakeMessage:
+    """Stand-in for discord.Message"""
+    
+    def __init__(self, content: str, author: FakeUser, channel: FakeChannel, guild: Optional[FakeGuild]):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.attachments: List[Any] = []
+        self.deleted = False
+    
+    async def delete(self):
+        await asyncio.sleep(self.channel.api_delay)
+        self.deleted = True
+    
+    async def reply(self, content: Optional[str] = None, **kwargs) -> FakeSentMessage:
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeCommand:
+    """Just enough of commands.Command for the cog's invoke hooks"""
+    
+    def __init__(self, name: str):
+        self.qualified_name = name
+
+
+class FakeContext:
+    """Stand-in for commands.Context"""
+    
+    def __init__(self, message: FakeMessage, command: str):
+        self.message = message
+        self.author = message.author
+        self.guild = message.guild
+        self.channel = message.channel
+        self.command = FakeCommand(command)
+        self.command_failed = False
+    
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeSentMessage:
+        return await self.channel.send(content, **kwargs)
+    
+    async def reply(self, content: Optional[str] = None, **kwargs) -> FakeSentMessage:
+        return await self.channel.send(content, **kwargs)
+    
+    def typing(self):
+        return self.channel.typing()
+
+
+class FakeBot:
+    """Stand-in for commands.Bot; command dispatch is driven by the harness"""
+    
+    async def process_commands(self, message: FakeMessage):
+        pass
+
+
+class RecordingRegistry(MetricsRegistry):
+    """MetricsRegistry that also keeps raw samples for exact percentiles"""
+    
+    def __init__(self):
+        super().__init__()
+        self.samples: Dict[str, List[float]] = {}
+    
+    def observe(self, name: str, value: float, **labels: Any):
+        super().observe(name, value, **labels)
+        key = name if not labels else f"{name}[{','.join(str(v) for _, v in sorted(labels.items()))}]"
+        self.samples.setdefault(key, []).append(value)
+
+
+class MockUpstream:
+    """Local stand-in for the chat, moderation and image APIs"""
+    
+    def __init__(self, latency: float = 0.02, tokens: int = 40, image: bytes = PNG_PIXEL):
+        self.latency = latency
+        self.tokens = tokens
+        # Encoded once, so serving a large artifact allocates little per request
+        self.image_body = json.dumps({'artifacts': [{'base64': base64.b64encode(image).decode()}]}).encode()
+        self.requests = {'chat': 0, 'moderation': 0, 'image': 0}
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self._chat)
+        app.router.add_post('/v1/moderations', self._moderation)
+        app.router.add_post('/v1/generation/{engine}/text-to-image', self._image)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+    
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        self.requests['chat'] += 1
+        await request.read()
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        await asyncio.sleep(self.latency)
+        for index in range(self.tokens):
+            chunk = {'choices': [{'delta': {'content': f"token{index} "}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+    
+    async def _moderation(self, request: web.Request) -> web.Response:
+        self.requests['moderation'] += 1
+        texts = (await request.json())['input']
+        await asyncio.sleep(self.latency)
+        return web.json_response({'results': [
+            {'category_scores': {'harassment': 0.8 if 'idiot' in text.lower() else 0.01}}
+            for text in texts
+        ]})
+    
+    async def _image(self, request: web.Request) -> web.StreamResponse:
+        self.requests['image'] += 1
+        await request.read()
+        await asyncio.sleep(self.latency * 5)
+        response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+        await response.prepare(request)
+        body = memoryview(self.image_body)
+        for offset in range(0, len(body), 64 * 1024):
+            await response.write(body[offset:offset + 64 * 1024])
+        await response.write_eof()
+        return response
+    
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class RESPStandIn:
+    """Local Redis-compatible server with just the commands shared state uses"""
+    
+    def __init__(self):
+        self.data: Dict[bytes, tuple] = {}
+        self.subscribers: Dict[bytes, set] = {}
+        self.clients: set = set()
+        self.commands = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.url = ""
+    
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"redis://127.0.0.1:{port}"
+    
+    def get(self, key: bytes) -> Optional[bytes]:
+        item = self.data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return None if item is None else item[0]
+    
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channels = []
+        self.clients.add(writer)
+        try:
+            while True:
+                command = await RESPStateBackend.read_reply(reader)
+                self.commands += 1
+                name, args = command[0].upper(), command[1:]
+                if name == b'SUBSCRIBE':
+                    for channel in args:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        channels.append(channel)
+                        writer.write(self._array([b'subscribe', channel, len(channels)]))
+                else:
+                    writer.write(self._execute(name, args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers[channel].discard(writer)
+            self.clients.discard(writer)
+            writer.close()
+    
+    def _execute(self, name: bytes, args: List[bytes]) -> bytes:
+        if name == b'GET':
+            return self._bulk(self.get(args[0]))
+        if name == b'MGET':
+            return self._array([self.get(key) for key in args])
+        if name == b'SET':
+            ttl = int(args[3]) / 1000 if len(args) > 3 and args[2].upper() == b'PX' else None
+            self.data[args[0]] = (args[1], time.monotonic() + ttl if ttl else None)
+            return b'+OK\r\n'
+        if name == b'DEL':
+            return b':%d\r\n' % sum(self.data.pop(key, None) is not None for key in args)
+        if name == b'PUBLISH':
+            receivers = self.subscribers.get(args[0], ())
+            for receiver in receivers:
+                receiver.write(self._array([b'message', args[0], args[1]]))
+            return b':%d\r\n' % len(receivers)
+        if name in (b'PING', b'SELECT', b'AUTH'):
+            return b'+OK\r\n'
+        return b'-ERR unknown command\r\n'
+    
+    @staticmethod
+    def _bulk(value: Optional[bytes]) -> bytes:
+        return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+    
+    @classmethod
+    def _array(cls, items: List[Any]) -> bytes:
+        return b'*%d\r\n' % len(items) + b''.join(
+            b':%d\r\n' % item if isinstance(item, int) else cls._bulk(item) for item in items
+        )
+    
+    def disconnect(self):
+        """Drop every client connection, as a server restart would"""
+        for writer in list(self.clients):
+            writer.transport.abort()
+    
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            self.disconnect()
+            await self._server.wait_closed()
+
+
+def synthetic_corpus(count: int, users: int, channels: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    Generate a reproducible mix of chat traffic
+    
+    Roughly: everyday chat, greetings and thanks, rule hits, long (Nitro
+    length) messages, and copypasta repeated across users.
+    """
+    rng = random.Random(seed)
+    vocabulary = [
+        "the", "game", "server", "tonight", "anyone", "play", "lol", "ranked", "patch", "music",
+        "stream", "build", "good", "bad", "great", "love", "hate", "awesome", "idiot", "question",
+    ]
+    copypasta = [
+        "FREE NITRO click here to claim your gift before it expires",
+        "this server is dead, join my server instead for giveaways",
+    ]
+    corpus = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.55:
+            content = " ".join(rng.choices(vocabulary, k=rng.randint(3, 18)))
+        elif roll < 0.70:
+            content = rng.choice(["hello everyone", "hey", "thanks a lot", "thank you!", "bye all", "can someone help?"])
+        elif roll < 0.80:
+            content = rng.choice(["this is a scam", "NSFW link here", "SPAM SPAM SPAM", "aaaaaaaaaa hate it"])
+        elif roll < 0.90:
+            content = " ".join(rng.choices(vocabulary, k=rng.randint(300, 700)))[:4000]
+        else:
+            content = rng.choice(copypasta)
+        corpus.append({
+            'content': content,
+            'user': rng.randrange(users) + 1,
+            'channel': rng.randrange(channels) + 1,
+        })
+    return corpus
+
+
+def load_corpus(path: str, users: int, channels: int, seed: int) -> List[Dict[str, Any]]:
+    """Read a JSON-lines corpus ({"content", "user", "channel"}) or plain text, one message per line"""
+    rng = random.Random(seed)
+    corpus = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = line
+            if not isinstance(record, dict):
+                record = {'content': str(record)}
+            record.setdefault('user', rng.randrange(users) + 1)
+            record.setdefault('channel', rng.randrange(channels) + 1)
+            corpus.append(record)
+    return corpus
+
+
+# Runs in a fresh interpreter so the import cost of ai_integration can be isolated
+STARTUP_PROBE = """
+import asyncio, json, os, socket, sys, tempfile, time
+import discord
+from discord.ext import commands  # the host bot has these loaded already
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        
+async def main(enabled):
+    baseline = rss()
+    started = time.perf_counter()
+    import ai_integration
+    imported = time.perf_counter()
+    config = ai_integration.AIConfig()
+    config.enable_ai_moderation = config.enable_auto_response = config.enable_image_generation = enabled
+    if enabled:
+        workdir = tempfile.mkdtemp()
+        config.state_db_path = os.path.join(workdir, 'state.db')
+        config.classifier_url = 'http://127.0.0.1:9/v1/moderations'
+        config.shared_state_url = 'memory://'
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            config.metrics_port = probe.getsockname()[1]
+    cog = ai_integration.AICog(object(), config)
+    constructed = time.perf_counter()
+    await cog.cog_load()
+    if enabled:
+        cog.advanced_ai
+    loaded = time.perf_counter()
+    result = {
+        'import_ms': (imported - started) * 1000,
+        'init_ms': (constructed - imported) * 1000,
+        'load_ms': (loaded - constructed) * 1000,
+        'rss_growth_bytes': rss() - baseline,
+    }
+    await cog.cog_unload()
+    print(json.dumps(result))
+    
+asyncio.run(main(sys.argv[1] == 'enabled'))
+"""
+
+
+def measure_startup(repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    """Median startup cost of the cog with every feature off and on, each run in a fresh process"""
+    results = {}
+    for mode in ('disabled', 'enabled'):
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, '-c', STARTUP_PROBE, mode],
+                capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[mode] = {key: sorted(run[key] for run in runs)[repeat // 2] for key in runs[0]}
+    return results
+
+
+def reference_scan(patterns: List[str], content: str) -> tuple:
+    """The original scorer: one re.search per rule plus a pass per signal"""
+    score = 0.0
+    violations = []
+    for pattern in patterns:
+        if re.search(pattern, content):
+            score += 0.3
+            violations.append(f"Pattern matched: {pattern}")
+    if len(content) > 5 and sum(1 for c in content if c.isupper()) / len(content) > 0.7:
+        score += 0.2
+        violations.append("Excessive capitalization")
+    if len(content) > 100 and content.count(' ') < 5:
+        score += 0.2
+        violations.append("Possible spam pattern")
+    if re.search(r'(.)\1{4,}', content):
+        score += 0.1
+        violations.append("Repeated characters detected")
+    return score, violations
+
+
+def measure_rules(corpus: List[Dict[str, Any]], extra_rules: int = 0) -> Dict[str, Any]:
+    """
+    Messages/sec of the per-pattern reference scorer and the compiled rule
+    engine over the same corpus, checking that both give identical results
+    
+    ``extra_rules`` adds random rules to the defaults, one in ten a regex.
+    """
+    rng = random.Random(extra_rules)
+    patterns = AIModeration(AIConfig()).blocked_patterns
+    # Admin rule lists are mostly word alternations, with the odd hand-written regex
+    for index in range(extra_rules):
+        words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(4, 8))) for _ in range(3)]
+        patterns.append(f"(?i)({'|'.join(words)})" if index % 10 else rf"(?i)\b{words[0]}\d+")
+    engine = ModerationRuleEngine(patterns)
+    texts = [record['content'] for record in corpus]
+    results: Dict[str, Any] = {'messages': len(texts), 'rules': len(patterns)}
+    outputs = {}
+    for name, scan in (('per_pattern', lambda text: reference_scan(patterns, text)), ('compiled', engine.scan)):
+        started = time.perf_counter()
+        outputs[name] = [scan(text) for text in texts]
+        elapsed = time.perf_counter() - started
+        results[name] = {'elapsed_s': round(elapsed, 3), 'msgs_per_sec': round(len(texts) / elapsed, 1)}
+    results['speedup'] = round(results['per_pattern']['elapsed_s'] / results['compiled']['elapsed_s'], 2)
+    results['mismatches'] = sum(
+        (round(a[0], 6), a[1]) != (round(b[0], 6), b[1]) for a, b in zip(outputs['per_pattern'], outputs['compiled'])
+    )
+    return results
+
+
+def measure_flood(corpus: List[Dict[str, Any]], rate: float) -> Dict[str, Any]:
+    """
+    Feed the configured FloodDetector in real time at ``rate`` messages/sec
+    and time each observe(), tracking how many users' windows are held
+    """
+    detector = AIModeration(AIConfig()).flood
+    samples = []
+    violations: Dict[str, int] = {}
+    peak_users = 0
+    started = time.perf_counter()
+    for position, record in enumerate(corpus):
+        delay = started + position / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        before = time.perf_counter()
+        _, found = detector.observe(record['user'], record['channel'], record['content'])
+        samples.append(time.perf_counter() - before)
+        for violation in found:
+            violations[violation] = violations.get(violation, 0) + 1
+        if position % 1000 == 0:
+            peak_users = max(peak_users, len(detector.users))
+    elapsed = time.perf_counter() - started
+    return {
+        'messages': len(corpus),
+        'users': len({record['user'] for record in corpus}),
+        'target_rate': rate,
+        'msgs_per_sec': round(len(corpus) / elapsed, 1),
+        'observe': percentiles(samples),
+        'busy_fraction': round(sum(samples) / elapsed, 3),
+        'violations': violations,
+        'peak_tracked_users': max(peak_users, len(detector.users)),
+        'tracked': detector.report(),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def synthetic_png(side: int) -> bytes:
+    """A side x side PNG with smooth and noisy regions, roughly as compressible as a generated image"""
+    from PIL import Image
+    
+    image = Image.merge('RGB', [
+        Image.effect_mandelbrot((side, side), (-2.0, -1.5, 1.0, 1.5), 100),
+        Image.linear_gradient('L').resize((side, side)),
+        Image.effect_noise((side, side), 40),
+    ])
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+async def measure_image_memory(sides: List[int]) -> List[Dict[str, Any]]:
+    """
+    Peak Python allocation (tracemalloc) per image request, for the bare
+    decoder and for ImageGeneration plus upload in each format, at each size
+    
+    Pillow's pixel buffers are allocated in C and not traced, so re-encoding
+    shows only its Python-side copies.
+    """
+    results = []
+    for upload_format in ('webp', 'jpeg'):
+        ImageGeneration._reencode(synthetic_png(64), upload_format, 85)  # load Pillow's plugins untraced
+    for side in sides:
+        png = synthetic_png(side)
+        upstream = MockUpstream(latency=0.0, image=png)
+        run: Dict[str, Any] = {'side': side, 'png_bytes': len(png), 'response_bytes': len(upstream.image_body)}
+        
+        body = upstream.image_body
+        chunks = [body[offset:offset + 64 * 1024] for offset in range(0, len(body), 64 * 1024)]
+        tracemalloc.start()
+        sink = io.BytesIO()
+        decoder = Base64ArtifactDecoder(sink)
+        for chunk in chunks:
+            decoder.feed(chunk)
+        assert sink.getvalue() == png
+        run['decoder_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del sink, decoder, chunks, body
+        
+        await upstream.start()
+        config = AIConfig()
+        config.stability_api_key = "benchmark"
+        http = AIHTTPClient()
+        run['formats'] = {}
+        for upload_format in ('png', 'webp', 'jpeg'):
+            config.image_upload_format = upload_format
+            generation = ImageGeneration(config, http)
+            generation.endpoint = f"{upstream.base_url}/generation"
+            tracemalloc.start()
+            data = await generation.generate_image(f"memory {side} {upload_format}")
+            upload = await generation.to_file(data)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            run['formats'][upload_format] = {
+                'peak_bytes': peak,
+                'peak_ratio': round(peak / len(png), 2),
+                'uploaded_bytes': generation.stats['bytes_uploaded'],
+            }
+            upload.close()
+            del data, upload, generation
+        await http.close()
+        await upstream.stop()
+        run['decoder_peak_ratio'] = round(run['decoder_peak_bytes'] / len(png), 2)
+        results.append(run)
+    return results
+
+
+def reference_entities(text: str) -> Dict[str, List[str]]:
+    """The original extractor: four findall passes with uncompiled patterns"""
+    return {
+        'mentions': re.findall(r'@\w+', text),
+        'urls': re.findall(r'http[s]?://\S+', text),
+        'emails': re.findall(r'\S+@\S+', text),
+        'numbers': re.findall(r'\b\d+\b', text),
+    }
+
+
+def entity_messages(count: int, length: int, seed: int) -> Dict[str, List[str]]:
+    """Long messages of plain prose, chat with an entity every few words, and nothing but entities"""
+    rng = random.Random(seed)
+    words = ["the", "patch", "notes", "are", "out", "and", "ranked", "feels", "better", "tonight", "anyone", "up", "for"]
+    
+    def snowflake() -> str:
+        return str(rng.randrange(10**17, 10**19))
+    
+    kinds = [
+        lambda: f"<@{snowflake()}>", lambda: f"<@&{snowflake()}>", lambda: f"<#{snowflake()}>",
+        lambda: f"<:pepe{rng.randrange(99)}:{snowflake()}>", lambda: f"<t:{rng.randrange(10**9, 2 * 10**9)}:R>",
+        lambda: f"https://discord.gg/{rng.randrange(16**6):x}", lambda: f"user{rng.randrange(999)}@example.com",
+        lambda: f"https://example.com/page/{rng.randrange(10**4)}?q={rng.randrange(99)}",
+        lambda: f"@name{rng.randrange(999)}", lambda: str(rng.randrange(10**4)), snowflake,
+    ]
+    makers = {
+        'prose': lambda: rng.choice(words),
+        'chatty': lambda: rng.choice(kinds)() if rng.random() < 0.2 else rng.choice(words),
+        'entities': lambda: rng.choice(kinds)(),
+    }
+    messages: Dict[str, List[str]] = {}
+    for name, make in makers.items():
+        messages[name] = []
+        for _ in range(count):
+            parts, size = [], 0
+            while size < length:
+                parts.append(make())
+                size += len(parts[-1]) + 1
+            messages[name].append(" ".join(parts)[:length])
+    return messages
+
+
+def measure_entities(count: int, length: int = 4000, seed: int = 1) -> Dict[str, Any]:
+    """
+    Per-message cost of the four-pass reference and EntityExtractor.scan on
+    long messages of each mix, plus a cached repeat by message ID
+    """
+    results: Dict[str, Any] = {'messages': count, 'length': length}
+    for name, texts in entity_messages(count, length, seed).items():
+        run: Dict[str, Any] = {'spans': sum(len(spans) for spans in EntityExtractor.scan(texts[0]).values())}
+        for method, extract in (('four_pass', reference_entities), ('scan', EntityExtractor.scan)):
+            started = time.perf_counter()
+            for text in texts:
+                extract(text)
+            run[f"{method}_us"] = round((time.perf_counter() - started) / count * 1e6, 1)
+        extractor = EntityExtractor()
+        for message_id, text in enumerate(texts):
+            extractor.extract(text, message_id)
+        started = time.perf_counter()
+        for message_id, text in enumerate(texts):
+            extractor.extract(text, message_id)
+        run['cached_us'] = round((time.perf_counter() - started) / count * 1e6, 1)
+        results[name] = run
+    return results
+
+
+def reference_keywords(entries: List[tuple], content: str) -> Dict[str, float]:
+    """The original matcher: a substring test per term, no word boundaries"""
+    lowered = content.lower()
+    scores: Dict[str, float] = {}
+    for category, term, weight in entries:
+        if term in lowered:
+            scores[category] = scores.get(category, 0.0) + weight
+    return scores
+
+
+def measure_lexicon(corpus: List[Dict[str, Any]], max_terms: int, seed: int = 1) -> List[Dict[str, Any]]:
+    """
+    Messages/sec of KeywordIndex and of per-term substring scans as the
+    lexicon grows tenfold from 20 terms up to ``max_terms``
+    
+    Lexicons are the defaults plus random terms, one in five of them two words.
+    """
+    rng = random.Random(seed)
+    entries = [(category, term, 1.0) for category, terms in DEFAULT_LEXICON.items() for term in terms]
+    while len(entries) < max_terms:
+        words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 9))) for _ in range(2)]
+        term = " ".join(words) if len(entries) % 5 == 0 else words[0]
+        entries.append((f"topic{len(entries) % 8}", term, round(rng.uniform(0.5, 2.0), 2)))
+    sizes = [20]
+    while sizes[-1] * 10 < max_terms:
+        sizes.append(sizes[-1] * 10)
+    if max_terms > sizes[-1]:
+        sizes.append(max_terms)
+    
+    texts = [record['content'] for record in corpus]
+    results = []
+    for size in sizes:
+        lexicon = entries[:size]
+        started = time.perf_counter()
+        index = KeywordIndex()
+        index.extend(lexicon)
+        run: Dict[str, Any] = {'terms': size, 'build_ms': round((time.perf_counter() - started) * 1000, 3)}
+        for text in texts[:200]:
+            index.scan(text)  # warm up
+        for name, scan in (('substring', lambda text: reference_keywords(lexicon, text)), ('index', index.scan)):
+            started = time.perf_counter()
+            for text in texts:
+                scan(text)
+            elapsed = time.perf_counter() - started
+            run[name] = {'elapsed_s': round(elapsed, 3), 'msgs_per_sec': round(len(texts) / elapsed, 1)}
+        results.append(run)
+    return results
+
+
+async def measure_faq(entries: int, dim: int = 256, queries: int = 256, seed: int = 1) -> Dict[str, Any]:
+    """
+    Build a memory-mapped FAQ index of synthetic entries and time top-k
+    lookups: direct searches at several batch sizes, then concurrent
+    answer() calls coalesced by FAQResponder
+    """
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 9))) for _ in range(5000)]
+    pairs = [(" ".join(rng.choice(vocabulary) for _ in range(8)), f"answer {index}") for index in range(entries)]
+    embedder = HashingEmbedder(dim)
+    results: Dict[str, Any] = {'entries': entries, 'dimensions': dim}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'faq.f32')
+        started = time.perf_counter()
+        index = FAQIndex(embedder, dim, path=path)
+        for offset in range(0, entries, 10000):
+            index.add(pairs[offset:offset + 10000])
+        results['build_s'] = round(time.perf_counter() - started, 3)
+        results['file_bytes'] = os.path.getsize(path)
+        index.close()
+        
+        started = time.perf_counter()
+        index = FAQIndex(embedder, dim, path=path)
+        results['open_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        
+        # Repeated entries are queried so recall is checkable without labels
+        sample = [pairs[rng.randrange(entries)][0] for _ in range(queries)]
+        results['search'] = {}
+        for batch_size in (1, 8, 32, 128):
+            samples = []
+            for offset in range(0, queries, batch_size):
+                started = time.perf_counter()
+                index.search(sample[offset:offset + batch_size], 3)
+                samples.append(time.perf_counter() - started)
+            stats = percentiles(samples)
+            stats['per_query_ms'] = round(sum(samples) / queries * 1000, 3)
+            results['search'][batch_size] = stats
+        results['recall_at_1'] = sum(
+            matches[0][2] == question for question, matches in zip(sample, index.search(sample, 1))
+        ) / queries
+        
+        responder = FAQResponder(index, threshold=0.0)
+        started = time.perf_counter()
+        await asyncio.gather(*(responder.answer(question) for question in sample))
+        results['responder'] = {
+            **percentiles(list(responder.latencies)),
+            'searches': responder.stats['searches'],
+            'queries_per_sec': round(queries / (time.perf_counter() - started), 1),
+        }
+        results['peak_rss_bytes'] = peak_rss_bytes()
+        index.close()
+    return results
+
+
+def shard_of(record: Dict[str, Any], guilds: int, shards: int) -> int:
+    """Shard that owns a record's guild, mirroring Discord's guild-to-shard routing"""
+    return (record['channel'] % guilds + 1) % shards
+
+
+def state_digest(view: Dict[int, list]) -> str:
+    """Order-independent fingerprint of per-user shared state"""
+    return hashlib.sha256(json.dumps(sorted(view.items())).encode()).hexdigest()[:16]
+
+
+async def shared_state_view(cog: AICog, users: List[int]) -> Dict[str, Any]:
+    """Read every user's strikes and cooldown through the cog's near-caches"""
+    view = {}
+    for user_id in users:
+        warnings = await cog.moderation.user_warnings.fetch(user_id)
+        cooldown = await cog.auto_response.user_cooldowns.fetch(user_id)
+        view[user_id] = [warnings[0] if warnings else 0, cooldown is not None]
+    return {
+        'digest': state_digest(view),
+        'strikes': sum(strikes for strikes, _ in view.values()),
+        'near_cache': {
+            store.namespace: store.report()
+            for store in (cog.moderation.user_warnings, cog.auto_response.user_cooldowns)
+        },
+        'backend': cog.state.report(),
+    }
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Count and p50/p95/p99/max in milliseconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 3)
+    
+    return {'count': len(ordered), 'p50_ms': at(0.50), 'p95_ms': at(0.95), 'p99_ms': at(0.99), 'max_ms': at(1.0)}
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def git_revision() -> Optional[str]:
+    """Current commit, so results can be compared across revisions"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def timed_command(cog: AICog, ctx: FakeContext, callback, **kwargs):
+    """Invoke a command callback between the cog's invoke hooks"""
+    await cog.cog_before_invoke(ctx)
+    try:
+        await callback(cog, ctx, **kwargs)
+    except Exception:
+        ctx.command_failed = True
+        raise
+    finally:
+        await cog.cog_after_invoke(ctx)
+
+
+async def run_benchmark(
+    args: argparse.Namespace,
+    corpus: List[Dict[str, Any]],
+    check_users: Optional[List[int]] = None
+) -> Dict[str, Any]:
+    """
+    Replay the corpus and collect timings, memory and cog statistics
+    
+    With ``check_users`` (shard processes), the run ends at a barrier: the
+    process prints ``ready`` once its writes are flushed, waits for a line on
+    stdin, then reports those users' state as seen through its near-caches.
+    """
+    upstream = MockUpstream(latency=args.upstream_latency)
+    await upstream.start()
+    
+    config = AIConfig()
+    config.openai_api_key = "benchmark"
+    config.stability_api_key = "benchmark"
+    config.openai_base_url = upstream.base_url
+    config.analysis_workers = args.analysis_workers
+    config.response_cooldown = 0
+    config.shared_state_url = args.state_url or ""
+    if args.classifier:
+        config.classifier_url = f"{upstream.base_url}/moderations"
+    
+    cog = AICog(FakeBot(), config)
+    registry = RecordingRegistry()
+    cog.metrics = registry
+    cog.http.metrics = registry
+    cog.image_gen.endpoint = f"{upstream.base_url}/generation"
+    await cog.cog_load()
+    
+    guilds = [FakeGuild(guild_id) for guild_id in range(1, args.guilds + 1)]
+    channels = {}
+    users = {}
+    end_to_end: List[float] = []
+    tasks = set()
+    
+    async def deliver(record: Dict[str, Any], index: int):
+        channel = channels.get(record['channel'])
+        if channel is None:
+            channel = channels[record['channel']] = FakeChannel(record['channel'], args.discord_latency)
+        author = users.get(record['user'])
+        if author is None:
+            author = users[record['user']] = FakeUser(record['user'])
+        message = FakeMessage(record['content'], author, channel, guilds[record['channel'] % len(guilds)])
+        
+        started = time.perf_counter()
+        await cog.on_message(message)
+        end_to_end.append(time.perf_counter() - started)
+        
+        if args.ask_every and index % args.ask_every == 0:
+            await timed_command(cog, FakeContext(message, 'ai_ask'), AICog.ask_ai.callback, question=record['content'][:200])
+        if args.image_every and index % args.image_every == 0:
+            await timed_command(cog, FakeContext(message, 'ai_generate'), AICog.generate_image.callback, prompt=f"prompt {index % 20}")
+    
+    if args.trace_allocations:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    
+    interval = 1.0 / args.rate if args.rate else 0.0
+    started = time.perf_counter()
+    for index, record in enumerate(corpus):
+        if interval:
+            delay = started + index * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        task = asyncio.create_task(deliver(record, index))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        if not interval and index % 256 == 0:
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await cog.moderation_pipeline.join()
+    await asyncio.gather(*cog._background, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    
+    memory: Dict[str, Any] = {}
+    if args.trace_allocations:
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        diff = after.compare_to(before, 'lineno')
+        memory.update({
+            'traced_current_bytes': current,
+            'traced_peak_bytes': peak,
+            'allocated_blocks': sum(max(stat.count_diff, 0) for stat in diff),
+            'top_allocations': [
+                {'site': str(stat.traceback[0]), 'size_bytes': stat.size_diff, 'blocks': stat.count_diff}
+                for stat in diff[:10]
+            ],
+        })
+        tracemalloc.stop()
+    memory['peak_rss_bytes'] = peak_rss_bytes()
+    
+    stages = {'on_message': percentiles(end_to_end)}
+    for key, samples in sorted(registry.samples.items()):
+        stages[key] = percentiles(samples)
+    stages['moderation_queue_to_verdict'] = {
+        'count': len(cog.moderation_pipeline.latencies),
+        'p50_ms': round(cog.moderation_pipeline.latency_percentile(50) * 1000, 3),
+        'p95_ms': round(cog.moderation_pipeline.latency_percentile(95) * 1000, 3),
+        'p99_ms': round(cog.moderation_pipeline.latency_percentile(99) * 1000, 3),
+    }
+    
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'messages': len(corpus),
+        'elapsed_s': round(elapsed, 3),
+        'msgs_per_sec': round(len(corpus) / elapsed, 1) if elapsed else 0.0,
+        'stages': stages,
+        'memory': memory,
+        'event_loop_lag': cog.loop_lag.report(),
+        'moderation': {**cog.moderation_pipeline.stats, 'actions': dict(cog.moderation_pipeline.actions)},
+        'analysis': cog.analyzer.report(),
+        'upstream_requests': dict(upstream.requests),
+    }
+    if cog.moderation.classifier:
+        results['classifier'] = cog.moderation.classifier.report()
+    if check_users is not None:
+        await cog.moderation.user_warnings.flush()
+        await cog.auto_response.user_cooldowns.flush()
+        print("ready", flush=True)
+        await asyncio.to_thread(sys.stdin.readline)
+        results['shared_state'] = await shared_state_view(cog, check_users)
+    
+    await cog.cog_unload()
+    await upstream.stop()
+    return results
+
+
+def shard_argv(args: argparse.Namespace) -> List[str]:
+    """Command-line options a shard process inherits from the coordinator"""
+    argv = ['--corpus', args.corpus] if args.corpus else ['--synthetic', str(args.synthetic)]
+    for option in ('rate', 'users', 'channels', 'guilds', 'seed', 'ask_every', 'image_every',
+                   'analysis_workers', 'upstream_latency', 'discord_latency', 'shards'):
+        argv += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    if args.classifier:
+        argv.append('--classifier')
+    return argv
+
+
+async def run_shards(args: argparse.Namespace, corpus: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Replay each shard's slice in its own process against one RESP stand-in and check they agree"""
+    standin = RESPStandIn()
+    await standin.start()
+    users = sorted({record['user'] for record in corpus})
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        outputs = [os.path.join(workdir, f"shard{index}.json") for index in range(args.shards)]
+        processes = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), *shard_argv(args),
+                '--shard-index', str(index), '--state-url', standin.url, '--output', outputs[index],
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+            )
+            for index in range(args.shards)
+        ]
+        # Every shard has replayed and flushed before any of them reads the shared view
+        for process in processes:
+            while True:
+                line = await process.stdout.readline()
+                if not line or line.strip() == b'ready':
+                    break
+        for process in processes:
+            if process.returncode is None:
+                process.stdin.write(b'go\n')
+        for process in processes:
+            await process.communicate()
+        failed = [index for index, process in enumerate(processes) if process.returncode]
+        if failed:
+            raise RuntimeError(f"Shard processes {failed} failed")
+        shards = []
+        for path in outputs:
+            with open(path, encoding='utf-8') as f:
+                shards.append(json.load(f))
+    
+    prefix = AIConfig().shared_state_prefix
+    stored = {}
+    for user_id in users:
+        warnings = standin.get(f"{prefix}:warnings:{user_id}".encode())
+        cooldown = standin.get(f"{prefix}:cooldowns:{user_id}".encode())
+        stored[user_id] = [json.loads(warnings)[0] if warnings else 0, cooldown is not None]
+    await standin.stop()
+    
+    elapsed = max(shard['elapsed_s'] for shard in shards)
+    digests = [shard['shared_state']['digest'] for shard in shards]
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'messages': len(corpus),
+        'elapsed_s': elapsed,
+        'msgs_per_sec': round(len(corpus) / elapsed, 1) if elapsed else 0.0,
+        'agree': len(set(digests)) == 1 and digests[0] == state_digest(stored),
+        'stored_digest': state_digest(stored),
+        'stored_strikes': sum(strikes for strikes, _ in stored.values()),
+        'standin_commands': standin.commands,
+        'shards': [
+            {key: shard[key] for key in ('messages', 'elapsed_s', 'msgs_per_sec', 'stages', 'shared_state')}
+            for shard in shards
+        ],
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Describe throughput and p99 changes against a previous result file"""
+    lines = [f"msgs/sec: {baseline['msgs_per_sec']} -> {current['msgs_per_sec']}"]
+    for stage, stats in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage, {}).get('p99_ms')
+        after = stats.get('p99_ms')
+        if before and after is not None:
+            lines.append(f"{stage} p99: {before:.3f}ms -> {after:.3f}ms ({(after - before) / before:+.1%})")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--corpus', help="JSON-lines or plain-text message corpus to replay")
+    source.add_argument('--synthetic', type=int, default=10000, help="number of synthetic messages (default: 10000)")
+    parser.add_argument('--rate', type=float, default=0.0, help="messages per second, 0 for as fast as possible")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--channels', type=int, default=50)
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--ask-every', type=int, default=0, help="run ai_ask on every Nth message")
+    parser.add_argument('--image-every', type=int, default=0, help="run ai_generate on every Nth message")
+    parser.add_argument('--classifier', action='store_true', help="enable the batched moderation classifier")
+    parser.add_argument('--analysis-workers', type=int, default=0, help="process pool size for text analysis")
+    parser.add_argument('--upstream-latency', type=float, default=0.02, help="mock upstream latency in seconds")
+    parser.add_argument('--discord-latency', type=float, default=0.0, help="fake Discord REST latency in seconds")
+    parser.add_argument('--trace-allocations', action='store_true', help="record allocations with tracemalloc (slow)")
+    parser.add_argument('--startup', action='store_true', help="measure cog startup with features disabled and enabled")
+    parser.add_argument('--rules', type=int, default=0, help="microbenchmark the moderation rule engine on this many messages")
+    parser.add_argument('--flood', type=int, default=0, help="replay this many messages from 100k users through FloodDetector at --rate (default 10k/sec)")
+    parser.add_argument('--image-memory', action='store_true', help="measure peak allocation of image decoding and upload")
+    parser.add_argument('--entities', type=int, default=0, help="benchmark entity extraction on this many long messages per mix")
+    parser.add_argument('--lexicon', type=int, default=0, help="benchmark keyword matching on lexicons of 20 up to this many terms")
+    parser.add_argument('--faq', type=int, default=0, help="benchmark a FAQ index of this many entries")
+    parser.add_argument('--shards', type=int, default=1, help="replay in one process per shard with shared state")
+    parser.add_argument('--state-url', help="shared state URL, e.g. redis://127.0.0.1:6379")
+    parser.add_argument('--shard-index', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help="write results as JSON to this path")
+    parser.add_argument('--compare', help="previous results file to compare against")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.WARNING)
+    ai_integration.logger.setLevel(logging.ERROR)
+    
+    if args.startup:
+        results = measure_startup()
+        for mode, stats in results.items():
+            print(f"features {mode}: import {stats['import_ms']:.1f}ms, init {stats['init_ms']:.1f}ms, "
+                  f"cog_load {stats['load_ms']:.1f}ms, RSS +{stats['rss_growth_bytes'] / 2**20:.1f} MiB")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    
+    if args.rules:
+        corpus = synthetic_corpus(args.rules, args.users, args.channels, args.seed)
+        results = [measure_rules(corpus, extra) for extra in (0, 50)]
+        for run in results:
+            print(f"{run['messages']} messages, {run['rules']} rules: "
+                  f"per-pattern {run['per_pattern']['msgs_per_sec']} msgs/sec, "
+                  f"compiled {run['compiled']['msgs_per_sec']} msgs/sec ({run['speedup']}x), "
+                  f"{run['mismatches']} mismatches")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return 1 if any(run['mismatches'] for run in results) else 0
+    
+    if args.flood:
+        corpus = synthetic_corpus(args.flood, 100000, args.channels, args.seed)
+        results = measure_flood(corpus, args.rate or 10000)
+        observe = results['observe']
+        print(f"{results['messages']} messages from {results['users']} users at {results['msgs_per_sec']} msgs/sec "
+              f"(target {results['target_rate']:g}): observe p50={observe['p50_ms']}ms p99={observe['p99_ms']}ms "
+              f"max={observe['max_ms']}ms, detector busy {results['busy_fraction']:.0%}")
+        print(f"  tracked users: peak {results['peak_tracked_users']}, final {results['tracked']['users']}; "
+              f"violations: {results['violations']}")
+        if results['peak_rss_bytes']:
+            print(f"  peak RSS: {results['peak_rss_bytes'] / 2**20:.1f} MiB")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    
+    if args.image_memory:
+        results = asyncio.run(measure_image_memory([512, 1024, 2048]))
+        for run in results:
+            print(f"{run['side']}x{run['side']}: {run['png_bytes'] / 2**20:.2f} MiB PNG in a "
+                  f"{run['response_bytes'] / 2**20:.2f} MiB response; decoder peak "
+                  f"{run['decoder_peak_bytes'] / 2**20:.2f} MiB ({run['decoder_peak_ratio']}x the PNG)")
+            for upload_format, stats in run['formats'].items():
+                print(f"  generate + upload as {upload_format}: peak {stats['peak_bytes'] / 2**20:.2f} MiB "
+                      f"({stats['peak_ratio']}x), uploaded {stats['uploaded_bytes'] / 2**20:.2f} MiB")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    
+    if args.entities:
+        results = measure_entities(args.entities, seed=args.seed)
+        print(f"{results['messages']} messages of {results['length']} chars per mix, per message:")
+        for name in ('prose', 'chatty', 'entities'):
+            run = results[name]
+            print(f"  {name} ({run['spans']} spans): four-pass {run['four_pass_us']}us, "
+                  f"single scan {run['scan_us']}us, cached {run['cached_us']}us")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    
+    if args.lexicon:
+        corpus = synthetic_corpus(2000, args.users, args.channels, args.seed)
+        results = measure_lexicon(corpus, args.lexicon, args.seed)
+        for run in results:
+            print(f"{run['terms']} terms (built in {run['build_ms']}ms): "
+                  f"keyword index {run['index']['msgs_per_sec']} msgs/sec, "
+                  f"substring scans {run['substring']['msgs_per_sec']} msgs/sec")
+        first, last = results[0]['index']['msgs_per_sec'], results[-1]['index']['msgs_per_sec']
+        print(f"keyword index throughput at {results[-1]['terms']} terms: {last / first:.0%} of {results[0]['terms']} terms")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    
+    if args.faq:
+        results = asyncio.run(measure_faq(args.faq, seed=args.seed))
+        print(f"FAQ index of {results['entries']} entries: built in {results['build_s']}s, "
+              f"{results['file_bytes'] / 2**20:.1f} MiB on disk, reopened in {results['open_ms']}ms, "
+              f"recall@1 {results['recall_at_1']:.0%}")
+        for batch_size, stats in results['search'].items():
+            print(f"  search batch {batch_size}: p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms "
+                  f"per query {stats['per_query_ms']}ms")
+        responder = results['responder']
+        print(f"  responder: {responder['count']} concurrent lookups in {responder['searches']} searches, "
+              f"p50={responder['p50_ms']}ms p99={responder['p99_ms']}ms ({responder['queries_per_sec']}/sec)")
+        if results['peak_rss_bytes']:
+            print(f"  peak RSS: {results['peak_rss_bytes'] / 2**20:.1f} MiB")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    
+    if args.corpus:
+        corpus = load_corpus(args.corpus, args.users, args.channels, args.seed)
+    else:
+        corpus = synthetic_corpus(args.synthetic, args.users, args.channels, args.seed)
+    
+    if args.shards > 1 and args.shard_index is None:
+        results = asyncio.run(run_shards(args, corpus))
+        print(f"{results['messages']} messages on {args.shards} shards in {results['elapsed_s']}s "
+              f"({results['msgs_per_sec']} msgs/sec)")
+        for index, shard in enumerate(results['shards']):
+            caches = shard['shared_state']['near_cache']
+            print(f"  shard {index}: {shard['messages']} messages, {shard['msgs_per_sec']} msgs/sec, "
+                  f"on_message p99={shard['stages']['on_message']['p99_ms']}ms, "
+                  f"state digest {shard['shared_state']['digest']}, "
+                  + ", ".join(f"{name} hits={cache['hits']} misses={cache['misses']}" for name, cache in caches.items()))
+        print(f"  stand-in digest {results['stored_digest']} ({results['stored_strikes']} strikes, "
+              f"{results['standin_commands']} commands): {'agree' if results['agree'] else 'DISAGREE'}")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return 0 if results['agree'] else 1
+    if args.shard_index is not None:
+        users = sorted({record['user'] for record in corpus})
+        corpus = [record for record in corpus if shard_of(record, args.guilds, args.shards) == args.shard_index]
+        results = asyncio.run(run_benchmark(args, corpus, check_users=users))
+    else:
+        results = asyncio.run(run_benchmark(args, corpus))
+    
+    print(f"{results['messages']} messages in {results['elapsed_s']}s ({results['msgs_per_sec']} msgs/sec)")
+    for stage, stats in results['stages'].items():
+        if stats.get('count'):
+            print(f"  {stage}: n={stats['count']} p50={stats.get('p50_ms')}ms p95={stats.get('p95_ms')}ms p99={stats.get('p99_ms')}ms")
+    if results['memory'].get('peak_rss_bytes'):
+        print(f"  peak RSS: {results['memory']['peak_rss_bytes'] / 2**20:.1f} MiB")
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            for line in compare(results, json.load(f)):
+                print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
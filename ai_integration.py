@@ -7,186 +7,4258 @@ import discord
 from discord.ext import commands
 import asyncio
 import aiohttp
-from typing import Optional, List, Dict, Any
+from typing import TYPE_CHECKING, Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, Iterable, NamedTuple
+import bisect
+import binascii
+import codecs
+import concurrent.futures
+import hashlib
+import importlib
+import heapq
+import io
+import itertools
 import json
 import logging
-from datetime import datetime
+import os
+import random
 import re
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    # Optional or heavy imports, loaded lazily where they are used
+    import sqlite3
+    
+    import numpy as np
+    from aiohttp import web
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class AIConfig:
-    """Configuration for AI services"""
+class AIConfig:
+    """Configuration for AI services"""
+    
+    def __init__(self):
+        self.openai_api_key = ""
+        self.huggingface_api_key = ""
+        self.stability_api_key = ""
+        self.moderation_threshold = 0.7
+        self.enable_auto_response = True
+        self.enable_image_generation = True
+        self.enable_ai_moderation = True
+        self.response_cooldown = 5  # seconds
+        self.max_tokens = 150
+        self.context_window = 2048  # tokens available to prompt plus reply
+        self.summary_tokens = 200
+        self.openai_base_url = "https://api.openai.com/v1"
+        self.openai_model = "gpt-4o-mini"
+        self.stream_edit_interval = 1.0  # seconds between progressive message edits
+        self.delivery_mode = 'auto'  # 'auto', 'text', 'embed' or 'file' for long responses
+        self.delivery_max_messages = 3  # messages 'auto' allows before packing denser
+        self.channel_send_rate = 1.0  # messages per second per channel
+        self.channel_send_burst = 5
+        self.moderation_workers = 2
+        self.moderation_batch_size = 32
+        self.moderation_queue_size = 1000
+        self.moderation_backpressure = 'drop'  # 'drop' or 'degrade'
+        self.enforcement_workers = 2
+        self.state_max_entries = 100000
+        self.warning_decay = 3600  # seconds per forgiven strike
+        self.cooldown_ttl = 300  # seconds
+        self.conversation_max_users = 10000
+        self.conversation_ttl = 3600  # seconds
+        self.state_db_path = ""  # SQLite file for persistent state, empty to disable
+        self.state_flush_interval = 1.0  # seconds
+        self.shared_state_url = ""  # redis://host:port/db or memory://, empty keeps state per process
+        self.shared_state_prefix = "discord_ai"  # key prefix shared by cooperating processes
+        self.shared_state_flush_delay = 0.002  # seconds writes are coalesced before a round trip
+        self.http_connection_limit = 100
+        self.http_per_host_limit = 8
+        self.http_max_retries = 3
+        self.http_breaker_threshold = 5
+        self.http_breaker_reset = 30  # seconds
+        self.image_cache_memory_bytes = 64 * 1024 * 1024
+        self.image_cache_dir = ""  # on-disk image cache, empty to disable
+        self.image_cache_disk_bytes = 512 * 1024 * 1024
+        self.image_max_concurrency = 2
+        self.image_per_guild_concurrency = 1
+        self.image_queue_size = 50
+        self.image_job_timeout = 90  # seconds
+        self.image_upload_format = 'png'  # 'png', 'webp' or 'jpeg' (re-encoding needs Pillow)
+        self.image_upload_quality = 85
+        self.analysis_workers = 0  # analysis processes (opt-in), needs a __main__ guard, see TextAnalysisExecutor
+        self.analysis_inline_chars = 1000  # shorter texts skip the process pool
+        self.analysis_batch_size = 32
+        self.analysis_batch_delay = 0.005  # seconds
+        self.loop_lag_interval = 0.25  # seconds
+        self.flood_window = 10.0  # seconds
+        self.flood_max_messages = 6  # per user per window
+        self.flood_max_duplicates = 3  # near-identical messages per user per window
+        self.raid_duplicates = 5  # near-identical messages per channel per window
+        self.classifier_url = ""  # OpenAI-compatible /moderations endpoint, empty to disable
+        self.classifier_model = "omni-moderation-latest"
+        self.classifier_batch_size = 32
+        self.classifier_batch_delay = 0.05  # seconds
+        self.classifier_timeout = 2.0  # seconds before falling back to heuristics
+        self.classifier_cache_size = 50000
+        self.classifier_max_in_flight = 8  # requests before new texts skip the classifier
+        self.entity_cache_size = 10000  # messages whose extracted entities are kept
+        self.lexicon_path = ""  # keyword lexicon file loaded at startup and appended to by !ai_lexicon
+        self.faq_index_path = ""  # FAQ vector file (requires NumPy), empty to disable
+        self.faq_dimensions = 256
+        self.faq_embedder = ""  # "module:factory" called with faq_dimensions, empty for HashingEmbedder
+        self.faq_threshold = 0.6  # cosine similarity an answer needs
+        self.faq_top_k = 3
+        self.faq_batch_size = 32
+        self.faq_batch_delay = 0.005  # seconds
+        self.metrics_host = "127.0.0.1"
+        self.metrics_port = 0  # Prometheus endpoint port, 0 to disable
+        self.profile_path = "ai_profile.folded"  # collapsed stacks written by !ai_profile
+        self.profile_interval = 0.01  # seconds between stack samples
+        self.guild_config_path = ""  # JSON file of per-guild settings, empty to disable
+        self.guild_config_poll_interval = 2.0  # seconds
+
+
+def _parse_bool(value: Any) -> bool:
+    """Accept JSON booleans or the strings true/false"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    raise ValueError(f"Expected true or false, got {value!r}")
+
+
+class GuildSettings(NamedTuple):
+    """Immutable per-guild settings snapshot"""
+    
+    enable_auto_response: bool = True
+    enable_image_generation: bool = True
+    enable_ai_moderation: bool = True
+    moderation_threshold: float = 0.7
+    response_cooldown: int = 5  # seconds
+    
+    @classmethod
+    def from_config(cls, config: AIConfig) -> 'GuildSettings':
+        """Take defaults from the global configuration"""
+        return cls(**{name: getattr(config, name) for name in cls._fields})
+    
+    def updated(self, values: Dict[str, Any]) -> 'GuildSettings':
+        """
+        Return a copy with ``values`` parsed and applied
+        
+        Raises:
+            KeyError: If a setting name is unknown
+            ValueError: If a value cannot be parsed
+        """
+        changes = {}
+        for name, value in values.items():
+            if name not in self._fields:
+                raise KeyError(name)
+            changes[name] = GUILD_SETTING_PARSERS[name](value)
+        return self._replace(**changes)
+
+
+GUILD_SETTING_PARSERS: Dict[str, Callable[[Any], Any]] = {
+    'enable_auto_response': _parse_bool,
+    'enable_image_generation': _parse_bool,
+    'enable_ai_moderation': _parse_bool,
+    'moderation_threshold': float,
+    'response_cooldown': int,
+}
+
+
+class GuildConfigStore:
+    """
+    Per-guild settings with copy-on-write snapshots and file hot reload
+    
+    Readers get an immutable GuildSettings from the current snapshot without
+    locking; every change builds a new mapping and swaps it in with a single
+    assignment, bumping ``version``. When ``path`` is set the store is loaded
+    from that JSON file, polled for changes, and rewritten on updates::
+    
+        {"defaults": {"moderation_threshold": 0.8},
+         "guilds": {"1234": {"enable_auto_response": false}}}
+    """
+    
+    def __init__(self, defaults: GuildSettings, path: str = "", poll_interval: float = 2.0):
+        self.base = defaults
+        self.path = path
+        self.poll_interval = poll_interval
+        self.version = 0
+        self._default = defaults
+        self._overrides: Dict[int, Dict[str, Any]] = {}
+        # (per-guild settings, default settings), replaced as a unit
+        self._snapshot: tuple = ({}, defaults)
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'reloads': 0, 'reload_errors': 0, 'updates': 0}
+    
+    def get(self, guild_id: Optional[int]) -> GuildSettings:
+        """Settings for a guild (the defaults for DMs or unconfigured guilds)"""
+        guilds, default = self._snapshot
+        return guilds.get(guild_id, default)
+    
+    def update(self, guild_id: int, values: Dict[str, Any]) -> GuildSettings:
+        """
+        Apply setting changes to one guild and publish a new snapshot
+        
+        Raises:
+            KeyError: If a setting name is unknown
+            ValueError: If a value cannot be parsed
+        """
+        with self._lock:
+            settings = self.get(guild_id).updated(values)
+            overrides = dict(self._overrides)
+            overrides[guild_id] = {
+                **overrides.get(guild_id, {}),
+                **{name: getattr(settings, name) for name in values}
+            }
+            self._publish(self._default, overrides)
+            self.stats['updates'] += 1
+            return settings
+    
+    def load(self) -> bool:
+        """
+        (Re)load the config file if it changed since the last load
+        
+        A file that fails to parse is logged and the current snapshot kept.
+        
+        Returns:
+            True if a new snapshot was published
+        """
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            default = self.base.updated(data.get('defaults', {}))
+            overrides = {}
+            for guild_id, values in data.get('guilds', {}).items():
+                # Validate now so a bad entry rejects the whole file
+                default.updated(values)
+                overrides[int(guild_id)] = dict(values)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self._mtime = mtime
+            self.stats['reload_errors'] += 1
+            logger.error(f"Error loading guild config {self.path}: {e}")
+            return False
+        
+        with self._lock:
+            self._mtime = mtime
+            self._publish(default, overrides)
+            self.stats['reloads'] += 1
+        logger.info(f"Loaded guild config v{self.version} ({len(overrides)} guilds)")
+        return True
+    
+    def save(self):
+        """Write the current settings back to the config file atomically"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                'defaults': {
+                    name: value for name, value in self._default._asdict().items()
+                    if value != getattr(self.base, name)
+                },
+                'guilds': {str(guild_id): values for guild_id, values in self._overrides.items()},
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+    
+    def _publish(self, default: GuildSettings, overrides: Dict[int, Dict[str, Any]]):
+        """Build a fresh snapshot and swap it in"""
+        snapshot = {guild_id: default.updated(values) for guild_id, values in overrides.items()}
+        self._overrides = overrides
+        self._default = default
+        self._snapshot = (snapshot, default)
+        self.version += 1
+    
+    def start(self):
+        """Load the config file and start watching it for changes"""
+        if self.path and self._task is None:
+            self.load()
+            self._task = asyncio.create_task(self._watch())
+    
+    async def _watch(self):
+        """Poll the config file and reload it off the event loop when it changes"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception as e:
+                logger.error(f"Error watching guild config: {e}")
+    
+    async def stop(self):
+        """Stop watching the config file"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class _StateEntry:
+    """Slot-only value holder for StateStore"""
+    
+    __slots__ = ('value', 'stamp')
+    
+    def __init__(self, value: Any, stamp: float):
+        self.value = value
+        self.stamp = stamp
+
+
+class StateStore:
+    """
+    Bounded per-key state with LRU and idle-time (TTL) eviction
+    
+    Entries expire once they have not been read or written for ``ttl``
+    seconds, and the least recently used entry is evicted whenever the store
+    grows past ``max_entries``. Timestamps come from ``time.monotonic``.
+    An optional ``loader`` is called on a miss to fetch the value lazily
+    (e.g. from StatePersistence); it returns None when there is nothing.
+    ``fetch`` runs the loader in a worker thread, so callers on the event
+    loop should fetch a key before reading it with ``get``.
+    """
+    
+    _MISSING = object()
+    
+    def __init__(
+        self,
+        max_entries: int = 100000,
+        ttl: Optional[float] = None,
+        loader: Optional[Callable[[Any], Any]] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.loader = loader
+        self._entries: OrderedDict = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Return the value for key, refreshing its recency"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._load(key, default)
+        now = time.monotonic()
+        if self.ttl is not None and now - entry.stamp > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            return default
+        entry.stamp = now
+        self._entries.move_to_end(key)
+        return entry.value
+    
+    async def fetch(self, key: Any, default: Any = None) -> Any:
+        """Awaitable get; a miss runs the loader in a worker thread (SharedStateStore reads the backend)"""
+        if self.loader is None or key in self._entries:
+            return self.get(key, default)
+        value = await asyncio.to_thread(self.loader, key)
+        if key in self._entries:
+            # Written while the loader ran; the newer value wins
+            return self.get(key, default)
+        if value is None:
+            return default
+        self.set(key, value)
+        return value
+    
+    def _load(self, key: Any, default: Any) -> Any:
+        """Fill a miss from the loader, if one is configured"""
+        if self.loader is None:
+            return default
+        value = self.loader(key)
+        if value is None:
+            return default
+        self.set(key, value)
+        return value
+    
+    def set(self, key: Any, value: Any):
+        """Store value for key, evicting expired or excess entries"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.value = value
+            entry.stamp = now
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = _StateEntry(value, now)
+        self._evict(now)
+    
+    def pop(self, key: Any, default: Any = None) -> Any:
+        """Remove key and return its value"""
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry.value
+    
+    def _evict(self, now: float):
+        """Drop expired entries from the LRU end, then enforce the size cap"""
+        entries = self._entries
+        if self.ttl is not None:
+            while entries:
+                oldest = next(iter(entries.values()))
+                if now - oldest.stamp <= self.ttl:
+                    break
+                entries.popitem(last=False)
+                self.expirations += 1
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        """Remove all entries"""
+        self._entries.clear()
+    
+    def is_cached(self, key: Any) -> bool:
+        """True if ``get(key)`` is answered from memory, without calling the loader"""
+        return key in self._entries
+    
+    def report(self) -> Dict[str, int]:
+        """Size and eviction counters"""
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+    
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, self._MISSING) is not self._MISSING
+    
+    def __getitem__(self, key: Any) -> Any:
+        value = self.get(key, self._MISSING)
+        if value is self._MISSING:
+            raise KeyError(key)
+        return value
+    
+    def __setitem__(self, key: Any, value: Any):
+        self.set(key, value)
+    
+    def __delitem__(self, key: Any):
+        del self._entries[key]
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class StatePersistence:
+    """
+    Crash-safe, write-behind SQLite storage for per-user state
+    
+    Writes are coalesced in memory (last write per key wins) and committed by
+    a background thread in batched transactions, so callers on the event loop
+    never wait on disk. The database runs in WAL mode; a crash loses at most
+    the batch that had not been committed yet, and a batch that fails to
+    commit is queued again behind newer writes. Reads are lazy point lookups
+    that check pending writes first. After ``warm`` the stored keys are
+    known in memory, so lookups of keys that were never saved (most users)
+    skip SQLite entirely.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS state (
+            namespace TEXT NOT NULL,
+            key INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+    """
+    
+    def __init__(self, path: str, flush_interval: float = 1.0, batch_size: int = 500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending: Dict[tuple, Optional[str]] = {}
+        self._inflight: Dict[tuple, Optional[str]] = {}
+        self._keys: Optional[set] = None
+        self._journal: Optional[List[tuple]] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._closed = False
+        self.stats = {
+            'writes': 0,
+            'coalesced': 0,
+            'committed': 0,
+            'transactions': 0,
+            'loads': 0,
+            'skipped_loads': 0,
+            'requeued': 0,
+            'errors': 0,
+        }
+        
+        self._reader = self._connect()
+        self._reader.execute(self.SCHEMA)
+        self._reader.commit()
+        self._reader_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="ai-state-writer", daemon=True)
+        self._thread.start()
+    
+    def _connect(self) -> 'sqlite3.Connection':
+        """Open a connection configured for WAL and relaxed fsync"""
+        import sqlite3
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def save(self, namespace: str, key: int, value: Any):
+        """Queue a JSON-serializable value for writing"""
+        self._queue((namespace, key), json.dumps(value, separators=(',', ':')))
+    
+    def delete(self, namespace: str, key: int):
+        """Queue removal of a key"""
+        self._queue((namespace, key), None)
+    
+    def _queue(self, item: tuple, payload: Optional[str]):
+        with self._lock:
+            if item in self._pending:
+                self.stats['coalesced'] += 1
+            self._pending[item] = payload
+            self._track(item, payload)
+            self.stats['writes'] += 1
+            self._idle.clear()
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+    
+    def _track(self, item: tuple, payload: Optional[str]):
+        """Keep the key index current; called with the lock held"""
+        if self._journal is not None:
+            self._journal.append((item, payload))
+        if self._keys is not None:
+            if payload is None:
+                self._keys.discard(item)
+            else:
+                self._keys.add(item)
+    
+    def warm(self):
+        """
+        Read every stored key into memory so misses skip SQLite
+        
+        Blocks on disk; run it in a worker thread. Writes queued meanwhile
+        are journaled and applied on top of the snapshot.
+        """
+        with self._lock:
+            # Queued writes may commit after the snapshot below is taken
+            self._journal = list(self._inflight.items()) + list(self._pending.items())
+        with self._reader_lock:
+            keys = set(self._reader.execute("SELECT namespace, key FROM state"))
+        with self._lock:
+            for item, payload in self._journal:
+                if payload is None:
+                    keys.discard(item)
+                else:
+                    keys.add(item)
+            self._journal = None
+            self._keys = keys
+    
+    def load(self, namespace: str, key: int) -> Any:
+        """Read a value, preferring writes that have not been flushed yet"""
+        with self._lock:
+            for writes in (self._pending, self._inflight):
+                if (namespace, key) in writes:
+                    payload = writes[(namespace, key)]
+                    return None if payload is None else json.loads(payload)
+            if self._keys is not None and (namespace, key) not in self._keys:
+                self.stats['skipped_loads'] += 1
+                return None
+        with self._reader_lock:
+            row = self._reader.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+        self.stats['loads'] += 1
+        return json.loads(row[0]) if row else None
+    
+    def _run(self):
+        """Writer thread: commit coalesced batches until closed"""
+        conn = self._connect()
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+                closed = self._closed
+            if batch:
+                self._commit(conn, list(batch.items()))
+            with self._lock:
+                self._inflight = {}
+                if not self._pending:
+                    self._idle.set()
+                elif closed:
+                    logger.error(f"Closing with {len(self._pending)} state writes that could not be committed")
+            if closed:
+                break
+        conn.close()
+    
+    def _commit(self, conn: 'sqlite3.Connection', items: List[tuple]):
+        """Write items in transactions of at most ``batch_size`` rows"""
+        import sqlite3
+        now = time.time()
+        for start in range(0, len(items), self.batch_size):
+            chunk = items[start:start + self.batch_size]
+            try:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT INTO state (namespace, key, value, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+                    [(ns, key, payload, now) for (ns, key), payload in chunk if payload is not None]
+                )
+                conn.executemany(
+                    "DELETE FROM state WHERE namespace = ? AND key = ?",
+                    [(ns, key) for (ns, key), payload in chunk if payload is None]
+                )
+                conn.execute("COMMIT")
+                self.stats['committed'] += len(chunk)
+                self.stats['transactions'] += 1
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self.stats['errors'] += 1
+                logger.error(f"Error persisting state batch, retrying: {e}")
+                with self._lock:
+                    # Newer writes queued since the batch was taken supersede it
+                    for item, payload in chunk:
+                        if item not in self._pending:
+                            self._pending[item] = payload
+                            self.stats['requeued'] += 1
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until all queued writes are committed"""
+        self._wakeup.set()
+        return self._idle.wait(timeout)
+    
+    def close(self):
+        """Flush pending writes and stop the writer thread"""
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        with self._reader_lock:
+            self._reader.close()
+
+
+class SharedStateBackend(ABC):
+    """
+    Key-value storage shared by every bot process
+    
+    Values are JSON strings stored under ``<prefix>:<namespace>:<key>``.
+    Every write also publishes the written keys on ``<prefix>:invalidate``,
+    so SharedStateStore near-caches in other processes drop their copies.
+    """
+    
+    def __init__(self, prefix: str = "discord_ai"):
+        self.prefix = prefix
+        self.channel = f"{prefix}:invalidate"
+        self._stores: Dict[str, List['SharedStateStore']] = {}
+        self.stats = {'reads': 0, 'writes': 0, 'round_trips': 0, 'invalidations': 0, 'errors': 0}
+    
+    @staticmethod
+    def from_url(url: str, prefix: str = "discord_ai") -> Optional['SharedStateBackend']:
+        """
+        Build a backend from a URL
+        
+        Args:
+            url: ``redis://[:password@]host[:port][/db]``, ``memory://``, or empty for none
+            prefix: Key and channel prefix shared by cooperating processes
+            
+        Returns:
+            A backend, or None when state stays in each process
+        """
+        if not url:
+            return None
+        parts = urlsplit(url)
+        if parts.scheme == 'memory':
+            return InMemoryStateBackend(prefix)
+        if parts.scheme == 'redis':
+            return RESPStateBackend(
+                host=parts.hostname or '127.0.0.1',
+                port=parts.port or 6379,
+                db=int(parts.path.strip('/') or 0),
+                password=parts.password,
+                prefix=prefix
+            )
+        raise ValueError(f"Unsupported shared state URL: {url}")
+    
+    def key(self, namespace: str, key: Any) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+    
+    def attach(self, store: 'SharedStateStore'):
+        """Register a store to receive invalidations for its namespace"""
+        self._stores.setdefault(store.namespace, []).append(store)
+    
+    async def start(self):
+        """Begin receiving invalidations"""
+    
+    @abstractmethod
+    async def read(self, namespace: str, keys: List[Any]) -> List[Optional[str]]:
+        """Fetch payloads for keys in one round trip, None where missing"""
+    
+    @abstractmethod
+    async def write(self, namespace: str, items: Dict[Any, Optional[str]], ttl: Optional[float], source: str):
+        """Store payloads (None deletes) and publish their invalidation in one round trip"""
+    
+    def _invalidation(self, namespace: str, keys: Iterable[Any], source: str) -> str:
+        return json.dumps([source, namespace, list(keys)], separators=(',', ':'))
+    
+    def _dispatch(self, message: Any):
+        """Apply an invalidation published by another store"""
+        try:
+            source, namespace, keys = json.loads(message)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Ignoring malformed state invalidation: {e}")
+            return
+        for store in self._stores.get(namespace, ()):
+            if store.node != source:
+                store.invalidate(keys)
+                self.stats['invalidations'] += 1
+    
+    def _drop_caches(self):
+        """Forget every near-cached value, e.g. after missing invalidations"""
+        for stores in self._stores.values():
+            for store in stores:
+                store.clear()
+    
+    async def close(self):
+        """Flush pending writes from attached stores"""
+        for stores in self._stores.values():
+            for store in stores:
+                await store.flush()
+    
+    def report(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+
+class InMemoryStateBackend(SharedStateBackend):
+    """SharedStateBackend for a single process (and for exercising the near-cache)"""
+    
+    def __init__(self, prefix: str = "discord_ai"):
+        super().__init__(prefix)
+        self._data: Dict[str, tuple] = {}
+    
+    async def read(self, namespace: str, keys: List[Any]) -> List[Optional[str]]:
+        now = time.monotonic()
+        payloads = []
+        for key in keys:
+            item = self._data.get(self.key(namespace, key))
+            if item is not None and item[1] is not None and item[1] <= now:
+                del self._data[self.key(namespace, key)]
+                item = None
+            payloads.append(None if item is None else item[0])
+        self.stats['reads'] += len(keys)
+        self.stats['round_trips'] += 1
+        return payloads
+    
+    async def write(self, namespace: str, items: Dict[Any, Optional[str]], ttl: Optional[float], source: str):
+        expires = time.monotonic() + ttl if ttl else None
+        for key, payload in items.items():
+            if payload is None:
+                self._data.pop(self.key(namespace, key), None)
+            else:
+                self._data[self.key(namespace, key)] = (payload, expires)
+        self.stats['writes'] += len(items)
+        self.stats['round_trips'] += 1
+        self._dispatch(self._invalidation(namespace, items, source))
+
+
+class RESPError(Exception):
+    """Error reply from a RESP server"""
+
+
+class RESPStateBackend(SharedStateBackend):
+    """
+    SharedStateBackend on a Redis-compatible server, spoken in plain RESP2
+    
+    Commands from concurrent callers are written back to back on one
+    connection and matched to replies in order (pipelining), so a batch of
+    reads or writes costs a single round trip. A second connection stays
+    subscribed to the invalidation channel; whenever it has to reconnect,
+    attached near-caches are dropped since invalidations may have been missed.
+    """
+    
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        prefix: str = "discord_ai",
+        timeout: float = 1.0
+    ):
+        super().__init__(prefix)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._replies: deque = deque()
+        self._receiver: Optional[asyncio.Task] = None
+        self._subscriber: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.stats['connects'] = 0
+    
+    @staticmethod
+    def encode(*args: Any) -> bytes:
+        """Encode one command as a RESP array of bulk strings"""
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+    
+    @classmethod
+    async def read_reply(cls, reader: asyncio.StreamReader) -> Any:
+        """Parse one RESP2 reply; error replies are returned as RESPError"""
+        line = await reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("State server closed the connection")
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode()
+        if kind == b'-':
+            return RESPError(body.decode())
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            return (await reader.readexactly(length + 2))[:-2]
+        if kind == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [await cls.read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected RESP reply: {line[:32]!r}")
+    
+    async def _open(self) -> tuple:
+        """Connect, authenticate and select the database"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port),
+            self.timeout
+        )
+        setup = []
+        if self.password:
+            setup.append(self.encode('AUTH', self.password))
+        if self.db:
+            setup.append(self.encode('SELECT', self.db))
+        if setup:
+            writer.write(b''.join(setup))
+            for _ in setup:
+                reply = await asyncio.wait_for(self.read_reply(reader), self.timeout)
+                if isinstance(reply, RESPError):
+                    writer.close()
+                    raise reply
+        return reader, writer
+    
+    async def execute(self, *commands: tuple) -> List[Any]:
+        """
+        Send commands in one write and wait for all their replies
+        
+        Args:
+            commands: Command tuples, e.g. ('GET', key)
+            
+        Returns:
+            Replies in command order
+        """
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            if self._writer is None:
+                try:
+                    self._reader, self._writer = await self._open()
+                except Exception:
+                    self.stats['errors'] += 1
+                    raise
+                self._receiver = loop.create_task(self._receive(self._reader))
+                self.stats['connects'] += 1
+            waiters = [loop.create_future() for _ in commands]
+            self._replies.extend(waiters)
+            self._writer.write(b''.join(self.encode(*command) for command in commands))
+            await self._writer.drain()
+        self.stats['round_trips'] += 1
+        try:
+            replies = await asyncio.wait_for(asyncio.gather(*waiters), self.timeout)
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        for reply in replies:
+            if isinstance(reply, RESPError):
+                self.stats['errors'] += 1
+                raise reply
+        return replies
+    
+    async def _receive(self, reader: asyncio.StreamReader):
+        """Resolve pending commands with replies, in order"""
+        try:
+            while True:
+                reply = await self.read_reply(reader)
+                waiter = self._replies.popleft()
+                if not waiter.done():
+                    waiter.set_result(reply)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+            logger.error(f"Shared state connection lost: {e}")
+        finally:
+            if self._reader is reader:
+                self._writer.close()
+                self._reader = self._writer = None
+            while self._replies:
+                waiter = self._replies.popleft()
+                if not waiter.done():
+                    waiter.set_exception(ConnectionError("Shared state connection lost"))
+    
+    async def read(self, namespace: str, keys: List[Any]) -> List[Optional[str]]:
+        (payloads,) = await self.execute(('MGET', *(self.key(namespace, key) for key in keys)))
+        self.stats['reads'] += len(keys)
+        return [None if payload is None else payload.decode() for payload in payloads]
+    
+    async def write(self, namespace: str, items: Dict[Any, Optional[str]], ttl: Optional[float], source: str):
+        commands = []
+        for key, payload in items.items():
+            if payload is None:
+                commands.append(('DEL', self.key(namespace, key)))
+            elif ttl:
+                commands.append(('SET', self.key(namespace, key), payload, 'PX', int(ttl * 1000)))
+            else:
+                commands.append(('SET', self.key(namespace, key), payload))
+        commands.append(('PUBLISH', self.channel, self._invalidation(namespace, items, source)))
+        await self.execute(*commands)
+        self.stats['writes'] += len(items)
+    
+    async def start(self):
+        if self._subscriber is None:
+            self._subscriber = asyncio.create_task(self._subscribe())
+    
+    async def _subscribe(self):
+        """Listen for invalidations, reconnecting with backoff"""
+        delay = 0.1
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._open()
+                writer.write(self.encode('SUBSCRIBE', self.channel))
+                await writer.drain()
+                delay = 0.1
+                while True:
+                    reply = await self.read_reply(reader)
+                    if not isinstance(reply, list):
+                        continue
+                    if reply[0] == b'message':
+                        self._dispatch(reply[2])
+                    elif reply[0] == b'subscribe':
+                        # Anything cached before now may have missed an invalidation
+                        self._drop_caches()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Shared state subscription lost: {e}")
+            finally:
+                if writer is not None:
+                    writer.close()
+            self._drop_caches()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+    
+    async def close(self):
+        await super().close()
+        for task in (self._subscriber, self._receiver):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._subscriber = self._receiver = None
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+class SharedStateStore(StateStore):
+    """
+    StateStore whose entries are a near-cache over a SharedStateBackend
+    
+    Synchronous reads only see local entries, so the hot path stays in
+    memory; ``fetch`` fills misses from the backend, batching concurrent
+    misses into one round trip and remembering keys the backend does not
+    have. Writes apply locally at once and are coalesced into a pipelined
+    write a moment later, which invalidates the key in every other process.
+    Concurrent read-modify-write cycles in two processes resolve as last
+    write wins.
+    
+    ``encode`` and ``decode`` convert values to and from JSON-compatible
+    data; monotonic timestamps must go through ``to_wall``/``from_wall``
+    because each process has its own monotonic clock.
+    """
+    
+    _DELETED = object()
+    
+    def __init__(
+        self,
+        backend: SharedStateBackend,
+        namespace: str,
+        max_entries: int = 100000,
+        ttl: Optional[float] = None,
+        loader: Optional[Callable[[Any], Any]] = None,
+        encode: Callable[[Any], Any] = lambda value: value,
+        decode: Callable[[Any], Any] = lambda data: data,
+        flush_delay: float = 0.002
+    ):
+        super().__init__(max_entries=max_entries, ttl=ttl, loader=loader)
+        self.backend = backend
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+        self.flush_delay = flush_delay
+        self.node = f"{os.getpid()}-{id(self):x}"
+        self._absent = StateStore(max_entries=max_entries, ttl=ttl)
+        self._reads: Dict[Any, asyncio.Future] = {}
+        self._inflight: List[tuple] = []
+        self._writes: Dict[Any, Any] = {}
+        self._flushing: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+        self.stats = {'hits': 0, 'misses': 0, 'remote_writes': 0, 'invalidations': 0, 'errors': 0}
+        backend.attach(self)
+    
+    @staticmethod
+    def to_wall(stamp: float) -> float:
+        """Convert a time.monotonic stamp to wall-clock time"""
+        return time.time() - (time.monotonic() - stamp)
+    
+    @staticmethod
+    def from_wall(stamp: float) -> float:
+        """Convert a wall-clock time to this process's time.monotonic"""
+        return time.monotonic() - (time.time() - stamp)
+    
+    async def fetch(self, key: Any, default: Any = None) -> Any:
+        """Return the value for key, reading through to the backend on a miss"""
+        if key in self._entries or key in self._absent:
+            self.stats['hits'] += 1
+            return self.get(key, default)
+        self.stats['misses'] += 1
+        waiter = self._reads.get(key)
+        if waiter is None:
+            loop = asyncio.get_running_loop()
+            if not self._reads:
+                # Misses from the same loop iteration join this read
+                task = loop.create_task(self._read())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            waiter = self._reads[key] = loop.create_future()
+        value = await asyncio.shield(waiter)
+        if value is self._MISSING:
+            return await StateStore.fetch(self, key, default)
+        return value
+    
+    async def _read(self):
+        """Fill every pending miss with one backend read"""
+        batch, self._reads = self._reads, {}
+        # Keys invalidated or deleted while the read is in flight get stale replies
+        stale: set = set()
+        self._inflight.append((batch, stale))
+        try:
+            payloads = await self.backend.read(self.namespace, list(batch))
+        except Exception as e:
+            logger.error(f"Error reading shared state: {e}")
+            self.stats['errors'] += 1
+            payloads = [self._MISSING] * len(batch)
+        finally:
+            self._inflight.remove((batch, stale))
+        for (key, waiter), payload in zip(batch.items(), payloads):
+            value = self._MISSING
+            fresh = key not in stale and key not in self._entries
+            try:
+                if payload is None:
+                    if fresh:
+                        self._absent[key] = True
+                elif payload is not self._MISSING:
+                    value = self.decode(json.loads(payload))
+                    if fresh:
+                        StateStore.set(self, key, value)
+            except Exception as e:
+                logger.error(f"Error decoding shared state: {e}")
+                self.stats['errors'] += 1
+            if key in self._entries:
+                value = self.get(key)
+            waiter.set_result(value)
+    
+    def set(self, key: Any, value: Any):
+        """Store value locally and queue it for the backend"""
+        super().set(key, value)
+        self._absent.pop(key)
+        self._queue(key, value)
+    
+    def pop(self, key: Any, default: Any = None) -> Any:
+        """Remove key here and from the backend"""
+        value = super().pop(key, default)
+        self._queue(key, self._DELETED)
+        return value
+    
+    def __delitem__(self, key: Any):
+        super().__delitem__(key)
+        self._queue(key, self._DELETED)
+    
+    def _queue(self, key: Any, value: Any):
+        if value is self._DELETED:
+            self._mark_stale(key)
+        self._writes[key] = value
+        if self._flushing is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return  # Written by the next flush()
+            self._flushing = loop.create_task(self._write())
+    
+    async def _write(self, delay: Optional[float] = None):
+        """Send coalesced writes, a batch per round trip"""
+        try:
+            await asyncio.sleep(self.flush_delay if delay is None else delay)
+            while self._writes:
+                batch, self._writes = self._writes, {}
+                try:
+                    await self.backend.write(self.namespace, {
+                        key: None if value is self._DELETED
+                        else json.dumps(self.encode(value), separators=(',', ':'))
+                        for key, value in batch.items()
+                    }, self.ttl, self.node)
+                    self.stats['remote_writes'] += len(batch)
+                except Exception as e:
+                    logger.error(f"Error writing shared state: {e}")
+                    self.stats['errors'] += 1
+        finally:
+            self._flushing = None
+    
+    async def flush(self):
+        """Wait until queued writes have been sent"""
+        if self._flushing is None and self._writes:
+            self._flushing = asyncio.get_running_loop().create_task(self._write(0))
+        if self._flushing is not None:
+            await asyncio.shield(self._flushing)
+    
+    def _mark_stale(self, key: Any):
+        for batch, stale in self._inflight:
+            if key in batch:
+                stale.add(key)
+    
+    def is_cached(self, key: Any) -> bool:
+        return key in self._entries or key in self._absent
+    
+    def invalidate(self, keys: Iterable[Any]):
+        """Drop local copies of keys written elsewhere"""
+        for key in keys:
+            self._entries.pop(key, None)
+            self._absent.pop(key)
+            self._mark_stale(key)
+        self.stats['invalidations'] += 1
+    
+    def clear(self):
+        """Drop every local copy; shared values are untouched"""
+        super().clear()
+        self._absent.clear()
+        for batch, stale in self._inflight:
+            stale.update(batch)
+    
+    def report(self) -> Dict[str, int]:
+        return {**super().report(), **self.stats}
+
+
+class ModerationRuleEngine:
+    """Compiled single-pass matcher for moderation rules"""
+    
+    PATTERN_WEIGHT = 0.3
+    CAPS_WEIGHT = 0.2
+    SPAM_WEIGHT = 0.2
+    REPEAT_WEIGHT = 0.1
+    
+    _INLINE_FLAGS = re.compile(r'^\(\?([imsx]+)\)')
+    _NUMBERED_BACKREF = re.compile(r'\\[1-9]')
+    _LITERAL_RULE = re.compile(r'^\(?([\w ]+(?:\|[\w ]+)*)\)?$')
+    _REPEAT = re.compile(r'(.)\1\1\1\1')
+    _ASCII_UPPER = str.maketrans('', '', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    
+    def __init__(self, patterns: List[str]):
+        self.patterns: List[str] = []
+        self.version = 0
+        self._matcher: Optional[re.Pattern] = None
+        self._lowered: Optional[re.Pattern] = None
+        self._unfolded: Optional[re.Pattern] = None
+        self._folded: Dict[str, frozenset] = {}
+        self._exact: Dict[str, frozenset] = {}
+        self._embedded: List[tuple] = []
+        self._literals: Dict[int, tuple] = {}
+        self._standalone: List[tuple] = []
+        self.compile(patterns)
+    
+    def compile(self, patterns: List[str]):
+        """
+        Rebuild the combined matcher from a list of rule patterns
+        
+        Literal rules (plain word alternations such as ``(?i)(spam|scam)``) are
+        folded into one trie-shaped alternation so clean messages cost a single
+        scan regardless of rule count; the matched word maps back to its rules.
+        ASCII messages are lowercased and matched case-sensitively against
+        that trie, which sre does several times faster than ``(?i)``.
+        Every other rule is embedded as a named group (``p0``, ``p1``, ...).
+        Rules with numbered backreferences cannot be embedded and are kept as
+        standalone regexes. Each rule's own regex is kept too: the combined
+        scan only reports non-overlapping matches, so once it finds a hit the
+        rules it did not report are checked individually.
+        
+        Args:
+            patterns: Regex patterns, optionally prefixed with global inline flags
+            
+        Raises:
+            re.error: If any pattern is not a valid regex
+        """
+        folded: Dict[str, set] = {}
+        exact: Dict[str, set] = {}
+        groups = []
+        embedded = []
+        literals = {}
+        standalone = []
+        for index, pattern in enumerate(patterns):
+            compiled = re.compile(pattern)
+            if self._NUMBERED_BACKREF.search(pattern):
+                standalone.append((index, compiled))
+                continue
+            embedded.append((index, compiled))
+            flags = self._INLINE_FLAGS.match(pattern)
+            body = pattern[flags.end():] if flags else pattern
+            flag_chars = flags.group(1) if flags else ''
+            literal = self._LITERAL_RULE.match(body)
+            if literal and flag_chars in ('', 'i'):
+                table = folded if flag_chars else exact
+                words = tuple(word.lower() if flag_chars else word for word in literal.group(1).split('|'))
+                for word in words:
+                    table.setdefault(word, set()).add(index)
+                literals[index] = (words, bool(flag_chars))
+                continue
+            groups.append(f"(?P<p{index}>(?{flag_chars}:{body}))" if flag_chars else f"(?P<p{index}>{body})")
+        
+        unfolded = []
+        if exact:
+            unfolded.append(f"(?P<exact>{self._trie_pattern(list(exact))})")
+        unfolded.extend(groups)
+        parts = list(unfolded)
+        if folded:
+            parts.insert(0, f"(?P<folded>(?i:{self._trie_pattern(list(folded))}))")
+        
+        lowered = unfolded_matcher = None
+        try:
+            matcher = re.compile("|".join(parts)) if parts else None
+            if folded and all(word.isascii() for word in folded):
+                lowered = re.compile(self._trie_pattern(list(folded)))
+                unfolded_matcher = re.compile("|".join(unfolded)) if unfolded else None
+        except re.error:
+            # Fall back to standalone matching for rules that clash once combined
+            matcher = None
+            folded, exact = {}, {}
+            embedded = []
+            literals = {}
+            standalone = [(index, re.compile(pattern)) for index, pattern in enumerate(patterns)]
+        
+        self.patterns = list(patterns)
+        self._matcher = matcher
+        self._lowered = lowered
+        self._unfolded = unfolded_matcher
+        self._folded = self._credit_substrings(folded)
+        self._exact = self._credit_substrings(exact)
+        self._embedded = embedded
+        self._literals = literals
+        self._standalone = standalone
+        self.version += 1
+    
+    @staticmethod
+    def _credit_substrings(table: Dict[str, set]) -> Dict[str, frozenset]:
+        """Let a matched word also credit rules whose words it contains"""
+        return {
+            word: frozenset().union(*(rules for other, rules in table.items() if other in word))
+            for word in table
+        }
+    
+    @staticmethod
+    def _trie_pattern(words: List[str]) -> str:
+        """Build a regex alternation that shares common prefixes"""
+        root: Dict[str, Dict] = {}
+        for word in words:
+            node = root
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        
+        def emit(node: Dict[str, Dict]) -> str:
+            branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ''
+            optional = '' in node
+            if len(branches) == 1 and not optional:
+                return branches[0]
+            return f"(?:{'|'.join(branches)})" + ('?' if optional else '')
+        
+        return emit(root)
+    
+    def _search_rule(self, index: int, compiled: re.Pattern, content: str, lowered: Optional[str]) -> bool:
+        """Whether one rule matches, by substring for literal rules where that is equivalent"""
+        literal = self._literals.get(index)
+        if literal is None or (literal[1] and lowered is None):
+            return compiled.search(content) is not None
+        text = lowered if literal[1] else content
+        return any(word in text for word in literal[0])
+    
+    def scan(self, content: str) -> tuple:
+        """
+        Score content against all rules
+        
+        Returns:
+            Tuple of (score, violations) before clamping to 1.0
+        """
+        hits = set()
+        is_ascii = content.isascii()
+        matcher = self._matcher
+        total = len(self.patterns) - len(self._standalone)
+        lowered = None
+        if self._lowered is not None and is_ascii:
+            lowered = content.lower()
+            for match in self._lowered.finditer(lowered):
+                hits.update(self._folded[match.group()])
+            matcher = self._unfolded
+        if matcher is not None:
+            for match in matcher.finditer(content):
+                group = match.lastgroup
+                if group == 'folded':
+                    word = match.group()
+                    rules = self._folded.get(word.lower())
+                    if rules is None:
+                        # (?i) equates some characters that lower() does not, e.g. "ſ" and "s"
+                        rules = frozenset().union(*(
+                            rules for other, rules in self._folded.items()
+                            if re.fullmatch(re.escape(other), word, re.IGNORECASE)
+                        ))
+                    hits.update(rules)
+                elif group == 'exact':
+                    hits.update(self._exact.get(match.group(), ()))
+                else:
+                    hits.add(int(group[1:]))
+                if len(hits) == total:
+                    break
+        # No hit means no rule matches anywhere, so clean messages stay a single scan
+        if hits and len(hits) < total:
+            for index, compiled in self._embedded:
+                if index not in hits and self._search_rule(index, compiled, content, lowered):
+                    hits.add(index)
+        for index, compiled in self._standalone:
+            if compiled.search(content):
+                hits.add(index)
+        
+        score = 0.0
+        violations = []
+        for index, pattern in enumerate(self.patterns):
+            if index in hits:
+                score += self.PATTERN_WEIGHT
+                violations.append(f"Pattern matched: {pattern}")
+        
+        length = len(content)
+        if length > 5:
+            if is_ascii:
+                upper = length - len(content.translate(self._ASCII_UPPER))
+            else:
+                upper = sum(map(str.isupper, content))
+            if upper / length > 0.7:
+                score += self.CAPS_WEIGHT
+                violations.append("Excessive capitalization")
+        
+        if length > 100 and content.count(' ') < 5:
+            score += self.SPAM_WEIGHT
+            violations.append("Possible spam pattern")
+        
+        if self._REPEAT.search(content):
+            score += self.REPEAT_WEIGHT
+            violations.append("Repeated characters detected")
+        
+        return score, violations
+
+
+class _Window:
+    """Fixed-capacity ring of (timestamp, user_id, bands) with band counts"""
+    
+    __slots__ = ('entries', 'counts')
+    
+    def __init__(self, capacity: int):
+        self.entries: deque = deque(maxlen=capacity)
+        self.counts: Dict[int, int] = {}
+    
+    def expire(self, cutoff: float):
+        """Drop entries older than ``cutoff``"""
+        entries = self.entries
+        while entries and entries[0][0] < cutoff:
+            self._forget(entries.popleft())
+    
+    def add(self, entry: tuple):
+        """Append an entry, evicting the oldest one when full"""
+        if len(self.entries) == self.entries.maxlen:
+            self._forget(self.entries.popleft())
+        self.entries.append(entry)
+        counts = self.counts
+        for band in entry[2]:
+            counts[band] = counts.get(band, 0) + 1
+    
+    def matches(self, bands: tuple) -> int:
+        """Entries sharing at least one band (upper bound, counts per band)"""
+        counts = self.counts
+        best = 0
+        for band in bands:
+            count = counts.get(band, 0)
+            if count > best:
+                best = count
+        return best
+    
+    def _forget(self, entry: tuple):
+        counts = self.counts
+        for band in entry[2]:
+            remaining = counts[band] - 1
+            if remaining:
+                counts[band] = remaining
+            else:
+                del counts[band]
+
+
+class FloodDetector:
+    """
+    Cross-message flood and near-duplicate detection
+    
+    Each user and channel keeps a fixed-size ring of recent messages inside a
+    bounded StateStore, so memory per tracked user is constant. Messages are
+    fingerprinted with a bottom-k MinHash over their words (the four smallest
+    word hashes), split into two bands; two messages sharing a band are treated
+    as near-duplicates. Three signals are raised:
+    
+    - flood: ``max_messages`` from one user within ``window`` seconds
+    - repeat: ``max_duplicates`` near-identical messages from one user
+    - raid: ``raid_duplicates`` near-identical messages of at least
+      ``raid_min_words`` words in a channel, some of them from other users
+    """
+    
+    FLOOD_WEIGHT = 0.4
+    REPEAT_WEIGHT = 0.3
+    RAID_WEIGHT = 0.4
+    RAID_VIOLATION = "Duplicate message across users"
+    
+    _WORD = re.compile(r'\w+')
+    
+    def __init__(
+        self,
+        window: float = 10.0,
+        max_messages: int = 6,
+        max_duplicates: int = 3,
+        raid_duplicates: int = 5,
+        raid_min_words: int = 3,
+        channel_capacity: int = 64,
+        max_entries: int = 100000
+    ):
+        self.window = window
+        self.max_messages = max_messages
+        self.max_duplicates = max_duplicates
+        self.raid_duplicates = raid_duplicates
+        self.raid_min_words = raid_min_words
+        self.channel_capacity = channel_capacity
+        self.users = StateStore(max_entries=max_entries, ttl=window)
+        self.channels = StateStore(max_entries=max_entries, ttl=window)
+    
+    @classmethod
+    def words(cls, content: str) -> set:
+        """Distinct lowercase words used for fingerprinting"""
+        return set(cls._WORD.findall(content[:512].lower()))
+    
+    @classmethod
+    def fingerprint(cls, words: set) -> tuple:
+        """MinHash bands for a word set (empty when there are no words)"""
+        smallest = sorted(map(hash, words))[:4]
+        return tuple(hash(tuple(smallest[i:i + 2])) for i in range(0, len(smallest), 2))
+    
+    def observe(self, user_id: int, channel_id: Optional[int], content: str, now: Optional[float] = None) -> tuple:
+        """
+        Record a message and score it against recent traffic
+        
+        Returns:
+            Tuple of (score, violations)
+        """
+        if now is None:
+            now = time.monotonic()
+        cutoff = now - self.window
+        words = self.words(content)
+        bands = self.fingerprint(words)
+        entry = (now, user_id, bands)
+        score = 0.0
+        violations = []
+        
+        user = self.users.get(user_id)
+        if user is None:
+            user = _Window(self.max_messages)
+            self.users[user_id] = user
+        user.expire(cutoff)
+        user.add(entry)
+        
+        repeats = user.matches(bands) if bands else 0
+        if len(user.entries) >= self.max_messages:
+            score += self.FLOOD_WEIGHT
+            violations.append("Message flood")
+        if repeats >= self.max_duplicates:
+            score += self.REPEAT_WEIGHT
+            violations.append("Repeated message")
+        
+        if channel_id is not None:
+            channel = self.channels.get(channel_id)
+            if channel is None:
+                channel = _Window(self.channel_capacity)
+                self.channels[channel_id] = channel
+            channel.expire(cutoff)
+            channel.add(entry)
+            
+            if len(words) >= self.raid_min_words and channel.matches(bands) >= self.raid_duplicates:
+                # Rare path: confirm that other users posted the same content
+                shared = set(bands)
+                if any(other != user_id and shared.intersection(other_bands) for _, other, other_bands in channel.entries):
+                    score += self.RAID_WEIGHT
+                    violations.append(self.RAID_VIOLATION)
+        
+        return score, violations
+    
+    def report(self) -> Dict[str, int]:
+        """Tracked user and channel counts"""
+        return {'users': len(self.users), 'channels': len(self.channels)}
+
+
+class AIModeration:
+    """AI-powered content moderation"""
+    
+    def __init__(
+        self,
+        config: AIConfig,
+        persistence: Optional[StatePersistence] = None,
+        state: Optional[SharedStateBackend] = None
+    ):
+        self.config = config
+        self.persistence = persistence
+        self.analyzer: Optional[TextAnalysisExecutor] = None
+        self.classifier: Optional[ModerationClassifier] = None
+        self.engine = ModerationRuleEngine([
+            r'(?i)(spam|scam)',
+            r'(?i)(hate|racist|slur)',
+            r'(?i)(adult|nsfw)',
+        ])
+        self.flood = FloodDetector(
+            window=config.flood_window,
+            max_messages=config.flood_max_messages,
+            max_duplicates=config.flood_max_duplicates,
+            raid_duplicates=config.raid_duplicates,
+            max_entries=config.state_max_entries
+        )
+        self.warning_threshold = 3
+        if state is None:
+            self.user_warnings = StateStore(
+                max_entries=config.state_max_entries,
+                ttl=config.warning_decay * self.warning_threshold,
+                loader=self._load_warnings if persistence else None
+            )
+        else:
+            self.user_warnings = SharedStateStore(
+                state,
+                'warnings',
+                max_entries=config.state_max_entries,
+                ttl=config.warning_decay * self.warning_threshold,
+                loader=self._load_warnings if persistence else None,
+                encode=lambda value: [value[0], SharedStateStore.to_wall(value[1])],
+                decode=lambda data: (data[0], SharedStateStore.from_wall(data[1])),
+                flush_delay=config.shared_state_flush_delay
+            )
+    
+    @property
+    def blocked_patterns(self) -> List[str]:
+        """Current rule patterns (assign a new list to rebuild the matcher)"""
+        return list(self.engine.patterns)
+    
+    @blocked_patterns.setter
+    def blocked_patterns(self, patterns: List[str]):
+        self.engine.compile(patterns)
+    
+    def add_pattern(self, pattern: str):
+        """Add a rule pattern and rebuild the matcher"""
+        self.engine.compile(self.engine.patterns + [pattern])
+    
+    def remove_pattern(self, pattern: str) -> bool:
+        """Remove a rule pattern and rebuild the matcher"""
+        if pattern not in self.engine.patterns:
+            return False
+        self.engine.compile([p for p in self.engine.patterns if p != pattern])
+        return True
+    
+    async def check_content(
+        self,
+        content: str,
+        user_id: int,
+        threshold: Optional[float] = None,
+        channel_id: Optional[int] = None,
+        classify: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Check content for moderation violations
+        
+        Args:
+            content: Text to moderate
+            user_id: Discord user ID
+            threshold: Violation threshold, defaults to config.moderation_threshold
+            channel_id: Discord channel ID, enables cross-user duplicate detection
+            classify: Wait for the classifier; False scores with heuristics only (see ``review``)
+            
+        Returns:
+            Dict with moderation results
+        """
+        classifier = self.classifier if classify else None
+        # Strikes are read synchronously by _verdict
+        await self.user_warnings.fetch(user_id)
+        if self.analyzer is None and classifier is None:
+            return self.evaluate(content, user_id, threshold, channel_id)
+        signals = self._cross_message(content, user_id, channel_id)
+        try:
+            if classifier is None:
+                violation_score, violations = await self._scan(content)
+            else:
+                (violation_score, violations), model_score = await asyncio.gather(
+                    self._scan(content),
+                    classifier.score(content)
+                )
+                # The heuristic score stands in when the model has no verdict
+                if model_score is not None and model_score > violation_score:
+                    violation_score = model_score
+                    violations = violations + [f"Classifier score: {model_score:.2f}"]
+        except Exception as e:
+            logger.error(f"Error checking content: {e}")
+            return self._clean_result()
+        return self._verdict(violation_score, violations, user_id, threshold, signals)
+    
+    async def _scan(self, content: str) -> tuple:
+        """Rule engine scan, in the analysis pool when one is attached"""
+        if self.analyzer is None:
+            return self.engine.scan(content)
+        return await self.analyzer.run('moderation', content)
+    
+    async def check_batch(self, items: List[tuple], classify: bool = True) -> List[Dict[str, Any]]:
+        """
+        Check a batch of messages for moderation violations
+        
+        Args:
+            items: Tuples of check_content arguments, (content, user_id[, threshold[, channel_id]])
+            classify: Wait for the classifier; False scores with heuristics only
+            
+        Returns:
+            List of moderation results in input order
+        """
+        if self.analyzer is None and (self.classifier is None or not classify):
+            await asyncio.gather(*(self.user_warnings.fetch(item[1]) for item in items))
+            return [self.evaluate(*item) for item in items]
+        return list(await asyncio.gather(*(self.check_content(*item, classify=classify) for item in items)))
+    
+    async def review(
+        self,
+        content: str,
+        user_id: int,
+        result: Dict[str, Any],
+        threshold: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Second opinion from the classifier on a heuristic verdict
+        
+        Args:
+            content: Text that was moderated
+            user_id: Discord user ID
+            result: Heuristic result from ``check_content(..., classify=False)``
+            threshold: Violation threshold, defaults to config.moderation_threshold
+            
+        Returns:
+            A new result when the model score moves the message into a more
+            severe action band, otherwise None (including when the classifier
+            has no verdict)
+        """
+        if self.classifier is None:
+            return None
+        model_score = await self.classifier.score(content)
+        if model_score is None:
+            return None
+        signal_score = result.get('signal_score', 0.0)
+        if self._band(min(model_score + signal_score, 1.0)) <= self._band(result['score']):
+            return None
+        return self._verdict(
+            model_score,
+            result['violations'] + [f"Classifier score: {model_score:.2f}"],
+            user_id,
+            threshold,
+            (signal_score, [])
+        )
+    
+    def evaluate(
+        self,
+        content: str,
+        user_id: int,
+        threshold: Optional[float] = None,
+        channel_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Score content synchronously using the compiled rule engine"""
+        signals = self._cross_message(content, user_id, channel_id)
+        try:
+            violation_score, violations = self.engine.scan(content)
+        except Exception as e:
+            logger.error(f"Error checking content: {e}")
+            return self._clean_result()
+        return self._verdict(violation_score, violations, user_id, threshold, signals)
+    
+    def _cross_message(self, content: str, user_id: int, channel_id: Optional[int]) -> tuple:
+        """Flood and duplicate signals from recent messages"""
+        try:
+            return self.flood.observe(user_id, channel_id, content)
+        except Exception as e:
+            logger.error(f"Error checking message flood: {e}")
+            return 0.0, []
+    
+    def _verdict(
+        self,
+        score: float,
+        violations: List[str],
+        user_id: int,
+        threshold: Optional[float],
+        signals: tuple = (0.0, [])
+    ) -> Dict[str, Any]:
+        """Turn rule engine and cross-message scores into a moderation result"""
+        if threshold is None:
+            threshold = self.config.moderation_threshold
+        try:
+            violation_score = min(score + signals[0], 1.0)
+            violations = violations + signals[1]
+            
+            return {
+                'is_violation': violation_score >= threshold,
+                'score': violation_score,
+                'violations': violations,
+                'action': self._determine_action(
+                    violation_score,
+                    user_id,
+                    raid=FloodDetector.RAID_VIOLATION in violations
+                ),
+                'signal_score': signals[0]
+            }
+        
+        except Exception as e:
+            logger.error(f"Error checking content: {e}")
+            return self._clean_result()
+    
+    @staticmethod
+    def _clean_result() -> Dict[str, Any]:
+        """Result used when content could not be checked"""
+        return {
+            'is_violation': False,
+            'score': 0.0,
+            'violations': [],
+            'action': 'none'
+        }
+    
+    def get_warnings(self, user_id: int) -> int:
+        """Current strike count after decay"""
+        strikes, stamp = self.user_warnings.get(user_id, (0, 0.0))
+        return self._decay(strikes, stamp, time.monotonic())
+    
+    def strikes_loaded(self, user_id: int) -> bool:
+        """True if ``evaluate`` can read the user's strikes without touching persistence"""
+        return self.user_warnings.loader is None or self.user_warnings.is_cached(user_id)
+    
+    def add_warning(self, user_id: int) -> int:
+        """Record a strike and return the decayed total"""
+        now = time.monotonic()
+        strikes, stamp = self.user_warnings.get(user_id, (0, now))
+        strikes = self._decay(strikes, stamp, now) + 1
+        self.user_warnings[user_id] = (strikes, now)
+        if self.persistence:
+            self.persistence.save('warnings', user_id, [strikes, time.time()])
+        return strikes
+    
+    def _load_warnings(self, user_id: int) -> Optional[tuple]:
+        """Load persisted strikes, converting the wall-clock stamp to monotonic"""
+        row = self.persistence.load('warnings', user_id)
+        if row is None:
+            return None
+        strikes, saved_at = row
+        return strikes, time.monotonic() - max(0.0, time.time() - saved_at)
+    
+    def _decay(self, strikes: int, stamp: float, now: float) -> int:
+        """Forgive one strike per ``warning_decay`` seconds since the last one"""
+        if not strikes or not self.config.warning_decay:
+            return strikes
+        return max(0, strikes - int((now - stamp) / self.config.warning_decay))
+    
+    # Lower bounds of the delete, warn (or kick) and ban actions; bans also need a raid signal
+    ACTION_BANDS = (0.5, 0.7, 0.9)
+    
+    @classmethod
+    def _band(cls, score: float) -> int:
+        """Severity of the action a score maps to, 0 for none"""
+        return bisect.bisect_right(cls.ACTION_BANDS, score)
+    
+    def _determine_action(self, score: float, user_id: int, raid: bool = False) -> str:
+        """
+        Determine moderation action based on score
+        
+        Only a raid (the same content posted across users) is banned outright;
+        content alone, however severe, goes through warnings and a kick.
+        """
+        band = self._band(score)
+        if band == 3 and raid:
+            return 'delete_and_ban'
+        elif band >= 2:
+            if self.add_warning(user_id) >= self.warning_threshold:
+                return 'delete_and_kick'
+            return 'delete_and_warn'
+        elif band == 1:
+            return 'delete'
+        return 'none'
+
+
+class ModerationActionExecutor:
+    """Enforces moderation actions off the message path"""
+    
+    NOTICES = {
+        'delete': "{mentions} Your message was removed for policy violations.",
+        'delete_and_warn': "{mentions} ⚠️ Warning: Your message violates community guidelines.",
+    }
+    # Removal follow-ups: (member method, audit log reason, channel notice)
+    REMOVALS = {
+        'delete_and_kick': ('kick', "Repeated policy violations", "{mention} has been kicked for repeated violations."),
+        'delete_and_ban': ('ban', "Severe policy violation", "{mention} has been banned for a severe violation."),
+    }
+    ACTIONS = ('delete', 'delete_and_warn', 'delete_and_kick', 'delete_and_ban')
+    
+    def __init__(self, workers: int = 2, queue_size: int = 1000):
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._pending_notices: Dict[tuple, List[str]] = {}
+        self._notice_tasks: Dict[tuple, asyncio.Task] = {}
+        self.stats = {
+            'actions': 0,
+            'dropped': 0,
+            'errors': 0,
+            'notices_sent': 0,
+            'notices_merged': 0,
+        }
+    
+    def start(self):
+        """Spawn enforcement workers on the running loop"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    def submit(self, message: discord.Message, action: str) -> bool:
+        """Queue an enforcement action, returning False if it was dropped"""
+        if action not in self.ACTIONS:
+            return False
+        self.start()
+        try:
+            self.queue.put_nowait((message, action))
+            return True
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            logger.warning(f"Moderation action queue full, dropping {action} for message {message.id}")
+            return False
+    
+    async def _worker(self):
+        """Process queued enforcement actions"""
+        while True:
+            message, action = await self.queue.get()
+            try:
+                await self._enforce(message, action)
+                self.stats['actions'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Error enforcing {action}: {e}")
+            finally:
+                self.queue.task_done()
+    
+    async def _enforce(self, message: discord.Message, action: str):
+        """Delete the message and apply the follow-up for the action"""
+        try:
+            await message.delete()
+        except discord.NotFound:
+            pass
+        
+        if action in self.REMOVALS:
+            method, reason, notice = self.REMOVALS[action]
+            try:
+                await getattr(message.author, method)(reason=reason)
+                await message.channel.send(notice.format(mention=message.author.mention))
+            except discord.Forbidden:
+                await message.channel.send(
+                    f"Unable to {method} {message.author.mention}. Insufficient permissions."
+                )
+            return
+        
+        self._queue_notice(message.channel, action, message.author.mention)
+    
+    def _queue_notice(self, channel: discord.abc.Messageable, action: str, mention: str):
+        """
+        Queue a channel notice, merging it with any notice already pending
+        
+        While a notice for the same channel and action is being sent, later
+        ones accumulate and go out as a single message naming every user.
+        """
+        key = (channel.id, action)
+        pending = self._pending_notices.setdefault(key, [])
+        if pending or key in self._notice_tasks:
+            self.stats['notices_merged'] += 1
+        if mention not in pending:
+            pending.append(mention)
+        if key not in self._notice_tasks:
+            self._notice_tasks[key] = asyncio.create_task(self._send_notices(channel, key))
+    
+    async def _send_notices(self, channel: discord.abc.Messageable, key: tuple):
+        """Drain pending notices for a channel and action"""
+        try:
+            while self._pending_notices.get(key):
+                mentions = self._pending_notices.pop(key)
+                text = self.NOTICES[key[1]].format(mentions=" ".join(mentions))
+                try:
+                    await channel.send(text[:2000])
+                    self.stats['notices_sent'] += 1
+                except discord.HTTPException as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Error sending moderation notice: {e}")
+        finally:
+            self._notice_tasks.pop(key, None)
+    
+    async def stop(self):
+        """Cancel workers and pending notices"""
+        tasks = self._tasks + list(self._notice_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._notice_tasks.clear()
+
+
+class ModerationPipeline:
+    """Bounded, batched moderation stage for incoming messages"""
+    
+    BACKPRESSURE_POLICIES = ('drop', 'degrade')
+    
+    def __init__(
+        self,
+        moderation: AIModeration,
+        executor: ModerationActionExecutor,
+        workers: int = 2,
+        batch_size: int = 32,
+        queue_size: int = 1000,
+        backpressure: str = 'drop'
+    ):
+        if backpressure not in self.BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+        self.moderation = moderation
+        self.executor = executor
+        self.workers = workers
+        self.batch_size = batch_size
+        self.backpressure = backpressure
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.latencies: deque = deque(maxlen=4096)
+        self._tasks: List[asyncio.Task] = []
+        self._reviews: set = set()
+        self._degraded: set = set()
+        self._held: Dict[int, asyncio.Future] = {}
+        self.stats = {
+            'submitted': 0,
+            'processed': 0,
+            'batches': 0,
+            'dropped': 0,
+            'degraded': 0,
+            'violations': 0,
+            'reviewed': 0,
+            'escalated': 0,
+        }
+        self.actions: Dict[str, int] = {}
+    
+    def start(self):
+        """Spawn scoring workers and the action executor"""
+        self.executor.start()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    def hold(self, message: discord.Message) -> asyncio.Future:
+        """
+        Get a future for a message's verdict; call it before ``submit``
+        
+        The future resolves with the heuristic verdict once the message has
+        been scored, or with None if it was dropped or scoring failed. A later
+        classifier escalation does not change it.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._held[message.id] = future
+        return future
+    
+    def _settle(self, message: discord.Message, result: Optional[Dict[str, Any]]):
+        future = self._held.pop(message.id, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+    
+    def submit(self, message: discord.Message, threshold: Optional[float] = None) -> bool:
+        """
+        Queue a message for moderation without waiting on it
+        
+        ``threshold`` overrides the configured violation threshold, e.g. with
+        the guild's own setting.
+        
+        When the queue is full the backpressure policy applies: ``drop`` skips
+        moderation for the message, ``degrade`` scores it inline with the
+        rule engine only and goes straight to enforcement. If the author's
+        strikes are not in memory yet, they are loaded off the event loop
+        first and the message is scored right after.
+        
+        Returns:
+            True if the message was queued or scored inline
+        """
+        self.start()
+        self.stats['submitted'] += 1
+        try:
+            self.queue.put_nowait((message, time.perf_counter(), threshold))
+            return True
+        except asyncio.QueueFull:
+            pass
+        
+        if self.backpressure == 'drop':
+            self.stats['dropped'] += 1
+            self._settle(message, None)
+            return False
+        
+        self.stats['degraded'] += 1
+        if self.moderation.strikes_loaded(message.author.id):
+            self._dispatch(message, self._evaluate(message, threshold))
+        else:
+            task = asyncio.create_task(self._degrade(message, threshold))
+            self._degraded.add(task)
+            task.add_done_callback(self._degraded.discard)
+        return True
+    
+    def _evaluate(self, message: discord.Message, threshold: Optional[float]) -> Dict[str, Any]:
+        return self.moderation.evaluate(message.content, message.author.id, threshold, message.channel.id)
+    
+    async def _degrade(self, message: discord.Message, threshold: Optional[float]):
+        """Rule-engine verdict once the author's strikes have been fetched"""
+        try:
+            await self.moderation.user_warnings.fetch(message.author.id)
+            result = self._evaluate(message, threshold)
+        except Exception as e:
+            logger.error(f"Error in degraded moderation: {e}")
+            self._settle(message, None)
+            return
+        self._dispatch(message, result)
+    
+    async def _worker(self):
+        """
+        Score queued messages in micro-batches
+        
+        Verdicts come from the heuristic scorer so enforcement never waits on
+        the classifier; when one is attached, each message is then reviewed
+        by it in the background and escalated if the model is more severe.
+        """
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            
+            try:
+                results = await self.moderation.check_batch(
+                    [
+                        (message.content, message.author.id, threshold, message.channel.id)
+                        for message, _, threshold in batch
+                    ],
+                    classify=False
+                )
+                now = time.perf_counter()
+                for (message, queued_at, threshold), result in zip(batch, results):
+                    self.latencies.append(now - queued_at)
+                    self._dispatch(message, result)
+                    if self.moderation.classifier:
+                        task = asyncio.create_task(self._review(message, threshold, result))
+                        self._reviews.add(task)
+                        task.add_done_callback(self._reviews.discard)
+                self.stats['processed'] += len(batch)
+                self.stats['batches'] += 1
+            except Exception as e:
+                logger.error(f"Error in moderation pipeline: {e}")
+            finally:
+                for message, _, _ in batch:
+                    if self._held:
+                        self._settle(message, None)
+                    self.queue.task_done()
+    
+    async def _review(self, message: discord.Message, threshold: Optional[float], result: Dict[str, Any]):
+        """Apply the classifier's verdict once it arrives"""
+        try:
+            escalated = await self.moderation.review(message.content, message.author.id, result, threshold)
+        except Exception as e:
+            logger.error(f"Error reviewing moderation verdict: {e}")
+            return
+        self.stats['reviewed'] += 1
+        if escalated is not None and escalated['is_violation']:
+            self.stats['escalated'] += 1
+            self._dispatch(message, escalated)
+    
+    async def join(self):
+        """Wait until queued and degraded messages are scored and their reviews have finished"""
+        await self.queue.join()
+        while self._reviews or self._degraded:
+            await asyncio.gather(*self._reviews, *self._degraded, return_exceptions=True)
+    
+    def _dispatch(self, message: discord.Message, result: Dict[str, Any]):
+        """Hand violations to the action executor"""
+        if self._held:
+            self._settle(message, result)
+        if result['is_violation']:
+            self.stats['violations'] += 1
+            self.actions[result['action']] = self.actions.get(result['action'], 0) + 1
+            self.executor.submit(message, result['action'])
+    
+    def latency_percentile(self, percentile: float) -> float:
+        """Queue-to-verdict latency in seconds at the given percentile (0-100)"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+    
+    async def stop(self):
+        """Cancel workers, pending reviews and degraded checks, then stop the action executor"""
+        tasks = self._tasks + list(self._reviews) + list(self._degraded)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        for future in self._held.values():
+            if not future.done():
+                future.set_result(None)
+        self._held.clear()
+        await self.executor.stop()
+
+
+class HTTPResult:
+    """Buffered upstream HTTP response"""
+    
+    __slots__ = ('status', 'headers', 'body')
+    
+    def __init__(self, status: int, headers: Any, body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+    
+    def json(self) -> Any:
+        """Decode the body as JSON"""
+        return json.loads(self.body)
+
+
+class CircuitBreaker:
+    """Per-upstream circuit breaker (closed -> open -> half-open)"""
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+    
+    def allow(self) -> bool:
+        """Whether a request may be sent now"""
+        if self.state == 'open':
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Let a single trial request through
+            self.state = 'half_open'
+            return True
+        return self.state == 'closed'
+    
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+    
+    def record_abandoned(self):
+        """A request ended without an outcome, e.g. it was cancelled; a half-open trial counts as failed"""
+        if self.state == 'half_open':
+            self.record_failure()
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                logger.warning("Circuit breaker opened for upstream")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+
+class AIHTTPClient:
+    """
+    Shared HTTP client for all AI upstreams
+    
+    One keep-alive connection pool with DNS caching, a concurrency semaphore
+    and circuit breaker per host, and retries with jittered exponential
+    backoff that honors ``Retry-After`` on 429/503 responses.
+    """
+    
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(
+        self,
+        limit: int = 100,
+        per_host_limit: int = 8,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30.0,
+        metrics: Optional['MetricsRegistry'] = None
+    ):
+        self.limit = limit
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.metrics = metrics
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: deque = deque(maxlen=1024)
+        self.stats = {
+            'in_flight': 0,
+            'queued': 0,
+            'requests': 0,
+            'retries': 0,
+            'failures': 0,
+            'rejected': 0,
+        }
+    
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Pooled session, created on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.per_host_limit,
+                ttl_dns_cache=300,
+                keepalive_timeout=30
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+    
+    def _record(self, host: str, status: Optional[int], started: float):
+        """Track one attempt's latency"""
+        elapsed = time.perf_counter() - started
+        self.latencies.append(elapsed)
+        if self.metrics:
+            self.metrics.observe('http_request_duration_seconds', elapsed, host=host, status=status or 'error')
+    
+    def _host(self, url: str) -> str:
+        return urlsplit(url).netloc
+    
+    def _upstream(self, host: str) -> tuple:
+        """Circuit breaker and concurrency semaphore for a host"""
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return breaker, semaphore
+    
+    def _backoff(self, attempt: int, result: Optional[HTTPResult]) -> float:
+        """Delay before the next attempt, preferring the server's Retry-After"""
+        if result is not None and result.status in (429, 503):
+            retry_after = result.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    async def request(
+        self,
+        method: str,
+        url: str,
+        retries: Optional[int] = None,
+        **kwargs
+    ) -> Optional[HTTPResult]:
+        """
+        Send a request with pooling, retries and circuit breaking
+        
+        Args:
+            method: HTTP method
+            url: Absolute URL
+            retries: Override for the retry count
+            **kwargs: Passed through to ``aiohttp.ClientSession.request``
+            
+        Returns:
+            The final response (possibly a non-2xx status), or None if the
+            circuit is open or every attempt failed at the transport level
+        """
+        host = self._host(url)
+        breaker, semaphore = self._upstream(host)
+        retries = self.max_retries if retries is None else retries
+        result = None
+        try:
+            for attempt in range(retries + 1):
+                if not breaker.allow():
+                    self.stats['rejected'] += 1
+                    logger.warning(f"Circuit open for {host}, skipping request")
+                    return result
+                
+                result = None
+                self.stats['queued'] += 1
+                async with semaphore:
+                    self.stats['queued'] -= 1
+                    self.stats['in_flight'] += 1
+                    self.stats['requests'] += 1
+                    started = time.perf_counter()
+                    try:
+                        async with self.session.request(method, url, **kwargs) as resp:
+                            result = HTTPResult(resp.status, resp.headers, await resp.read())
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        logger.warning(f"Request to {host} failed: {e!r}")
+                    finally:
+                        self.stats['in_flight'] -= 1
+                        self._record(host, result.status if result else None, started)
+                
+                if result is not None and result.status not in self.RETRY_STATUSES:
+                    breaker.record_success()
+                    return result
+                if result is None or result.status >= 500 or breaker.state == 'half_open':
+                    breaker.record_failure()
+                
+                if attempt < retries:
+                    self.stats['retries'] += 1
+                    await asyncio.sleep(self._backoff(attempt, result))
+        except BaseException:
+            # A cancelled half-open trial must not leave the breaker waiting forever
+            breaker.record_abandoned()
+            raise
+        
+        self.stats['failures'] += 1
+        return result
+    
+    @asynccontextmanager
+    async def stream(
+        self,
+        method: str,
+        url: str,
+        retries: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[Optional[aiohttp.ClientResponse]]:
+        """
+        Like ``request`` but yields the open response for incremental reads
+        
+        Retries and circuit breaking apply until a response with a
+        non-retryable status arrives; the body is then left to the caller.
+        The host's concurrency slot is held until the block exits.
+        
+        Yields:
+            The open response (possibly non-2xx after retries are exhausted),
+            or None if the circuit is open or the transport failed
+        """
+        host = self._host(url)
+        breaker, semaphore = self._upstream(host)
+        retries = self.max_retries if retries is None else retries
+        try:
+            for attempt in range(retries + 1):
+                if not breaker.allow():
+                    self.stats['rejected'] += 1
+                    logger.warning(f"Circuit open for {host}, skipping request")
+                    yield None
+                    return
+                
+                result = None
+                self.stats['queued'] += 1
+                async with semaphore:
+                    self.stats['queued'] -= 1
+                    self.stats['in_flight'] += 1
+                    self.stats['requests'] += 1
+                    started = time.perf_counter()
+                    try:
+                        resp = None
+                        try:
+                            resp = await self.session.request(method, url, **kwargs)
+                        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                            logger.warning(f"Request to {host} failed: {e!r}")
+                        
+                        if resp is not None:
+                            if resp.status not in self.RETRY_STATUSES or attempt == retries:
+                                if resp.status not in self.RETRY_STATUSES:
+                                    breaker.record_success()
+                                try:
+                                    yield resp
+                                finally:
+                                    resp.release()
+                                return
+                            result = HTTPResult(resp.status, resp.headers, b'')
+                            resp.release()
+                    finally:
+                        self.stats['in_flight'] -= 1
+                        self._record(host, resp.status if resp is not None else None, started)
+                
+                if result is None or result.status >= 500 or breaker.state == 'half_open':
+                    breaker.record_failure()
+                if attempt < retries:
+                    self.stats['retries'] += 1
+                    await asyncio.sleep(self._backoff(attempt, result))
+        except BaseException:
+            breaker.record_abandoned()
+            raise
+        
+        self.stats['failures'] += 1
+        yield None
+    
+    def report(self) -> Dict[str, Any]:
+        """Counters, latency summary and breaker states"""
+        ordered = sorted(self.latencies)
+        
+        def percentile(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+        
+        return {
+            **self.stats,
+            'latency_p50': percentile(0.5),
+            'latency_p99': percentile(0.99),
+            'breakers': {host: breaker.state for host, breaker in self.breakers.items()},
+        }
+    
+    async def close(self):
+        """Close the pooled session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class ModerationClassifier(ABC):
+    """Interface for model-based moderation scoring"""
+    
+    @abstractmethod
+    async def score(self, text: str) -> Optional[float]:
+        """Return a 0-1 violation score, or None if no verdict is available"""
+    
+    async def close(self):
+        """Flush pending work"""
+
+
+class BatchedHTTPClassifier(ModerationClassifier):
+    """
+    Classifier client for OpenAI-compatible ``/moderations`` endpoints
+    
+    Pending texts are grouped into one request per ``batch_size`` texts or
+    ``batch_delay`` seconds, whichever comes first. Verdicts are cached by
+    content hash and identical texts in flight share one slot in the batch.
+    A request that fails or takes longer than ``timeout`` yields None so the
+    caller can fall back to the heuristic scorer, as does a new text while
+    ``max_in_flight`` requests are already outstanding.
+    """
+    
+    def __init__(
+        self,
+        http: AIHTTPClient,
+        url: str,
+        api_key: str = "",
+        model: str = "",
+        batch_size: int = 32,
+        batch_delay: float = 0.05,
+        timeout: float = 2.0,
+        cache_size: int = 50000,
+        cache_ttl: float = 3600,
+        max_in_flight: int = 8
+    ):
+        self.http = http
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.verdicts = StateStore(max_entries=cache_size, ttl=cache_ttl)
+        self._pending: Dict[bytes, tuple] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: set = set()
+        self.latencies: deque = deque(maxlen=4096)
+        self.stats = {
+            'texts': 0,
+            'cache_hits': 0,
+            'coalesced': 0,
+            'requests': 0,
+            'batched_texts': 0,
+            'fallbacks': 0,
+            'saturated': 0,
+        }
+    
+    @staticmethod
+    def key(text: str) -> bytes:
+        """Content hash used for caching and coalescing"""
+        return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    
+    async def score(self, text: str) -> Optional[float]:
+        self.stats['texts'] += 1
+        key = self.key(text)
+        cached = self.verdicts.get(key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            return cached
+        
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(pending[1])
+        
+        if len(self._batches) >= self.max_in_flight:
+            self.stats['saturated'] += 1
+            return None
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[key] = (text, future)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_delay, self._flush)
+        
+        started = time.perf_counter()
+        result = await asyncio.shield(future)
+        self.latencies.append(time.perf_counter() - started)
+        return result
+    
+    def _flush(self):
+        """Send the pending texts as one request"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+    
+    async def _run_batch(self, batch: Dict[bytes, tuple]):
+        """Classify a batch and resolve its waiters"""
+        texts = [text for text, _ in batch.values()]
+        try:
+            scores = await asyncio.wait_for(self._classify(texts), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Moderation classifier timed out on {len(texts)} texts")
+            scores = None
+        except Exception as e:
+            logger.error(f"Error calling moderation classifier: {e}")
+            scores = None
+        
+        if scores is None:
+            self.stats['fallbacks'] += len(texts)
+            scores = [None] * len(texts)
+        for (key, (_, future)), score in zip(batch.items(), scores):
+            if score is not None:
+                self.verdicts[key] = score
+            if not future.done():
+                future.set_result(score)
+    
+    async def _classify(self, texts: List[str]) -> Optional[List[float]]:
+        """POST one batch and return the highest category score per text"""
+        self.stats['requests'] += 1
+        self.stats['batched_texts'] += len(texts)
+        payload: Dict[str, Any] = {'input': texts}
+        if self.model:
+            payload['model'] = self.model
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        
+        result = await self.http.request('POST', self.url, retries=0, json=payload, headers=headers)
+        if result is None or result.status != 200:
+            logger.error(f"Moderation classifier failed: {result.status if result else 'no response'}")
+            return None
+        
+        results = result.json()['results']
+        if len(results) != len(texts):
+            logger.error(f"Moderation classifier returned {len(results)} results for {len(texts)} texts")
+            return None
+        return [max(item.get('category_scores', {}).values(), default=0.0) for item in results]
+    
+    def report(self) -> Dict[str, Any]:
+        """Batching efficiency, cache hit rate and added latency"""
+        ordered = sorted(self.latencies)
+        return {
+            **self.stats,
+            'texts_per_request': self.stats['batched_texts'] / self.stats['requests'] if self.stats['requests'] else 0.0,
+            'cache_hit_rate': self.stats['cache_hits'] / self.stats['texts'] if self.stats['texts'] else 0.0,
+            'p50_ms': ordered[len(ordered) // 2] * 1000 if ordered else 0.0,
+            'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000 if ordered else 0.0,
+        }
+    
+    async def close(self):
+        """Send anything still pending and wait for in-flight batches"""
+        self._flush()
+        await asyncio.gather(*self._batches, return_exceptions=True)
+
+
+class ImageCache:
+    """
+    Content-addressed cache for generated images
+    
+    Decoded image bytes live in a size-bounded in-memory LRU tier backed by
+    an optional size-bounded on-disk tier. Concurrent requests for the same
+    key share a single upstream call.
+    """
+    
+    def __init__(self, memory_bytes: int = 64 * 1024 * 1024, disk_dir: str = "", disk_bytes: int = 512 * 1024 * 1024):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_size = 0
+        self._disk_index: Optional[OrderedDict] = None
+        self._disk_size = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'coalesced': 0,
+            'handoffs': 0,
+            'misses': 0,
+            'upstream_calls': 0,
+            'bytes_saved': 0,
+        }
+    
+    @staticmethod
+    def key(params: Dict[str, Any]) -> str:
+        """Stable content address for a set of generation parameters"""
+        encoded = json.dumps(params, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+    
+    # Outcome shared with waiters when the caller running the factory was cancelled
+    _ABANDONED = object()
+    
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[Optional[bytes]]]) -> Optional[bytes]:
+        """
+        Return cached bytes for key, calling factory at most once per key
+        
+        If the caller running the factory is cancelled (e.g. its job timed
+        out), the callers waiting on it retry and the first one to resume
+        runs its own factory, rather than all of them failing.
+        
+        Args:
+            key: Content address from ``ImageCache.key``
+            factory: Coroutine function producing the image bytes or None
+            
+        Returns:
+            Image bytes or None if generation failed
+        """
+        while True:
+            data = await self.get(key)
+            if data is not None:
+                self.stats['bytes_saved'] += len(data)
+                return data
+            
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            self.stats['coalesced'] += 1
+            data = await asyncio.shield(pending)
+            if data is not self._ABANDONED:
+                if data is not None:
+                    self.stats['bytes_saved'] += len(data)
+                return data
+            self.stats['handoffs'] += 1
+        
+        self.stats['misses'] += 1
+        self.stats['upstream_calls'] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        outcome = None
+        try:
+            data = await factory()
+            if data is not None:
+                await self.put(key, data)
+            outcome = data
+            return data
+        except asyncio.CancelledError:
+            outcome = self._ABANDONED
+            raise
+        finally:
+            future.set_result(outcome)
+            del self._inflight[key]
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        """Look up key in memory, then on disk"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return data
+        
+        if not self.disk_dir:
+            return None
+        await self._load_disk_index()
+        if key not in self._disk_index:
+            return None
+        try:
+            data = await asyncio.to_thread(self._read_file, key)
+        except OSError:
+            self._disk_size -= self._disk_index.pop(key)
+            return None
+        self._disk_index.move_to_end(key)
+        self.stats['disk_hits'] += 1
+        self._remember(key, data)
+        return data
+    
+    async def put(self, key: str, data: bytes):
+        """Store bytes in both tiers"""
+        self._remember(key, data)
+        if not self.disk_dir:
+            return
+        await self._load_disk_index()
+        if key in self._disk_index:
+            return
+        try:
+            await asyncio.to_thread(self._write_file, key, data)
+        except OSError as e:
+            logger.error(f"Error writing image cache entry: {e}")
+            return
+        self._disk_index[key] = len(data)
+        self._disk_size += len(data)
+        evicted = []
+        while self._disk_size > self.disk_bytes and len(self._disk_index) > 1:
+            old_key, size = self._disk_index.popitem(last=False)
+            self._disk_size -= size
+            evicted.append(old_key)
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+    
+    def _remember(self, key: str, data: bytes):
+        """Insert into the memory tier and evict down to the byte budget"""
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+    
+    async def _load_disk_index(self):
+        """Scan the cache directory once, oldest files first"""
+        if self._disk_index is None:
+            entries = await asyncio.to_thread(self._scan_disk)
+            self._disk_index = OrderedDict(entries)
+            self._disk_size = sum(size for _, size in entries)
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.png")
+    
+    def _scan_disk(self) -> List[tuple]:
+        os.makedirs(self.disk_dir, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith('.png'):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        return [(key, size) for _, key, size in sorted(found)]
+    
+    def _read_file(self, key: str) -> bytes:
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+    
+    def _write_file(self, key: str, data: bytes):
+        tmp_path = self._path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+    
+    def _remove_files(self, keys: List[str]):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+    
+    def report(self) -> Dict[str, Any]:
+        """Hit rate, bytes saved and upstream calls avoided"""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits'] + self.stats['coalesced']
+        lookups = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'upstream_avoided': hits,
+            'memory_bytes': self._memory_size,
+            'disk_bytes': self._disk_size,
+        }
+
+
+class Base64ArtifactDecoder:
+    """
+    Incrementally decodes the first ``"base64"`` string of a JSON stream
+    
+    Chunks are decoded as soon as whole 4-character groups arrive and written
+    to ``sink``, so the encoded payload is never held in full.
+    """
+    
+    MARKER = b'"base64"'
+    
+    def __init__(self, sink: io.BytesIO):
+        self.sink = sink
+        self.done = False
+        self._in_value = False
+        self._buffer = bytearray()
+    
+    def feed(self, chunk: bytes):
+        """Consume the next chunk of the response body"""
+        if self.done:
+            return
+        buffer = self._buffer
+        buffer += chunk
+        
+        if not self._in_value:
+            start = buffer.find(self.MARKER)
+            if start < 0:
+                del buffer[:max(0, len(buffer) - len(self.MARKER))]
+                return
+            quote = buffer.find(b'"', start + len(self.MARKER))
+            if quote < 0:
+                del buffer[:start]
+                return
+            del buffer[:quote + 1]
+            self._in_value = True
+        
+        end = buffer.find(b'"')
+        if end >= 0:
+            del buffer[end:]
+            self.done = True
+        if b'\\' in buffer:
+            # JSON may escape '/' as '\/'
+            buffer[:] = buffer.replace(b'\\', b'')
+        usable = len(buffer) if self.done else len(buffer) - len(buffer) % 4
+        if usable:
+            self.sink.write(binascii.a2b_base64(buffer[:usable]))
+            del buffer[:usable]
+
+
+class ImageGeneration:
+    """AI image generation capabilities"""
+    
+    def __init__(self, config: AIConfig, http: Optional[AIHTTPClient] = None):
+        self.config = config
+        self.endpoint = "https://api.stability.ai/v1/generation"
+        self._owns_http = http is None
+        self.http = http or AIHTTPClient()
+        self.cache = ImageCache(
+            memory_bytes=config.image_cache_memory_bytes,
+            disk_dir=config.image_cache_dir,
+            disk_bytes=config.image_cache_disk_bytes
+        )
+        self.stats = {'uploads': 0, 'bytes_uploaded': 0}
+    
+    async def generate_image(self, prompt: str, style: str = "photorealistic") -> Optional[bytes]:
+        """
+        Generate image from text prompt
+        
+        Identical requests (after normalizing whitespace and case) are served
+        from the cache or share one in-flight upstream call.
+        
+        Args:
+            prompt: Text description of image
+            style: Style of image (photorealistic, artistic, anime, etc.)
+            
+        Returns:
+            PNG bytes of the generated image or None
+        """
+        try:
+            if not self.config.stability_api_key:
+                logger.warning("Stability API key not configured")
+                return None
+            
+            payload = {
+                "prompt": f"{prompt}, {style} style, high quality, detailed",
+                "negative_prompt": "blurry, low quality, distorted",
+                "steps": 30,
+                "cfg_scale": 7.5,
+                "width": 512,
+                "height": 512,
+                "samples": 1,
+                "sampler": "k_euler"
+            }
+            
+            key = ImageCache.key({
+                **payload,
+                "prompt": " ".join(prompt.lower().split()),
+                "style": " ".join(style.lower().split()),
+            })
+            return await self.cache.get_or_create(key, lambda: self._request_image(payload))
+        
+        except Exception as e:
+            logger.error(f"Error generating image: {e}")
+            return None
+    
+    async def _request_image(self, payload: Dict[str, Any]) -> Optional[bytes]:
+        """Call the upstream and stream-decode the first artifact"""
+        headers = {
+            "Authorization": f"Bearer {self.config.stability_api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        async with self.http.stream(
+            'POST',
+            f"{self.endpoint}/stable-diffusion-v1-6/text-to-image",
+            headers=headers,
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=60)
+        ) as resp:
+            if resp is None or resp.status != 200:
+                logger.error(f"Image generation failed: {resp.status if resp else 'no response'}")
+                return None
+            
+            sink = io.BytesIO()
+            decoder = Base64ArtifactDecoder(sink)
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                decoder.feed(chunk)
+        
+        if not decoder.done:
+            logger.error("Image generation returned no artifacts")
+            return None
+        return sink.getvalue()
+    
+    async def to_file(self, data: bytes, name: str = "image") -> discord.File:
+        """
+        Wrap image bytes in a ``discord.File``, re-encoding if configured
+        
+        ``image_upload_format`` of ``webp`` or ``jpeg`` re-encodes the PNG off
+        the event loop (requires Pillow) when that makes the upload smaller.
+        
+        Args:
+            data: PNG bytes from ``generate_image``
+            name: Filename without extension
+            
+        Returns:
+            File ready to attach to a message
+        """
+        extension = 'png'
+        upload_format = self.config.image_upload_format.lower()
+        if upload_format in ('webp', 'jpeg'):
+            try:
+                encoded = await asyncio.to_thread(
+                    self._reencode, data, upload_format, self.config.image_upload_quality
+                )
+                if len(encoded) < len(data):
+                    data = encoded
+                    extension = 'jpg' if upload_format == 'jpeg' else upload_format
+            except ImportError:
+                logger.warning("Pillow is not installed, uploading PNG")
+            except Exception as e:
+                logger.error(f"Error re-encoding image: {e}")
+        
+        self.stats['uploads'] += 1
+        self.stats['bytes_uploaded'] += len(data)
+        # BytesIO shares the bytes object's buffer until written to, so no copy is made
+        return discord.File(io.BytesIO(data), filename=f"{name}.{extension}")
+    
+    @staticmethod
+    def _reencode(data: bytes, upload_format: str, quality: int) -> bytes:
+        from PIL import Image
+        
+        with Image.open(io.BytesIO(data)) as image:
+            if upload_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            output = io.BytesIO()
+            image.save(output, format=upload_format.upper(), quality=quality)
+        return output.getvalue()
+    
+    async def close(self):
+        """Close the HTTP client if this instance created it"""
+        if self._owns_http:
+            await self.http.close()
+
+
+class ImageJob:
+    """A queued image generation request"""
+    
+    __slots__ = (
+        'id', 'guild_id', 'user_id', 'prompt', 'style', 'priority', 'tag',
+        'status', 'enqueued_at', 'started_at', 'future', 'task'
+    )
+    
+    def __init__(self, job_id: int, guild_id: int, user_id: int, prompt: str, style: str, priority: int):
+        self.id = job_id
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.prompt = prompt
+        self.style = style
+        self.priority = priority
+        self.tag = 0.0
+        self.status = 'queued'
+        self.enqueued_at = time.monotonic()
+        self.started_at = 0.0
+        self.future: Optional[asyncio.Future] = None
+        self.task: Optional[asyncio.Task] = None
+    
+    def sort_key(self) -> tuple:
+        return (-self.priority, self.tag, self.id)
+
+
+class ImageJobScheduler:
+    """
+    Fair, bounded scheduler for image generation jobs
+    
+    Jobs are ordered by priority and then by a start-time fair queueing tag,
+    so each guild's jobs interleave with other guilds' instead of running
+    back to back. Concurrency is capped globally and per guild, and every job
+    runs under a timeout.
+    """
+    
+    def __init__(
+        self,
+        generator: Callable[[str, str], Awaitable[Optional[bytes]]],
+        max_concurrency: int = 2,
+        per_guild_concurrency: int = 1,
+        max_queue: int = 50,
+        job_timeout: float = 90.0
+    ):
+        self.generator = generator
+        self.max_concurrency = max_concurrency
+        self.per_guild_concurrency = per_guild_concurrency
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.jobs: Dict[int, ImageJob] = {}
+        self._heap: List[tuple] = []
+        self._queued = 0
+        self._virtual_time = 0.0
+        self._guild_finish: Dict[int, float] = {}
+        self._running: Dict[int, int] = {}
+        self._active = 0
+        self._ids = itertools.count(1)
+        self.wait_times: deque = deque(maxlen=1024)
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'cancelled': 0,
+        }
+    
+    def submit(self, guild_id: int, user_id: int, prompt: str, style: str = "photorealistic", priority: int = 0) -> Optional[ImageJob]:
+        """
+        Queue a job, starting it right away if capacity allows
+        
+        Returns:
+            The job, whose ``future`` resolves to image bytes or None, or
+            None if the queue is full
+        """
+        if self._queued >= self.max_queue:
+            self.stats['rejected'] += 1
+            return None
+        
+        job = ImageJob(next(self._ids), guild_id, user_id, prompt, style, priority)
+        job.tag = max(self._virtual_time, self._guild_finish.get(guild_id, 0.0))
+        self._guild_finish[guild_id] = job.tag + 1.0
+        job.future = asyncio.get_running_loop().create_future()
+        self.jobs[job.id] = job
+        heapq.heappush(self._heap, (job.sort_key(), job))
+        self._queued += 1
+        self.stats['submitted'] += 1
+        self._dispatch()
+        return job
+    
+    def position(self, job: ImageJob) -> int:
+        """1-based queue position, or 0 once the job has started"""
+        if job.status != 'queued':
+            return 0
+        key = job.sort_key()
+        return 1 + sum(1 for other_key, other in self._heap if other.status == 'queued' and other_key < key)
+    
+    def _dispatch(self):
+        """Start queued jobs while global and per-guild capacity allows"""
+        deferred = []
+        while self._heap and self._active < self.max_concurrency:
+            entry = heapq.heappop(self._heap)
+            job = entry[1]
+            if job.status != 'queued':
+                continue
+            if self._running.get(job.guild_id, 0) >= self.per_guild_concurrency:
+                deferred.append(entry)
+                continue
+            self._start(job)
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+    
+    def _start(self, job: ImageJob):
+        self._queued -= 1
+        self._active += 1
+        self._running[job.guild_id] = self._running.get(job.guild_id, 0) + 1
+        self._virtual_time = max(self._virtual_time, job.tag)
+        job.status = 'running'
+        job.started_at = time.monotonic()
+        self.wait_times.append(job.started_at - job.enqueued_at)
+        job.task = asyncio.create_task(self._run(job))
+    
+    async def _run(self, job: ImageJob):
+        result = None
+        try:
+            result = await asyncio.wait_for(self.generator(job.prompt, job.style), self.job_timeout)
+            job.status = 'done' if result is not None else 'failed'
+        except asyncio.TimeoutError:
+            job.status = 'timed_out'
+            logger.warning(f"Image job {job.id} timed out after {self.job_timeout}s")
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            logger.error(f"Image job {job.id} failed: {e}")
+        finally:
+            self.stats[{'done': 'completed'}.get(job.status, job.status)] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+            self._active -= 1
+            self._running[job.guild_id] -= 1
+            if not self._running[job.guild_id]:
+                del self._running[job.guild_id]
+            self.jobs.pop(job.id, None)
+            self._dispatch()
+    
+    def cancel(self, job_id: int, user_id: Optional[int] = None, guild_id: Optional[int] = None) -> bool:
+        """
+        Cancel a queued or running job
+        
+        Args:
+            job_id: Job to cancel
+            user_id: If given, only cancel when the job belongs to this user
+            guild_id: If given, only cancel when the job was submitted in this guild
+            
+        Returns:
+            True if the job was cancelled
+        """
+        job = self.jobs.get(job_id)
+        if job is None or (user_id is not None and job.user_id != user_id):
+            return False
+        if guild_id is not None and job.guild_id != guild_id:
+            return False
+        if job.status == 'running':
+            job.task.cancel()
+            return True
+        job.status = 'cancelled'
+        self._queued -= 1
+        self.stats['cancelled'] += 1
+        self.jobs.pop(job_id, None)
+        job.future.set_result(None)
+        return True
+    
+    def report(self) -> Dict[str, Any]:
+        """Queue depth, concurrency and wait-time metrics"""
+        waits = sorted(self.wait_times)
+        return {
+            **self.stats,
+            'queue_depth': self._queued,
+            'running': self._active,
+            'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+            'wait_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+        }
+    
+    async def stop(self):
+        """Cancel every queued and running job"""
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        tasks = [job.task for job in self.jobs.values() if job.task]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+DEFAULT_LEXICON: Dict[str, List[str]] = {
+    'greeting': ['hello', 'hi', 'hey', 'greetings'],
+    'help': ['help', 'assist', 'question'],
+    'thanks': ['thanks', 'thank you', 'appreciate'],
+    'goodbye': ['bye', 'goodbye', 'see you'],
+    'positive': ['good', 'great', 'awesome', 'love', 'happy', 'excellent'],
+    'negative': ['bad', 'hate', 'terrible', 'awful', 'sad', 'angry'],
+}
+
+
+class KeywordIndex:
+    """
+    Weighted multi-pattern keyword matcher with word boundaries
+    
+    Terms are split into words and stored in a word-level trie, so one pass
+    over the tokenized text finds every term (including multi-word ones such
+    as "thank you") with cost independent of lexicon size. A match counts
+    once per term, and each category's score is the sum of its matched term
+    weights.
+    """
+    
+    _TOKEN = re.compile(r"\w+")
+    _TERMINAL = ''
+    
+    def __init__(self):
+        self._terms: Dict[tuple, Dict[str, float]] = {}
+        self._root: Dict[str, Any] = {}
+        self.version = 0
+    
+    @classmethod
+    def from_lexicon(cls, lexicon: Dict[str, List[str]]) -> 'KeywordIndex':
+        """Build an index from a mapping of category to terms (weight 1.0)"""
+        index = cls()
+        index.extend((category, term, 1.0) for category, terms in lexicon.items() for term in terms)
+        return index
+    
+    def extend(self, entries: Iterable[tuple]) -> int:
+        """
+        Add (category, term, weight) entries and rebuild the trie
+        
+        The new trie is built aside and swapped in with a single assignment,
+        so this may run in a worker thread while the event loop keeps scanning.
+        
+        Returns:
+            Number of entries added
+        """
+        terms = {key: dict(categories) for key, categories in self._terms.items()}
+        added = 0
+        for category, term, weight in entries:
+            words = tuple(self._TOKEN.findall(term.lower()))
+            if words:
+                terms.setdefault(words, {})[category] = float(weight)
+                added += 1
+        
+        root: Dict[str, Any] = {}
+        for words, categories in terms.items():
+            node = root
+            for word in words:
+                node = node.setdefault(word, {})
+            node[self._TERMINAL] = categories
+        
+        self._terms = terms
+        self._root = root
+        self.version += 1
+        return added
+    
+    def entries(self) -> List[tuple]:
+        """All (category, term, weight) entries, e.g. to rebuild the index elsewhere"""
+        return [
+            (category, ' '.join(words), weight)
+            for words, categories in self._terms.items()
+            for category, weight in categories.items()
+        ]
+    
+    def load_lines(self, lines: Iterable[str]) -> int:
+        """
+        Add entries from ``category<TAB>term[<TAB>weight]`` lines
+        
+        Blank lines and lines starting with ``#`` are ignored.
+        
+        Raises:
+            ValueError: If a line is malformed
+        """
+        return self.extend(self.parse_lines(lines))
+    
+    @staticmethod
+    def parse_lines(lines: Iterable[str]) -> List[tuple]:
+        """
+        Parse ``category<TAB>term[<TAB>weight]`` lines into (category, term, weight) entries
+        
+        Raises:
+            ValueError: If a line is malformed
+        """
+        entries = []
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) not in (2, 3):
+                raise ValueError(f"Line {number}: expected category, term and optional weight")
+            try:
+                weight = float(fields[2]) if len(fields) == 3 else 1.0
+            except ValueError:
+                raise ValueError(f"Line {number}: weight must be a number")
+            entries.append((fields[0].strip(), fields[1].strip(), weight))
+        return entries
+    
+    def load_file(self, path: str) -> int:
+        """Add entries from a lexicon file (see ``load_lines``)"""
+        with open(path, encoding='utf-8') as f:
+            return self.load_lines(f)
+    
+    @staticmethod
+    def append_file(path: str, entries: Iterable[tuple]):
+        """Append (category, term, weight) entries to a lexicon file; later lines override earlier ones"""
+        with open(path, 'a', encoding='utf-8') as f:
+            f.writelines(f"{category}\t{term}\t{weight:g}\n" for category, term, weight in entries)
+    
+    def scan(self, text: str) -> Dict[str, float]:
+        """
+        Score every category in one pass over the text
+        
+        Returns:
+            Mapping of category to summed weight of matched terms
+        """
+        root = self._root
+        tokens = self._TOKEN.findall(text.lower())
+        matched: Dict[int, Dict[str, float]] = {}
+        for start in range(len(tokens)):
+            node = root.get(tokens[start])
+            position = start + 1
+            while node is not None:
+                categories = node.get(self._TERMINAL)
+                if categories is not None:
+                    matched[id(categories)] = categories
+                if position == len(tokens):
+                    break
+                node = node.get(tokens[position])
+                position += 1
+        
+        scores: Dict[str, float] = {}
+        for categories in matched.values():
+            for category, weight in categories.items():
+                scores[category] = scores.get(category, 0.0) + weight
+        return scores
+    
+    def __len__(self) -> int:
+        return len(self._terms)
+
+
+# Per-process analyzers, built by _analysis_init in each pool worker
+_WORKER_ANALYZERS: Dict[str, Any] = {}
+
+
+def _analysis_init(patterns: List[str], lexicon: List[tuple]):
+    """Pool initializer: build the rule engine and keyword index once per worker"""
+    keywords = KeywordIndex()
+    keywords.extend(lexicon)
+    _WORKER_ANALYZERS['moderation'] = ModerationRuleEngine(patterns).scan
+    _WORKER_ANALYZERS['keywords'] = keywords.scan
+    _WORKER_ANALYZERS['entities'] = EntityExtractor.scan
+
+
+def _analysis_batch(kind: str, texts: List[str]) -> List[Any]:
+    """Pool task: analyze a batch of texts of one kind"""
+    analyze = _WORKER_ANALYZERS[kind]
+    return [analyze(text) for text in texts]
+
+
+class TextAnalysisExecutor:
+    """
+    Async facade that moves CPU-heavy text analysis off the event loop
+    
+    Texts shorter than ``inline_chars`` are analyzed inline, where IPC would
+    cost more than the work. Longer texts are queued per analysis kind and sent
+    to a process pool in micro-batches of up to ``batch_size``, flushed after
+    ``batch_delay`` seconds. Workers hold their own copy of the rule engine and
+    keyword index; the pool is rebuilt when either changes.
+    
+    Kinds: ``moderation`` (rule engine scan), ``keywords`` (keyword index
+    scores) and ``entities`` (entity extraction).
+    
+    The pool is opt-in (``workers`` defaults to 0). Workers use the spawn
+    start method, which re-imports the main module in every worker, so the
+    bot's entry point must be guarded::
+    
+        if __name__ == '__main__':
+            bot.run(token)
+            
+    Without the guard each worker would start another bot.
+    """
+    
+    def __init__(
+        self,
+        engine: 'ModerationRuleEngine',
+        keywords: 'KeywordIndex',
+        workers: int = 0,
+        inline_chars: int = 1000,
+        batch_size: int = 32,
+        batch_delay: float = 0.005
+    ):
+        self.engine = engine
+        self.keywords = keywords
+        self.workers = workers
+        self.inline_chars = inline_chars
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._pool_version: Optional[tuple] = None
+        self._pending: Dict[str, List[tuple]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._batches: set = set()
+        self._closed = False
+        self.stats = {'inline': 0, 'offloaded': 0, 'batches': 0, 'fallbacks': 0, 'pool_rebuilds': 0}
+    
+    def analyze(self, kind: str, text: str) -> Any:
+        """Run one analysis synchronously in this process"""
+        if kind == 'moderation':
+            return self.engine.scan(text)
+        if kind == 'keywords':
+            return self.keywords.scan(text)
+        if kind == 'entities':
+            return EntityExtractor.scan(text)
+        raise ValueError(f"Unknown analysis kind: {kind}")
+    
+    async def run(self, kind: str, text: str) -> Any:
+        """
+        Analyze text, offloading long texts to the process pool
+        
+        Args:
+            kind: Analysis kind
+            text: Text to analyze
+            
+        Returns:
+            The analysis result, identical to ``analyze(kind, text)``
+        """
+        if self.workers <= 0 or self._closed or len(text) < self.inline_chars:
+            self.stats['inline'] += 1
+            return self.analyze(kind, text)
+        
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(kind, [])
+        pending.append((text, future))
+        if len(pending) >= self.batch_size:
+            self._flush(kind)
+        elif kind not in self._timers:
+            self._timers[kind] = asyncio.get_running_loop().call_later(self.batch_delay, self._flush, kind)
+        return await future
+    
+    def _flush(self, kind: str):
+        """Send the pending batch of one kind to the pool"""
+        timer = self._timers.pop(kind, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(kind, [])
+        if batch:
+            task = asyncio.create_task(self._run_batch(kind, batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+    
+    async def _run_batch(self, kind: str, batch: List[tuple]):
+        """Analyze a batch in the pool, falling back to inline analysis on failure"""
+        texts = [text for text, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._get_pool(), _analysis_batch, kind, texts
+            )
+            self.stats['offloaded'] += len(batch)
+            self.stats['batches'] += 1
+        except Exception as e:
+            logger.error(f"Error in analysis pool, analyzing inline: {e}")
+            self.stats['fallbacks'] += len(batch)
+            self._discard_pool()
+            results = []
+            for text in texts:
+                try:
+                    results.append(self.analyze(kind, text))
+                except Exception as inline_error:
+                    results.append(inline_error)
+        
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+    
+    def _get_pool(self) -> 'concurrent.futures.ProcessPoolExecutor':
+        """Return the pool, rebuilding it if the rules or lexicon changed"""
+        version = (self.engine.version, self.keywords.version)
+        if self._pool is not None and self._pool_version != version:
+            self._discard_pool()
+            self.stats['pool_rebuilds'] += 1
+        if self._pool is None:
+            import multiprocessing
+            # Spawned workers do not inherit the bot's threads or sockets
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_analysis_init,
+                initargs=(list(self.engine.patterns), self.keywords.entries())
+            )
+            self._pool_version = version
+        return self._pool
+    
+    def _discard_pool(self):
+        """Stop accepting work on the current pool; queued batches still finish"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+    
+    async def shutdown(self):
+        """Flush pending batches and shut the pool down"""
+        self._closed = True
+        for kind in list(self._pending):
+            self._flush(kind)
+        await asyncio.gather(*self._batches, return_exceptions=True)
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown, True)
+    
+    def report(self) -> Dict[str, Any]:
+        """Routing counters"""
+        return {**self.stats, 'workers': self.workers if self._pool else 0}
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a periodic callback"""
+    
+    def __init__(self, interval: float = 0.25, window: int = 1024):
+        self.interval = interval
+        self.samples: deque = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Start sampling"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample())
+    
+    async def _sample(self):
+        """Sleep for the interval and record the overshoot"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+    
+    def percentile(self, percentile: float) -> float:
+        """Lag in seconds at the given percentile (0-100)"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+    
+    def report(self) -> Dict[str, float]:
+        """Lag percentiles and maximum in milliseconds"""
+        return {
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.max_lag * 1000,
+        }
+    
+    async def stop(self):
+        """Stop sampling"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class Histogram:
+    """Cumulative-bucket histogram in Prometheus layout"""
+    
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+    
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation (0-1)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class MetricsRegistry:
+    """
+    In-process counters and histograms rendered in Prometheus text format
+    
+    Metrics are keyed by name and a sorted tuple of label pairs. Components
+    that already keep ``stats`` dicts are exposed through collectors, callables
+    returning ``(name, labels, value)`` gauges at render time, so nothing is
+    counted twice.
+    """
+    
+    PREFIX = 'discord_ai_'
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
     
     def __init__(self):
-        self.openai_api_key = ""
-        self.huggingface_api_key = ""
-        self.stability_api_key = ""
-        self.moderation_threshold = 0.7
-        self.enable_auto_response = True
-        self.enable_image_generation = True
-        self.enable_ai_moderation = True
-        self.response_cooldown = 5  # seconds
-        self.max_tokens = 150
+        self.counters: Dict[str, Dict[tuple, float]] = {}
+        self.histograms: Dict[str, Dict[tuple, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+    
+    def describe(self, name: str, text: str):
+        """Set the HELP text for a metric"""
+        self.help[name] = text
+    
+    def inc(self, name: str, value: float = 1.0, **labels: Any):
+        """Increment a counter"""
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0.0) + value
+    
+    def observe(self, name: str, value: float, **labels: Any):
+        """Record a value (seconds for latencies) in a histogram"""
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self.LATENCY_BUCKETS)
+        histogram.observe(value)
+    
+    @contextmanager
+    def timer(self, name: str, **labels: Any):
+        """Observe the duration of a block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def add_collector(self, collector: Callable[[], Iterable[tuple]]):
+        """Register a callable yielding (name, labels dict, value) gauges"""
+        self._collectors.append(collector)
+    
+    def render(self) -> str:
+        """Prometheus text exposition (format 0.0.4)"""
+        lines = []
+        
+        def header(name: str, kind: str):
+            if name in self.help:
+                lines.append(f"# HELP {self.PREFIX}{name} {self.help[name]}")
+            lines.append(f"# TYPE {self.PREFIX}{name} {kind}")
+        
+        for name, series in sorted(self.counters.items()):
+            header(name, 'counter')
+            for key, value in series.items():
+                lines.append(f"{self.PREFIX}{name}{self._labels(key)} {value:g}")
+        
+        for name, series in sorted(self.histograms.items()):
+            header(name, 'histogram')
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{self.PREFIX}{name}_bucket{self._labels(key + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{self.PREFIX}{name}_bucket{self._labels(key + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{self.PREFIX}{name}_sum{self._labels(key)} {histogram.sum:g}")
+                lines.append(f"{self.PREFIX}{name}_count{self._labels(key)} {histogram.count}")
+        
+        gauges: Dict[str, List[tuple]] = {}
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {e}")
+        for name, series in sorted(gauges.items()):
+            header(name, 'gauge')
+            for key, value in series:
+                lines.append(f"{self.PREFIX}{name}{self._labels(key)} {float(value):g}")
+        
+        return "\n".join(lines) + "\n"
+    
+    @staticmethod
+    def _labels(key: tuple) -> str:
+        """Format label pairs, escaping values per the exposition format"""
+        if not key:
+            return ""
+        pairs = []
+        for label, value in key:
+            escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{label}="{escaped}"')
+        return "{" + ",".join(pairs) + "}"
 
 
-class AIModeration:
-    """AI-powered content moderation"""
+class MetricsServer:
+    """Serves a MetricsRegistry at ``/metrics`` from a local aiohttp server"""
     
-    def __init__(self, config: AIConfig):
-        self.config = config
-        self.blocked_patterns = [
-            r'(?i)(spam|scam)',
-            r'(?i)(hate|racist|slur)',
-            r'(?i)(adult|nsfw)',
-        ]
-        self.warning_threshold = 3
-        self.user_warnings: Dict[int, int] = {}
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional['web.AppRunner'] = None
+    
+    async def start(self):
+        """Bind the endpoint"""
+        if self._runner is not None:
+            return
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError as e:
+            logger.error(f"Unable to serve metrics on {self.host}:{self.port}: {e}")
+            await runner.cleanup()
+            return
+        self._runner = runner
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+    
+    async def _handle(self, request: 'web.Request') -> 'web.Response':
+        from aiohttp import web
+        return web.Response(
+            text=self.registry.render(),
+            content_type='text/plain',
+            charset='utf-8',
+            headers={'X-Content-Type-Options': 'nosniff'}
+        )
+    
+    async def stop(self):
+        """Close the endpoint"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class SamplingProfiler:
+    """
+    Low-overhead sampling profiler for the event loop thread
+    
+    A daemon thread samples the target thread's stack every ``interval``
+    seconds and aggregates it in collapsed-stack form (``a;b;c count``), which
+    flamegraph.pl, speedscope and inferno read directly. The cumulative
+    profile is rewritten to ``path`` every ``flush_interval`` seconds and on
+    stop.
+    """
+    
+    def __init__(self, path: str, interval: float = 0.01, flush_interval: float = 10.0):
+        self.path = path
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.samples: Dict[str, int] = {}
+        self._target: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+    
+    def start(self, thread_id: Optional[int] = None):
+        """Start sampling ``thread_id`` (the calling thread by default)"""
+        if self._thread is not None:
+            return
+        self._target = thread_id or threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ai-profiler", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval
+    
+    def flush(self):
+        """Write the collapsed stacks collected so far"""
+        lines = [f"{stack} {count}\n" for stack, count in list(self.samples.items())]
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error writing profile {self.path}: {e}")
+    
+    def stop(self):
+        """Stop sampling and write the final profile"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+
+class HashingEmbedder:
+    """
+    Local text embedder needing only NumPy
+    
+    Words, word pairs and in-word character trigrams are hashed with CRC32
+    into ``dim`` signed buckets. This captures shared wording rather than
+    meaning, but it is stable across processes (unlike ``hash``), so
+    persisted indexes stay valid. Any callable taking a list of texts and
+    returning an (n, dim) array can be used instead, e.g. the ``encode``
+    method of a sentence-transformers model.
+    """
+    
+    _WORD = re.compile(r'\w+')
+    STOPWORDS = frozenset((
+        'a', 'an', 'and', 'are', 'be', 'can', 'do', 'does', 'for', 'how', 'i', 'in', 'is', 'it',
+        'me', 'my', 'of', 'on', 'or', 'the', 'to', 'what', 'with', 'you',
+    ))
+    
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+    
+    def features(self, text: str) -> List[tuple]:
+        """(feature, weight) pairs for text"""
+        words = self._WORD.findall(text.lower())
+        features = [(word, 0.25 if word in self.STOPWORDS else 1.0) for word in words]
+        features.extend((f"{first} {second}", 0.5) for first, second in zip(words, words[1:]))
+        for word in words:
+            if len(word) > 3 and word not in self.STOPWORDS:
+                padded = f"<{word}>"
+                features.extend((padded[i:i + 3], 0.2) for i in range(len(padded) - 2))
+        return features
+    
+    def __call__(self, texts: List[str]) -> 'np.ndarray':
+        import numpy as np
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets: Dict[int, float] = {}
+            for feature, weight in self.features(text):
+                digest = zlib.crc32(feature.encode('utf-8', 'surrogatepass'))
+                bucket = digest % self.dim
+                buckets[bucket] = buckets.get(bucket, 0.0) + (weight if digest & 0x80000000 else -weight)
+            if buckets:
+                vectors[row, list(buckets)] = list(buckets.values())
+        return vectors
+
+
+class FAQIndex:
+    """
+    Vector index of FAQ entries for cosine-similarity lookup (requires NumPy)
+    
+    Question embeddings are stored as unit-length float32 rows, so cosine
+    similarity is one matrix product. Every entry belongs to a guild and
+    searches only match rows of the querying guild. With a ``path`` the rows
+    live in a memory-mapped file and the entries in ``<path>.json``. Edits
+    are appended to ``<path>.log`` and folded into the JSON once the log
+    outgrows it, so an edit costs its own size rather than the whole index.
+    The index then reopens without re-embedding, and only pages that are
+    touched stay resident. Added entries fill rows freed by removals before
+    the file grows, by doubling. Removed rows are zeroed so they can never
+    match. Entry ids are row numbers.
+    """
     
-    async def check_content(self, content: str, user_id: int) -> Dict[str, Any]:
+    def __init__(
+        self,
+        embed: Callable[[List[str]], Any],
+        dim: int,
+        path: str = "",
+        initial_capacity: int = 1024,
+        embedder_name: str = ""
+    ):
+        self.embed = embed
+        self.dim = dim
+        self.path = path
+        self.embedder_name = embedder_name or getattr(embed, 'name', '')
+        # (question, answer, guild_id) per row, None for free rows
+        self.entries: List[Optional[tuple]] = []
+        self.live = 0
+        self.version = 0
+        self._free: List[int] = []
+        self._guild_live: Dict[int, int] = {}
+        self._vectors: Any = None
+        self._owners: Any = None
+        self._logged = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path) and os.path.exists(f"{path}.json"):
+            self._open()
+        else:
+            self._allocate(initial_capacity)
+            if path:
+                self._compact()
+    
+    @property
+    def capacity(self) -> int:
+        return len(self._vectors)
+    
+    def _allocate(self, capacity: int):
+        """Create or grow the vector storage to ``capacity`` rows"""
+        import numpy as np
+        owners = np.full(capacity, -1, dtype=np.int64)
+        if self._owners is not None:
+            owners[:len(self._owners)] = self._owners
+        self._owners = owners
+        if not self.path:
+            vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            if self._vectors is not None:
+                vectors[:len(self._vectors)] = self._vectors
+            self._vectors = vectors
+            return
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        # Growing the file appends zero rows; existing rows are not copied
+        with open(self.path, 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+    
+    def _open(self):
+        """Map an existing index file, read its entries and replay the edit log"""
+        import numpy as np
+        with open(f"{self.path}.json", encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['dim'] != self.dim or meta.get('embedder', '') != self.embedder_name:
+            raise ValueError(
+                f"FAQ index {self.path} was built by {meta.get('embedder') or 'another embedder'} "
+                f"with {meta['dim']} dimensions"
+            )
+        # Entries written before guild scoping belong to no guild (0)
+        self.entries = [(entry[0], entry[1], entry[2] if len(entry) > 2 else 0) if entry else None
+                        for entry in meta['entries']]
+        self._replay()
+        self._free = [row for row in range(len(self.entries) - 1, -1, -1) if self.entries[row] is None]
+        self.live = len(self.entries) - len(self._free)
+        for entry in self.entries:
+            if entry is not None:
+                self._guild_live[entry[2]] = self._guild_live.get(entry[2], 0) + 1
+        capacity = max(os.path.getsize(self.path) // (self.dim * 4), len(self.entries), 1)
+        self._vectors = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        self._owners = np.full(capacity, -1, dtype=np.int64)
+        for row, entry in enumerate(self.entries):
+            if entry is not None:
+                self._owners[row] = entry[2]
+    
+    def _replay(self):
+        """Apply edits logged since the entries file was last written"""
+        if not os.path.exists(f"{self.path}.log"):
+            return
+        with open(f"{self.path}.log", encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-append; its vectors were never referenced
+                    break
+                for row, question, answer, guild_id in record.get('add', ()):
+                    self.entries.extend([None] * (row + 1 - len(self.entries)))
+                    self.entries[row] = (question, answer, guild_id)
+                for row in record.get('remove', ()):
+                    if row < len(self.entries):
+                        self.entries[row] = None
+                self._logged += len(record.get('add', ())) + len(record.get('remove', ()))
+    
+    def _persist(self, record: Dict[str, list]):
+        """Flush vectors and append an edit to the log, compacting it once it outgrows the entries"""
+        if not self.path:
+            return
+        self._vectors.flush()
+        with open(f"{self.path}.log", 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._logged += sum(len(rows) for rows in record.values())
+        if self._logged > max(len(self.entries), 64):
+            self._compact()
+    
+    def _compact(self):
+        """Atomically rewrite the entries file and truncate the edit log"""
+        tmp = f"{self.path}.json.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'dim': self.dim,
+                'embedder': self.embedder_name,
+                'entries': [list(entry) if entry else None for entry in self.entries],
+            }, f, separators=(',', ':'))
+        os.replace(tmp, f"{self.path}.json")
+        # Replaying a log older than the entries file is harmless: every edit sets a row outright
+        open(f"{self.path}.log", 'w').close()
+        self._logged = 0
+    
+    def _embed(self, texts: List[str]) -> 'np.ndarray':
+        """Embed texts as unit-length float32 rows"""
+        import numpy as np
+        vectors = np.asarray(self.embed(texts), dtype=np.float32)
+        if vectors.shape != (len(texts), self.dim):
+            raise ValueError(f"Embedder returned shape {vectors.shape}, expected ({len(texts)}, {self.dim})")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+    
+    def add(self, pairs: Iterable[tuple], guild_id: int = 0) -> List[int]:
         """
-        Check content for moderation violations
+        Embed and add (question, answer) pairs
         
         Args:
-            content: Text to moderate
-            user_id: Discord user ID
+            pairs: (question, answer) pairs
+            guild_id: Guild whose searches the entries answer
             
         Returns:
-            Dict with moderation results
+            Entry ids in input order
         """
-        try:
-            violation_score = 0.0
-            violations = []
-            
-            # Pattern-based detection
-            for pattern in self.blocked_patterns:
-                if re.search(pattern, content):
-                    violation_score += 0.3
-                    violations.append(f"Pattern matched: {pattern}")
-            
-            # Check for excessive caps
-            if len(content) > 5 and sum(1 for c in content if c.isupper()) / len(content) > 0.7:
-                violation_score += 0.2
-                violations.append("Excessive capitalization")
-            
-            # Check for spam indicators
-            if len(content) > 100 and content.count(' ') < 5:
-                violation_score += 0.2
-                violations.append("Possible spam pattern")
-            
-            # Check for repeated characters
-            if re.search(r'(.)\1{4,}', content):
-                violation_score += 0.1
-                violations.append("Repeated characters detected")
-            
-            violation_score = min(violation_score, 1.0)
-            
-            return {
-                'is_violation': violation_score >= self.config.moderation_threshold,
-                'score': violation_score,
-                'violations': violations,
-                'action': self._determine_action(violation_score, user_id)
-            }
+        pairs = [(str(question), str(answer)) for question, answer in pairs]
+        if not pairs:
+            return []
+        vectors = self._embed([question for question, _ in pairs])
+        with self._lock:
+            rows = []
+            for question, answer in pairs:
+                if self._free:
+                    row = self._free.pop()
+                    self.entries[row] = (question, answer, guild_id)
+                else:
+                    row = len(self.entries)
+                    self.entries.append((question, answer, guild_id))
+                rows.append(row)
+            if len(self.entries) > self.capacity:
+                capacity = self.capacity
+                while capacity < len(self.entries):
+                    capacity *= 2
+                self._allocate(capacity)
+            self._vectors[rows] = vectors
+            self._owners[rows] = guild_id
+            self.live += len(rows)
+            self._guild_live[guild_id] = self._guild_live.get(guild_id, 0) + len(rows)
+            self.version += 1
+            self._persist({'add': [[row, question, answer, guild_id] for row, (question, answer) in zip(rows, pairs)]})
+        return rows
+    
+    def load_lines(self, lines: Iterable[str], guild_id: int = 0) -> List[int]:
+        """
+        Add entries from ``question<TAB>answer`` lines or JSON objects with
+        ``question`` and ``answer`` keys
         
-        except Exception as e:
-            logger.error(f"Error checking content: {e}")
-            return {
-                'is_violation': False,
-                'score': 0.0,
-                'violations': [],
-                'action': 'none'
-            }
+        Blank lines and lines starting with ``#`` are ignored, and ``\\n`` in
+        a tab-separated answer becomes a line break.
+        
+        Raises:
+            ValueError: If a line is malformed
+        """
+        pairs = []
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                try:
+                    entry = json.loads(line)
+                    pairs.append((entry['question'], entry['answer']))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    raise ValueError(f"Line {number}: expected an object with question and answer")
+                continue
+            fields = line.split('\t')
+            if len(fields) != 2 or not fields[0].strip() or not fields[1].strip():
+                raise ValueError(f"Line {number}: expected question and answer")
+            pairs.append((fields[0].strip(), fields[1].strip().replace('\\n', '\n')))
+        return self.add(pairs, guild_id)
     
-    def _determine_action(self, score: float, user_id: int) -> str:
-        """Determine moderation action based on score"""
-        if score >= 0.9:
-            return 'delete_and_ban'
-        elif score >= 0.7:
-            self.user_warnings[user_id] = self.user_warnings.get(user_id, 0) + 1
-            if self.user_warnings[user_id] >= self.warning_threshold:
-                return 'delete_and_kick'
-            return 'delete_and_warn'
-        elif score >= 0.5:
-            return 'delete'
-        return 'none'
+    def remove(self, ids: Iterable[int], guild_id: Optional[int] = None) -> int:
+        """Remove entries by id, only those of ``guild_id`` when given, returning how many were removed"""
+        with self._lock:
+            removed = [
+                row for row in set(ids)
+                if 0 <= row < len(self.entries) and self.entries[row] is not None
+                and (guild_id is None or self.entries[row][2] == guild_id)
+            ]
+            for row in removed:
+                owner = self.entries[row][2]
+                self._guild_live[owner] -= 1
+                self.entries[row] = None
+                self._vectors[row] = 0.0
+                self._owners[row] = -1
+            # Lowest rows are reused first
+            self._free = sorted(set(self._free) | set(removed), reverse=True)
+            self.live -= len(removed)
+            if removed:
+                self.version += 1
+                self._persist({'remove': removed})
+        return len(removed)
+    
+    def search(self, queries: List[str], k: int = 3, guild_ids: Optional[List[int]] = None) -> List[List[tuple]]:
+        """
+        Top-k cosine matches for each query in one matrix product
+        
+        Args:
+            queries: Query texts
+            k: Matches per query
+            guild_ids: Guild of each query, whose entries alone may match; None searches every guild
+            
+        Returns:
+            Per query, up to k (score, id, question, answer) tuples, best first
+        """
+        import numpy as np
+        if not queries:
+            return []
+        vectors = self._embed(queries)
+        with self._lock:
+            count = len(self.entries)
+            if not self.live:
+                return [[] for _ in queries]
+            scores = vectors @ self._vectors[:count].T
+            owners = self._owners[:count]
+            k = min(k, count)
+            results = []
+            # Row by row, so no index matrix the size of ``scores`` is allocated
+            for query, row_scores in enumerate(scores):
+                if guild_ids is not None:
+                    row_scores[owners != guild_ids[query]] = -np.inf
+                top = np.argpartition(row_scores, count - k)[count - k:]
+                results.append([
+                    (float(row_scores[row]), int(row)) + self.entries[row][:2]
+                    for row in top[np.argsort(-row_scores[top])]
+                    if self.entries[row] is not None and row_scores[row] > -np.inf
+                ])
+        return results
+    
+    def count(self, guild_id: int) -> int:
+        """Number of entries belonging to a guild"""
+        return self._guild_live.get(guild_id, 0)
+    
+    def close(self):
+        """Write pending vector changes to disk and fold the edit log into the entries file"""
+        with self._lock:
+            if self.path and self._vectors is not None:
+                self._vectors.flush()
+                if self._logged:
+                    self._compact()
+    
+    def __len__(self) -> int:
+        return self.live
 
 
-class ImageGeneration:
-    """AI image generation capabilities"""
+class FAQResponder:
+    """Answers messages from a FAQIndex, batching concurrent lookups into one top-k search"""
     
-    def __init__(self, config: AIConfig):
-        self.config = config
-        self.endpoint = "https://api.stability.ai/v1/generation"
-        self.session: Optional[aiohttp.ClientSession] = None
+    def __init__(
+        self,
+        index: FAQIndex,
+        threshold: float = 0.6,
+        top_k: int = 3,
+        batch_size: int = 32,
+        batch_delay: float = 0.005,
+        min_words: int = 3
+    ):
+        self.index = index
+        self.threshold = threshold
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.min_words = min_words
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: set = set()
+        self.latencies: deque = deque(maxlen=4096)
+        self.stats = {'lookups': 0, 'skipped': 0, 'searches': 0, 'answered': 0, 'errors': 0}
     
-    async def generate_image(self, prompt: str, style: str = "photorealistic") -> Optional[str]:
+    async def answer(self, text: str, guild_id: int = 0) -> Optional[tuple]:
         """
-        Generate image from text prompt
+        Best FAQ match for a message
         
         Args:
-            prompt: Text description of image
-            style: Style of image (photorealistic, artistic, anime, etc.)
+            text: Message content
+            guild_id: Guild whose entries may answer, 0 outside guilds
             
         Returns:
-            URL of generated image or None
+            (score, id, question, answer) above the threshold, or None
         """
-        try:
-            if not self.config.stability_api_key:
-                logger.warning("Stability API key not configured")
-                return None
-            
-            if self.session is None:
-                self.session = aiohttp.ClientSession()
-            
-            headers = {
-                "Authorization": f"Bearer {self.config.stability_api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "prompt": f"{prompt}, {style} style, high quality, detailed",
-                "negative_prompt": "blurry, low quality, distorted",
-                "steps": 30,
-                "cfg_scale": 7.5,
-                "width": 512,
-                "height": 512,
-                "samples": 1,
-                "sampler": "k_euler"
-            }
-            
-            async with self.session.post(
-                f"{self.endpoint}/stable-diffusion-v1-6/text-to-image",
-                headers=headers,
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=60)
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    if 'artifacts' in data and len(data['artifacts']) > 0:
-                        return data['artifacts'][0]['base64']
-                else:
-                    logger.error(f"Image generation failed: {resp.status}")
-            
+        if not self.index.count(guild_id) or len(HashingEmbedder._WORD.findall(text)) < self.min_words:
+            self.stats['skipped'] += 1
             return None
-        
+        self.stats['lookups'] += 1
+        matches = await self.search(text, guild_id)
+        if matches and matches[0][0] >= self.threshold:
+            self.stats['answered'] += 1
+            return matches[0]
+        return None
+    
+    async def search(self, text: str, guild_id: int = 0) -> List[tuple]:
+        """Top-k matches for text among a guild's entries, searched together with concurrent lookups"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, guild_id, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_delay, self._flush)
+        started = time.perf_counter()
+        result = await asyncio.shield(future)
+        self.latencies.append(time.perf_counter() - started)
+        return result
+    
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+    
+    async def _run_batch(self, batch: List[tuple]):
+        """Search a batch off the event loop and resolve its waiters"""
+        self.stats['searches'] += 1
+        try:
+            results = await asyncio.to_thread(
+                self.index.search,
+                [text for text, _, _ in batch],
+                self.top_k,
+                [guild_id for _, guild_id, _ in batch]
+            )
         except Exception as e:
-            logger.error(f"Error generating image: {e}")
-            return None
+            logger.error(f"Error searching FAQ index: {e}")
+            self.stats['errors'] += 1
+            results = [[] for _ in batch]
+        for (_, _, future), matches in zip(batch, results):
+            if not future.done():
+                future.set_result(matches)
     
-    async def close(self):
-        """Close aiohttp session"""
-        if self.session:
-            await self.session.close()
+    def report(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            **self.stats,
+            'entries': len(self.index),
+            'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+            'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        }
 
 
 class AIAutoResponse:
     """AI-powered auto-response system"""
     
-    def __init__(self, config: AIConfig):
+    # Checked in order; the first intent wins ties
+    INTENTS = ('greeting', 'help', 'thanks', 'goodbye')
+    
+    def __init__(
+        self,
+        config: AIConfig,
+        keywords: Optional[KeywordIndex] = None,
+        state: Optional[SharedStateBackend] = None
+    ):
         self.config = config
+        self.keywords = keywords or KeywordIndex.from_lexicon(DEFAULT_LEXICON)
         self.responses: Dict[str, List[str]] = {
             'greeting': [
                 "Hello! How can I assist you?",
@@ -209,62 +4281,434 @@ class AIAutoResponse:
                 "Goodbye! Have a great day!",
             ]
         }
-        self.user_cooldowns: Dict[int, datetime] = {}
+        if state is None:
+            self.user_cooldowns = StateStore(
+                max_entries=config.state_max_entries,
+                ttl=config.cooldown_ttl
+            )
+        else:
+            self.user_cooldowns = SharedStateStore(
+                state,
+                'cooldowns',
+                max_entries=config.state_max_entries,
+                ttl=config.cooldown_ttl,
+                encode=SharedStateStore.to_wall,
+                decode=SharedStateStore.from_wall,
+                flush_delay=config.shared_state_flush_delay
+            )
+        # Semantic FAQ answers, tried before intents when attached
+        self.faq: Optional[FAQResponder] = None
+    
+    async def get_response(
+        self,
+        content: str,
+        user_id: int,
+        cooldown: Optional[float] = None,
+        guild_id: int = 0
+    ) -> Optional[str]:
+        """
+        Generate appropriate auto-response
+        
+        Args:
+            content: User message content
+            user_id: Discord user ID
+            cooldown: Per-user cooldown in seconds, defaults to config.response_cooldown
+            guild_id: Guild whose FAQ entries may answer, 0 outside guilds
+            
+        Returns:
+            Response string or None
+        """
+        if cooldown is None:
+            cooldown = self.config.response_cooldown
+        try:
+            # Check cooldown
+            last_response = await self.user_cooldowns.fetch(user_id)
+            if last_response is not None:
+                if time.monotonic() - last_response < cooldown:
+                    return None
+            
+            match = await self.faq.answer(content, guild_id) if self.faq else None
+            if match is not None:
+                response = match[3]
+            else:
+                # Detect intent: highest-scoring known intent, earliest on ties
+                scores = self.keywords.scan(content)
+                intent = max(
+                    (name for name in self.INTENTS if name in scores and name in self.responses),
+                    key=lambda name: scores[name],
+                    default=None
+                )
+                if intent is None:
+                    return None
+                
+                # Get random response for intent
+                response = random.choice(self.responses[intent])
+            
+            # Update cooldown
+            self.user_cooldowns[user_id] = time.monotonic()
+            
+            return response
+        
+        except Exception as e:
+            logger.error(f"Error generating auto-response: {e}")
+            return None
+
+
+class SSEParser:
+    """Incremental parser for ``text/event-stream`` bodies"""
+    
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._pending = ""
+        self._data: List[str] = []
+    
+    def feed(self, chunk: bytes) -> List[str]:
+        """Consume bytes and return the data payloads of completed events"""
+        self._pending += self._decoder.decode(chunk)
+        events = []
+        *lines, self._pending = self._pending.split('\n')
+        for line in lines:
+            line = line.rstrip('\r')
+            if not line:
+                if self._data:
+                    events.append("\n".join(self._data))
+                    self._data = []
+            elif line.startswith('data:'):
+                self._data.append(line[5:].lstrip(' '))
+        return events
+
+
+class CompletionBackend(ABC):
+    """Interface for chat completion providers"""
+    
+    @abstractmethod
+    async def stream(self, messages: List[Dict], max_tokens: int) -> AsyncIterator[str]:
+        """Yield response text deltas as they arrive"""
+        raise NotImplementedError
+        yield  # An async generator like its implementations, so ``async for`` reaches the error
+    
+    async def complete(self, messages: List[Dict], max_tokens: int) -> Optional[str]:
+        """Return the full response text, or None on failure"""
+        parts = [delta async for delta in self.stream(messages, max_tokens)]
+        return "".join(parts) or None
+
+
+class OpenAICompatibleBackend(CompletionBackend):
+    """Streaming client for OpenAI-compatible ``/chat/completions`` endpoints"""
+    
+    def __init__(self, config: AIConfig, http: AIHTTPClient):
+        self.config = config
+        self.http = http
+    
+    async def stream(self, messages: List[Dict], max_tokens: int) -> AsyncIterator[str]:
+        payload = {
+            'model': self.config.openai_model,
+            'messages': messages,
+            'max_tokens': max_tokens,
+            'stream': True,
+        }
+        headers = {
+            "Authorization": f"Bearer {self.config.openai_api_key}",
+            "Accept": "text/event-stream"
+        }
+        
+        async with self.http.stream(
+            'POST',
+            f"{self.config.openai_base_url.rstrip('/')}/chat/completions",
+            headers=headers,
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=120, sock_read=30)
+        ) as resp:
+            if resp is None or resp.status != 200:
+                logger.error(f"Completion request failed: {resp.status if resp else 'no response'}")
+                return
+            
+            parser = SSEParser()
+            async for chunk in resp.content.iter_any():
+                for event in parser.feed(chunk):
+                    if event == '[DONE]':
+                        return
+                    try:
+                        data = json.loads(event)
+                    except ValueError:
+                        logger.warning("Skipping malformed completion event")
+                        continue
+                    if data.get('error'):
+                        # Providers report failures after a 200 as an error event
+                        logger.error(f"Completion stream failed: {data['error']}")
+                        return
+                    choices = data.get('choices') or [{}]
+                    delta = choices[0].get('delta', {}).get('content')
+                    if delta:
+                        yield delta
+
+
+class ConversationTurn:
+    """One chat message with its cached token count"""
+    
+    __slots__ = ('message', 'tokens')
+    
+    def __init__(self, role: str, content: str, tokens: int):
+        self.message = {'role': role, 'content': content}
+        self.tokens = tokens
+
+
+class Conversation:
+    """A user's recent turns plus a rolling summary of older ones"""
+    
+    __slots__ = ('turns', 'tokens', 'summary', 'summary_tokens', 'version', '_system')
+    
+    def __init__(self):
+        self.turns: deque = deque()
+        self.tokens = 0
+        self.summary: deque = deque()
+        self.summary_tokens = 0
+        self.version = 0
+        self._system: Optional[tuple] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable form for StatePersistence"""
+        return {
+            'turns': [[turn.message['role'], turn.message['content']] for turn in self.turns],
+            'summary': list(self.summary),
+        }
+
+
+class ConversationContextManager:
+    """
+    Token-budgeted conversation context for chat completions
+    
+    Turns are stored with their token counts so trimming and request
+    building never re-measure text. When a conversation exceeds the budget,
+    the oldest turns are folded into a short rolling summary that rides in
+    the system message.
+    """
+    
+    SUMMARY_LINE_CHARS = 160
+    
+    def __init__(self, token_budget: int = 1024, summary_budget: int = 200):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+    
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """Approximate token count (about four characters per token)"""
+        return (len(text) + 3) // 4 + 1
+    
+    def append(self, conversation: Conversation, role: str, content: str, reserved: int = 0):
+        """
+        Add a turn and trim the conversation back under budget
+        
+        Args:
+            conversation: Conversation to extend
+            role: Chat role of the turn
+            content: Message text
+            reserved: Tokens already spoken for (e.g. the system prompt)
+        """
+        turn = ConversationTurn(role, content, self.count_tokens(content))
+        conversation.turns.append(turn)
+        conversation.tokens += turn.tokens
+        budget = self.token_budget - reserved
+        while len(conversation.turns) > 1 and conversation.tokens + conversation.summary_tokens > budget:
+            self._fold(conversation, conversation.turns.popleft())
     
-    async def get_response(self, content: str, user_id: int) -> Optional[str]:
+    def _fold(self, conversation: Conversation, turn: ConversationTurn):
+        """Move a turn into the summary, dropping the oldest summary lines if needed"""
+        conversation.tokens -= turn.tokens
+        text = " ".join(turn.message['content'].split())
+        if len(text) > self.SUMMARY_LINE_CHARS:
+            text = text[:self.SUMMARY_LINE_CHARS].rsplit(' ', 1)[0] + "..."
+        line = f"{turn.message['role']}: {text}"
+        conversation.summary.append(line)
+        conversation.summary_tokens += self.count_tokens(line)
+        while len(conversation.summary) > 1 and conversation.summary_tokens > self.summary_budget:
+            conversation.summary_tokens -= self.count_tokens(conversation.summary.popleft())
+        conversation.version += 1
+    
+    def build(self, conversation: Conversation, context: str = "") -> List[Dict]:
         """
-        Generate appropriate auto-response
+        Build the request messages for a conversation
         
         Args:
-            content: User message content
-            user_id: Discord user ID
+            conversation: Conversation to render
+            context: System prompt; the summary of folded turns is appended to it
             
         Returns:
-            Response string or None
+            List of chat messages, system message first
         """
-        try:
-            # Check cooldown
-            if user_id in self.user_cooldowns:
-                elapsed = (datetime.utcnow() - self.user_cooldowns[user_id]).total_seconds()
-                if elapsed < self.config.response_cooldown:
-                    return None
-            
-            content_lower = content.lower()
-            
-            # Detect intent
-            if any(word in content_lower for word in ['hello', 'hi', 'hey', 'greetings']):
-                intent = 'greeting'
-            elif any(word in content_lower for word in ['help', 'assist', 'question']):
-                intent = 'help'
-            elif any(word in content_lower for word in ['thanks', 'thank you', 'appreciate']):
-                intent = 'thanks'
-            elif any(word in content_lower for word in ['bye', 'goodbye', 'see you']):
-                intent = 'goodbye'
-            else:
-                return None
-            
-            # Get random response for intent
-            import random
-            response = random.choice(self.responses[intent])
-            
-            # Update cooldown
-            self.user_cooldowns[user_id] = datetime.utcnow()
-            
-            return response
+        cached = conversation._system
+        if cached is None or cached[0] != context or cached[1] != conversation.version:
+            system = context
+            if conversation.summary:
+                summary = "\n".join(conversation.summary)
+                system = f"{context}\n\nEarlier in this conversation:\n{summary}" if context else summary
+            cached = (context, conversation.version, {'role': 'system', 'content': system} if system else None)
+            conversation._system = cached
         
-        except Exception as e:
-            logger.error(f"Error generating auto-response: {e}")
+        messages = [cached[2]] if cached[2] else []
+        messages.extend(turn.message for turn in conversation.turns)
+        return messages
+    
+    def restore(self, data: Any) -> Conversation:
+        """Rebuild a conversation from its persisted form"""
+        conversation = Conversation()
+        if isinstance(data, list):
+            # Plain message list written before summaries existed
+            data = {'turns': [[m['role'], m['content']] for m in data], 'summary': []}
+        for line in data.get('summary', []):
+            conversation.summary.append(line)
+            conversation.summary_tokens += self.count_tokens(line)
+        for role, content in data.get('turns', []):
+            self.append(conversation, role, content)
+        return conversation
+
+
+class Entity(NamedTuple):
+    """One extracted entity and its position in the text"""
+    
+    kind: str
+    text: str
+    start: int
+    end: int
+
+
+class EntityExtractor:
+    """
+    Single-scan entity extraction with Discord-native entity types
+    
+    All entity patterns are alternatives of one precompiled regex, tried in
+    priority order at each position, so the text is scanned once and an entity
+    never also matches as a smaller one (an email is not a mention, the ID
+    inside ``<@123>`` is not a number). Inline code and code blocks are
+    skipped, since Discord shows their contents literally. Repeated entities
+    are reported once, at their first offset. Results can be cached per
+    message ID so moderation and commands share one extraction.
+    """
+    
+    KINDS = (
+        'users', 'roles', 'channels', 'emoji', 'timestamps', 'invites',
+        'urls', 'emails', 'mentions', 'snowflakes', 'numbers',
+    )
+    # Every alternative starts with one character from a single class, which
+    # lets the regex engine skip ahead to candidate positions in C; the
+    # lookbehinds then pick the branch for the character just consumed.
+    _PATTERN = re.compile(
+        r'[<@hd\d`](?:'
+        r'(?<=`)(?P<code>``[\s\S]*?```|`(?:[^`]|`(?!`))+``|[^`]+`)'
+        r'|(?<=<)(?:'
+        r'(?P<users>@!?\d{15,21}>)'
+        r'|(?P<roles>@&\d{15,21}>)'
+        r'|(?P<channels>#\d{15,21}>)'
+        r'|(?P<emoji>a?:\w{2,32}:\d{15,21}>)'
+        r'|(?P<timestamps>t:-?\d{1,13}(?::[tTdDfFR])?>))'
+        r'|(?<=h)(?:'
+        r'(?P<invites>ttps?://(?:www\.)?discord(?:app)?\.(?:com/invite|gg)/[\w-]+)'
+        r'|(?P<urls>ttps?://[^\s<>]*[^\s<>.,;:!?)\]\'"]))'
+        r'|(?<=d)(?P<bare_invites>iscord(?:app)?\.(?:com/invite|gg)/[\w-]+)'
+        r'|(?<=[\w.+-]@)(?P<emails>[\w-]+(?:\.[\w-]+)+)'
+        r'|(?<=@)(?P<mentions>\w+)'
+        r'|(?<=\d)(?<!\w\d)(?P<numbers>\d*(?![\w.+-]*@)(?!\w))'
+        r')'
+    )
+    # Emails are found by their "@"; the local part is matched on the reversed
+    # 64 characters before it, which costs one pass instead of a search from
+    # every starting position
+    _LOCAL_PART = re.compile(r'[\w.+-]{1,64}')
+    
+    def __init__(self, cache_size: int = 10000, cache_ttl: float = 600):
+        self.cache = StateStore(max_entries=cache_size, ttl=cache_ttl)
+    
+    @classmethod
+    def scan(cls, text: str) -> Dict[str, List[Entity]]:
+        """Extract deduplicated entities grouped by kind (safe to run in a worker process)"""
+        found: Dict[str, List[Entity]] = {kind: [] for kind in cls.KINDS}
+        seen = set()
+        # Entity's generated __new__ is a Python-level call, too slow once per span
+        make = tuple.__new__
+        for match in cls._PATTERN.finditer(text):
+            kind = match.lastgroup
+            if kind == 'code':
+                continue
+            start, end = match.span()
+            if kind == 'bare_invites':
+                kind = 'invites'
+            elif kind == 'emails':
+                start -= cls._LOCAL_PART.match(text[max(0, start - 64):start][::-1]).end()
+            elif kind == 'numbers' and 17 <= end - start <= 21:
+                kind = 'snowflakes'
+            value = text[start:end]
+            # The text alone determines the kind, so it is enough to deduplicate on
+            if value in seen:
+                continue
+            seen.add(value)
+            found[kind].append(make(Entity, (kind, value, start, end)))
+        return found
+    
+    def cached(self, text: str, message_id: Optional[int]) -> Optional[Dict[str, List[Entity]]]:
+        """Entities already extracted for this message, unless it was edited"""
+        if message_id is None:
+            return None
+        entry = self.cache.get(message_id)
+        if entry is None or entry[0] != text:
             return None
+        return entry[1]
+    
+    def store(self, text: str, message_id: Optional[int], entities: Dict[str, List[Entity]]):
+        """Remember the entities extracted for a message"""
+        if message_id is not None:
+            self.cache[message_id] = (text, entities)
+    
+    def extract(self, text: str, message_id: Optional[int] = None) -> Dict[str, List[Entity]]:
+        """Extract entities, reusing the cached result for ``message_id``"""
+        entities = self.cached(text, message_id)
+        if entities is None:
+            entities = self.scan(text)
+            self.store(text, message_id, entities)
+        return entities
 
 
 class AdvancedAIFeatures:
     """Advanced AI capabilities"""
     
-    def __init__(self, config: AIConfig):
+    def __init__(
+        self,
+        config: AIConfig,
+        persistence: Optional[StatePersistence] = None,
+        http: Optional[AIHTTPClient] = None,
+        backend: Optional[CompletionBackend] = None,
+        keywords: Optional[KeywordIndex] = None,
+        state: Optional[SharedStateBackend] = None
+    ):
         self.config = config
-        self.session: Optional[aiohttp.ClientSession] = None
-        self.conversation_history: Dict[int, List[Dict]] = {}
-        self.max_history_length = 10
+        self.persistence = persistence
+        self.keywords = keywords or KeywordIndex.from_lexicon(DEFAULT_LEXICON)
+        self.analyzer: Optional[TextAnalysisExecutor] = None
+        self._owns_http = http is None
+        self.http = http or AIHTTPClient()
+        self.backend = backend or OpenAICompatibleBackend(config, self.http)
+        self.latencies = {'first_token': deque(maxlen=1024), 'total': deque(maxlen=1024)}
+        self.context_manager = ConversationContextManager(
+            token_budget=config.context_window - config.max_tokens,
+            summary_budget=config.summary_tokens
+        )
+        if state is None:
+            self.conversation_history = StateStore(
+                max_entries=config.conversation_max_users,
+                ttl=config.conversation_ttl,
+                loader=self._load_history if persistence else None
+            )
+        else:
+            self.conversation_history = SharedStateStore(
+                state,
+                'conversations',
+                max_entries=config.conversation_max_users,
+                ttl=config.conversation_ttl,
+                loader=self._load_history if persistence else None,
+                encode=Conversation.to_dict,
+                decode=self.context_manager.restore,
+                flush_delay=config.shared_state_flush_delay
+            )
+        self.entities = EntityExtractor(cache_size=config.entity_cache_size)
     
     async def generate_response(self, prompt: str, user_id: int, context: str = "") -> Optional[str]:
         """
@@ -279,55 +4723,94 @@ class AdvancedAIFeatures:
             Generated response or None
         """
         try:
-            if self.session is None:
-                self.session = aiohttp.ClientSession()
+            await self.conversation_history.fetch(user_id)
+            conversation, messages, reserved = self._prepare(prompt, user_id, context)
             
-            # Maintain conversation history
-            if user_id not in self.conversation_history:
-                self.conversation_history[user_id] = []
-            
-            # Add to history
-            self.conversation_history[user_id].append({
-                'role': 'user',
-                'content': prompt
-            })
-            
-            # Keep history manageable
-            if len(self.conversation_history[user_id]) > self.max_history_length:
-                self.conversation_history[user_id].pop(0)
-            
-            # Build messages with context
-            messages = []
-            if context:
-                messages.append({'role': 'system', 'content': context})
-            messages.extend(self.conversation_history[user_id])
-            
-            # Placeholder for AI API call
             response = await self._call_ai_api(messages)
             
-            if response:
-                self.conversation_history[user_id].append({
-                    'role': 'assistant',
-                    'content': response
-                })
-            
+            self._record(user_id, conversation, response, reserved)
             return response
         
         except Exception as e:
             logger.error(f"Error generating AI response: {e}")
             return None
     
-    async def _call_ai_api(self, messages: List[Dict]) -> Optional[str]:
+    async def stream_response(self, prompt: str, user_id: int, context: str = "") -> AsyncIterator[str]:
         """
-        Call AI API for response generation
-        Placeholder implementation - replace with actual API
+        Generate AI response with conversation context, yielding text as it streams
+        
+        Args:
+            prompt: User prompt/question
+            user_id: Discord user ID
+            context: Additional context for response
+            
+        Yields:
+            Response text deltas; nothing if generation failed
         """
+        await self.conversation_history.fetch(user_id)
+        conversation, messages, reserved = self._prepare(prompt, user_id, context)
+        
+        if not self.config.openai_api_key:
+            response = await self._call_ai_api(messages)
+            self._record(user_id, conversation, response, reserved)
+            if response:
+                yield response
+            return
+        
+        parts: List[str] = []
+        started = time.perf_counter()
+        try:
+            async for delta in self.backend.stream(messages, self.config.max_tokens):
+                if not parts:
+                    self.latencies['first_token'].append(time.perf_counter() - started)
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            logger.error(f"Error streaming AI response: {e}")
+        finally:
+            self.latencies['total'].append(time.perf_counter() - started)
+            self._record(user_id, conversation, "".join(parts) or None, reserved)
+    
+    def _prepare(self, prompt: str, user_id: int, context: str) -> tuple:
+        """Add the prompt to the user's conversation and build request messages"""
+        # Maintain conversation history
+        conversation = self.conversation_history.get(user_id)
+        if conversation is None:
+            conversation = Conversation()
+            self.conversation_history[user_id] = conversation
+        
+        # Add to history, trimming to the token budget left after the system prompt
+        reserved = self.context_manager.count_tokens(context)
+        self.context_manager.append(conversation, 'user', prompt, reserved)
+        
+        # Build messages with context
+        return conversation, self.context_manager.build(conversation, context), reserved
+    
+    def _record(self, user_id: int, conversation: Conversation, response: Optional[str], reserved: int):
+        """Add the reply to the conversation and persist it"""
+        if response:
+            self.context_manager.append(conversation, 'assistant', response, reserved)
+        
+        # Reassigning publishes the updated conversation to shared state
+        self.conversation_history[user_id] = conversation
+        if self.persistence:
+            self.persistence.save('conversations', user_id, conversation.to_dict())
+    
+    def _load_history(self, user_id: int) -> Optional[Conversation]:
+        """Load a persisted conversation"""
+        data = self.persistence.load('conversations', user_id)
+        return self.context_manager.restore(data) if data is not None else None
+    
+    async def _call_ai_api(self, messages: List[Dict]) -> Optional[str]:
+        """Call the completion backend for a full response"""
         try:
             if not self.config.openai_api_key:
                 return "AI service not configured. Please set up API keys."
             
-            # Example implementation
-            return "I'm an AI assistant. This is a placeholder response. Configure your API keys to enable full functionality."
+            started = time.perf_counter()
+            response = await self.backend.complete(messages, self.config.max_tokens)
+            self.latencies['total'].append(time.perf_counter() - started)
+            return response
         
         except Exception as e:
             logger.error(f"Error calling AI API: {e}")
@@ -341,13 +4824,13 @@ class AdvancedAIFeatures:
             Dict with sentiment scores (positive, negative, neutral)
         """
         try:
-            # Simple sentiment analysis
-            positive_words = ['good', 'great', 'awesome', 'love', 'happy', 'excellent']
-            negative_words = ['bad', 'hate', 'terrible', 'awful', 'sad', 'angry']
-            
-            text_lower = text.lower()
-            pos_score = sum(1 for word in positive_words if word in text_lower)
-            neg_score = sum(1 for word in negative_words if word in text_lower)
+            # Lexicon-based sentiment analysis
+            if self.analyzer is None:
+                scores = self.keywords.scan(text)
+            else:
+                scores = await self.analyzer.run('keywords', text)
+            pos_score = scores.get('positive', 0.0)
+            neg_score = scores.get('negative', 0.0)
             
             total = pos_score + neg_score + 1
             
@@ -361,134 +4844,842 @@ class AdvancedAIFeatures:
             logger.error(f"Error analyzing sentiment: {e}")
             return {'positive': 0.0, 'negative': 0.0, 'neutral': 1.0}
     
-    async def extract_entities(self, text: str) -> Dict[str, List[str]]:
+    async def extract_entities(self, text: str, message_id: Optional[int] = None) -> Dict[str, List[str]]:
         """
-        Extract entities from text (names, dates, locations, etc.)
+        Extract entities from text (mentions, links, emails, IDs, etc.)
         
+        Args:
+            text: Text to scan
+            message_id: Discord message ID, to reuse a cached extraction
+            
         Returns:
             Dict with extracted entities by type
         """
+        spans = await self.extract_spans(text, message_id)
+        return {kind: [entity.text for entity in entities] for kind, entities in spans.items()}
+    
+    async def extract_spans(self, text: str, message_id: Optional[int] = None) -> Dict[str, List[Entity]]:
+        """
+        Extract entities with their offsets
+        
+        Returns:
+            Dict of entity kind to deduplicated Entity spans in text order
+        """
         try:
-            entities = {
-                'mentions': re.findall(r'@\w+', text),
-                'urls': re.findall(r'http[s]?://\S+', text),
-                'emails': re.findall(r'\S+@\S+', text),
-                'numbers': re.findall(r'\b\d+\b', text),
-            }
+            entities = self.entities.cached(text, message_id)
+            if entities is None:
+                if self.analyzer is None:
+                    entities = EntityExtractor.scan(text)
+                else:
+                    entities = await self.analyzer.run('entities', text)
+                self.entities.store(text, message_id, entities)
             return entities
         
         except Exception as e:
             logger.error(f"Error extracting entities: {e}")
-            return {'mentions': [], 'urls': [], 'emails': [], 'numbers': []}
+            return {kind: [] for kind in EntityExtractor.KINDS}
     
     async def close(self):
-        """Close aiohttp session"""
-        if self.session:
-            await self.session.close()
+        """Close the HTTP client if this instance created it"""
+        if self._owns_http:
+            await self.http.close()
+
+
+class MessageSplitter:
+    """
+    Splits text into Discord-sized chunks at natural boundaries
+    
+    Cuts prefer, in order, a blank line, a line break, the end of a sentence
+    and a space, as long as that keeps a chunk at least half full; otherwise
+    the cut is a hard one that steps back out of emoji sequences and
+    combining marks. A chunk that ends inside a code fence gets a closing
+    fence, and the next chunk reopens it with the same language. Fences
+    whose marker is longer than an eighth of the limit are left unrepaired,
+    and so is a language that long, so the repair never crowds out content.
+    """
+    
+    _FENCE = re.compile(r'^[ \t]*(`{3,}|~{3,})[ \t]*([^`\s]*)')
+    _SENTENCE = re.compile(r'[.!?][)"\'\]]*\s')
+    # Code points that continue a grapheme: ZWJ, variation selectors, skin tones, tag characters
+    _EXTENDERS = re.compile('[\u200d\ufe0e\ufe0f\U0001f3fb-\U0001f3ff\U000e0020-\U000e007f]')
+    _REGIONAL = re.compile('[\U0001f1e6-\U0001f1ff]')
+    
+    def __init__(self, limit: int = 2000):
+        self.limit = limit
+    
+    def split(self, text: str) -> List[str]:
+        """
+        Split text into chunks of at most ``limit`` characters
+        
+        Args:
+            text: Text to split
+            
+        Returns:
+            Chunks in order, without leading or trailing blank lines
+        """
+        chunks: List[str] = []
+        reopen = ""
+        fence = None
+        pos = 0
+        text = text.strip('\n')
+        while pos < len(text):
+            budget = self.limit - len(reopen)
+            if len(text) - pos <= budget:
+                chunks.append(reopen + text[pos:])
+                break
+            # Leave room for the closing fence; a longer one opening inside the piece needs another pass
+            reserve = self._closing(fence)
+            while True:
+                cut, resume = self._boundary(text, pos, pos + max(1, budget - reserve))
+                if resume <= pos:
+                    cut = resume = pos + max(1, budget - reserve)
+                piece = text[pos:cut].rstrip()
+                after = self._fence_state(piece, fence)
+                if self._closing(after) <= reserve:
+                    break
+                reserve = self._closing(after)
+            fence = after
+            if self._closing(fence):
+                chunks.append(f"{reopen}{piece}\n{fence[0]}")
+                language = fence[1] if len(fence[1]) <= self.limit // 8 else ""
+                reopen = f"{fence[0]}{language}\n"
+            else:
+                chunks.append(reopen + piece)
+                reopen = ""
+            pos = resume
+        return [chunk for chunk in chunks if chunk.strip()]
+    
+    def _closing(self, fence: Optional[tuple]) -> int:
+        """Characters needed to close ``fence`` at the end of a chunk, 0 if it is not repaired"""
+        if fence is None or len(fence[0]) > self.limit // 8:
+            return 0
+        return len(fence[0]) + 1
+    
+    def _boundary(self, text: str, start: int, end: int) -> tuple:
+        """Best cut in text[start:end], as (end of chunk, start of the next)"""
+        floor = start + (end - start) // 2
+        for separator in ("\n\n", "\n"):
+            index = text.rfind(separator, floor, end)
+            if index != -1:
+                return index, index + len(separator)
+        last = None
+        for last in self._SENTENCE.finditer(text, floor, end):
+            pass
+        if last is not None:
+            return last.end() - 1, last.end()
+        index = text.rfind(" ", floor, end)
+        if index != -1:
+            return index, index + 1
+        cut = end
+        while cut > start + 1 and self._joins(text, cut):
+            cut -= 1
+        return cut, cut
+    
+    def _joins(self, text: str, index: int) -> bool:
+        """Whether a cut before text[index] would split a grapheme"""
+        char = text[index]
+        if self._EXTENDERS.match(char) or text[index - 1] == '\u200d':
+            return True
+        if unicodedata.category(char) in ('Mn', 'Mc', 'Me'):
+            return True
+        if self._REGIONAL.match(char) and self._REGIONAL.match(text[index - 1]):
+            # Flags are pairs; count the run to see if this starts a new one
+            run = 0
+            while index - run - 1 >= 0 and self._REGIONAL.match(text[index - run - 1]):
+                run += 1
+            return run % 2 == 1
+        return False
+    
+    @classmethod
+    def _fence_state(cls, text: str, fence: Optional[tuple]) -> Optional[tuple]:
+        """Fence (marker, language) still open after text, given the one open before it"""
+        for line in text.split('\n'):
+            match = cls._FENCE.match(line)
+            if match is None:
+                continue
+            marker = match.group(1)
+            if fence is None:
+                fence = (marker, match.group(2))
+            elif marker[0] == fence[0][0] and len(marker) >= len(fence[0]) and not match.group(2):
+                fence = None
+        return fence
+
+
+class ChannelRateLimiter:
+    """
+    Per-channel token bucket for outgoing messages
+    
+    Sends are paced to ``rate`` per second with bursts of ``burst``, roughly
+    Discord's per-channel message limit. When Discord still answers with a
+    rate limit (``discord.RateLimited``, or a 429 whose headers give the reset
+    time) the channel is held back for that long and the call is retried.
+    
+    Buckets are kept for the ``max_channels`` most recently used channels.
+    They have no idle timeout: a bucket that callers have overdrawn, or one
+    held after a rate limit, can sit untouched for longer than any fixed TTL,
+    and dropping it would let a full burst through early.
+    """
+    
+    def __init__(self, rate: float = 1.0, burst: int = 5, max_retries: int = 3, max_channels: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        # channel id -> [tokens, stamp of last refill, held until]
+        self.buckets = StateStore(max_entries=max_channels)
+        self.stats = {'calls': 0, 'skipped': 0, 'waits': 0, 'wait_seconds': 0.0, 'rate_limited': 0}
+    
+    def _refill(self, channel_id: int, now: float) -> list:
+        """The channel's bucket, created full and topped up to ``now``"""
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.buckets[channel_id] = [float(self.burst), now, 0.0]
+        bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        return bucket
+    
+    async def acquire(self, channel_id: int):
+        """Wait for a token; concurrent callers queue behind each other"""
+        now = time.monotonic()
+        bucket = self._refill(channel_id, now)
+        bucket[0] -= 1
+        wait = max(-bucket[0] / self.rate if self.rate else 0.0, bucket[2] - now)
+        if wait > 0:
+            self.stats['waits'] += 1
+            self.stats['wait_seconds'] += wait
+            await asyncio.sleep(wait)
+    
+    def hold(self, channel_id: int, retry_after: float):
+        """Block the channel for ``retry_after`` seconds after a rate limit"""
+        now = time.monotonic()
+        bucket = self._refill(channel_id, now)
+        bucket[0] = min(bucket[0], 0.0)
+        bucket[2] = max(bucket[2], now + retry_after)
+        self.stats['rate_limited'] += 1
+    
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """Seconds to wait from a rate-limit error, or None if it is not one"""
+        if isinstance(error, discord.RateLimited):
+            return error.retry_after
+        if isinstance(error, discord.HTTPException) and error.status == 429:
+            headers = getattr(error.response, 'headers', None) or {}
+            for header in ('Retry-After', 'X-RateLimit-Reset-After'):
+                try:
+                    return float(headers[header])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            return 1.0
+        return None
+    
+    async def call_nowait(self, channel_id: int, func: Callable[..., Awaitable], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run a best-effort call (e.g. a progress edit) only if a token is free now
+        
+        Returns:
+            The call's result, or None if it was skipped or rate limited
+        """
+        now = time.monotonic()
+        bucket = self._refill(channel_id, now)
+        if bucket[0] < 1 or bucket[2] > now:
+            self.stats['skipped'] += 1
+            return None
+        bucket[0] -= 1
+        self.stats['calls'] += 1
+        try:
+            return await func(*args, **kwargs)
+        except (discord.RateLimited, discord.HTTPException) as e:
+            retry_after = self.retry_after(e)
+            if retry_after is None:
+                raise
+            self.hold(channel_id, retry_after)
+            return None
+    
+    async def call(self, channel_id: int, func: Callable[..., Awaitable], *args: Any, **kwargs: Any) -> Any:
+        """Run a send/edit coroutine function once the channel has capacity"""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(channel_id)
+            self.stats['calls'] += 1
+            try:
+                return await func(*args, **kwargs)
+            except (discord.RateLimited, discord.HTTPException) as e:
+                retry_after = self.retry_after(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                logger.warning(f"Rate limited in channel {channel_id}, retrying in {retry_after:.2f}s")
+                self.hold(channel_id, retry_after)
+
+
+class MessageDelivery:
+    """
+    Sends long text in the fewest API calls
+    
+    The text is packed as plain messages, as embeds (two 3000-character
+    embeds per message, under Discord's 6000-character total), or as a
+    single file upload. ``auto`` picks plain messages while they fit in
+    ``max_messages``, then embeds, then the file. Every call goes through
+    the channel's ChannelRateLimiter.
+    """
+    
+    CONTENT_LIMIT = 2000
+    EMBED_LIMIT = 3000
+    EMBEDS_PER_MESSAGE = 2
+    MODES = ('auto', 'text', 'embed', 'file')
+    
+    def __init__(
+        self,
+        limiter: ChannelRateLimiter,
+        mode: str = 'auto',
+        max_messages: int = 3,
+        file_name: str = "response.md"
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown delivery mode: {mode}")
+        self.limiter = limiter
+        self.mode = mode
+        self.max_messages = max_messages
+        self.file_name = file_name
+        self.text_splitter = MessageSplitter(self.CONTENT_LIMIT)
+        self.embed_splitter = MessageSplitter(self.EMBED_LIMIT)
+        self.stats = {'deliveries': 0, 'messages': 0, 'text': 0, 'embed': 0, 'file': 0}
+    
+    def plan(self, text: str) -> tuple:
+        """
+        Choose how to send text
+        
+        Args:
+            text: Full response text
+            
+        Returns:
+            (mode, payloads), payloads being keyword arguments for send/edit
+            with any file given as a (name, bytes) pair
+        """
+        if self.mode in ('auto', 'text'):
+            chunks = self.text_splitter.split(text)
+            if self.mode == 'text' or len(chunks) <= self.max_messages:
+                return 'text', [{'content': chunk} for chunk in chunks]
+        if self.mode in ('auto', 'embed'):
+            chunks = self.embed_splitter.split(text)
+            groups = [
+                chunks[index:index + self.EMBEDS_PER_MESSAGE]
+                for index in range(0, len(chunks), self.EMBEDS_PER_MESSAGE)
+            ]
+            if self.mode == 'embed' or len(groups) <= self.max_messages:
+                return 'embed', [
+                    {'embeds': [discord.Embed(description=chunk, color=discord.Color.blue()) for chunk in group]}
+                    for group in groups
+                ]
+        return 'file', [{
+            'content': f"📄 The answer is {len(text):,} characters long, so it is attached as a file.",
+            'file': (self.file_name, text.encode('utf-8')),
+        }]
+    
+    async def deliver(self, target: Any, text: str, reuse: Optional[Any] = None) -> int:
+        """
+        Send text to a channel or context
+        
+        Args:
+            target: Anything with ``send`` (a channel or commands.Context)
+            text: Text to deliver
+            reuse: Message to edit into the first payload instead of sending one
+            
+        Returns:
+            Number of API calls made
+        """
+        channel_id = getattr(getattr(target, 'channel', target), 'id', 0)
+        mode, payloads = self.plan(text)
+        self.stats['deliveries'] += 1
+        self.stats[mode] += 1
+        calls = 0
+        for index, payload in enumerate(payloads):
+            if index == 0 and reuse is not None:
+                await self.limiter.call(channel_id, self._edit, reuse, payload)
+            else:
+                await self.limiter.call(channel_id, self._send, target, payload)
+            calls += 1
+        self.stats['messages'] += calls
+        return calls
+    
+    @staticmethod
+    async def _send(target: Any, payload: Dict[str, Any]) -> Any:
+        kwargs = dict(payload)
+        if 'file' in kwargs:
+            name, data = kwargs.pop('file')
+            kwargs['file'] = discord.File(io.BytesIO(data), filename=name)
+        return await target.send(**kwargs)
+    
+    @staticmethod
+    async def _edit(message: Any, payload: Dict[str, Any]) -> Any:
+        attachments = []
+        if 'file' in payload:
+            name, data = payload['file']
+            attachments.append(discord.File(io.BytesIO(data), filename=name))
+        return await message.edit(
+            content=payload.get('content'),
+            embeds=payload.get('embeds', []),
+            attachments=attachments
+        )
 
 
 class AICog(commands.Cog):
     """Discord bot cog for AI integration"""
     
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, config: Optional[AIConfig] = None):
         self.bot = bot
-        self.config = AIConfig()
-        self.moderation = AIModeration(self.config)
-        self.image_gen = ImageGeneration(self.config)
-        self.auto_response = AIAutoResponse(self.config)
-        self.advanced_ai = AdvancedAIFeatures(self.config)
+        self.config = config or AIConfig()
+        self.persistence = StatePersistence(
+            self.config.state_db_path,
+            flush_interval=self.config.state_flush_interval
+        ) if self.config.state_db_path else None
+        self.state = SharedStateBackend.from_url(
+            self.config.shared_state_url,
+            self.config.shared_state_prefix
+        )
+        self.metrics = MetricsRegistry()
+        self.guild_config = GuildConfigStore(
+            GuildSettings.from_config(self.config),
+            path=self.config.guild_config_path,
+            poll_interval=self.config.guild_config_poll_interval
+        )
+        self._background: set = set()
+        self.loop_lag = LoopLagMonitor(self.config.loop_lag_interval)
+        self.metrics_server = MetricsServer(
+            self.metrics,
+            self.config.metrics_host,
+            self.config.metrics_port
+        ) if self.config.metrics_port else None
+        self.profiler = SamplingProfiler(self.config.profile_path, self.config.profile_interval)
+        self.delivery = MessageDelivery(
+            ChannelRateLimiter(self.config.channel_send_rate, self.config.channel_send_burst),
+            mode=self.config.delivery_mode,
+            max_messages=self.config.delivery_max_messages
+        )
+        self.metrics.describe('message_stage_seconds', "Time spent in each on_message stage")
+        self.metrics.describe('command_duration_seconds', "Command handler duration")
+        self.metrics.describe('http_request_duration_seconds', "Upstream HTTP attempt latency")
+        self.metrics.add_collector(self._collect_metrics)
+        
+        # Subsystems are built on first use, or by cog_load when their feature is on
+        self._loaded = False
+        self._http: Optional[AIHTTPClient] = None
+        self._keywords: Optional[KeywordIndex] = None
+        self._moderation: Optional[AIModeration] = None
+        self._analyzer: Optional[TextAnalysisExecutor] = None
+        self._moderation_pipeline: Optional[ModerationPipeline] = None
+        self._auto_response: Optional[AIAutoResponse] = None
+        self._faq: Optional[FAQResponder] = None
+        self._image_gen: Optional[ImageGeneration] = None
+        self._image_jobs: Optional[ImageJobScheduler] = None
+        self._advanced_ai: Optional[AdvancedAIFeatures] = None
         
         logger.info("AI Integration module initialized")
     
+    @property
+    def http(self) -> AIHTTPClient:
+        """Shared upstream HTTP client"""
+        if self._http is None:
+            self._http = AIHTTPClient(
+                limit=self.config.http_connection_limit,
+                per_host_limit=self.config.http_per_host_limit,
+                max_retries=self.config.http_max_retries,
+                breaker_threshold=self.config.http_breaker_threshold,
+                breaker_reset=self.config.http_breaker_reset,
+                metrics=self.metrics
+            )
+        return self._http
+    
+    @property
+    def keywords(self) -> KeywordIndex:
+        """Keyword index shared by auto-response, sentiment and the analysis pool"""
+        if self._keywords is None:
+            keywords = KeywordIndex.from_lexicon(DEFAULT_LEXICON)
+            if self.config.lexicon_path and os.path.exists(self.config.lexicon_path):
+                try:
+                    keywords.load_file(self.config.lexicon_path)
+                except (OSError, UnicodeDecodeError, ValueError) as e:
+                    logger.error(f"Error loading lexicon {self.config.lexicon_path}: {e}")
+            self._keywords = keywords
+        return self._keywords
+    
+    @property
+    def moderation(self) -> AIModeration:
+        """Moderation scoring, with the analysis pool and classifier attached"""
+        if self._moderation is None:
+            moderation = AIModeration(self.config, self.persistence, self.state)
+            self._analyzer = TextAnalysisExecutor(
+                moderation.engine,
+                self.keywords,
+                workers=self.config.analysis_workers,
+                inline_chars=self.config.analysis_inline_chars,
+                batch_size=self.config.analysis_batch_size,
+                batch_delay=self.config.analysis_batch_delay
+            )
+            moderation.analyzer = self._analyzer
+            if self.config.classifier_url:
+                moderation.classifier = BatchedHTTPClassifier(
+                    self.http,
+                    self.config.classifier_url,
+                    api_key=self.config.openai_api_key,
+                    model=self.config.classifier_model,
+                    batch_size=self.config.classifier_batch_size,
+                    batch_delay=self.config.classifier_batch_delay,
+                    timeout=self.config.classifier_timeout,
+                    cache_size=self.config.classifier_cache_size,
+                    max_in_flight=self.config.classifier_max_in_flight
+                )
+            self._moderation = moderation
+        return self._moderation
+    
+    @property
+    def analyzer(self) -> TextAnalysisExecutor:
+        """Text analysis executor (its worker processes start on first offload)"""
+        return self.moderation.analyzer
+    
+    @property
+    def moderation_pipeline(self) -> ModerationPipeline:
+        """Moderation queue and enforcement workers, running once the cog is loaded"""
+        if self._moderation_pipeline is None:
+            self._moderation_pipeline = ModerationPipeline(
+                self.moderation,
+                ModerationActionExecutor(
+                    workers=self.config.enforcement_workers,
+                    queue_size=self.config.moderation_queue_size
+                ),
+                workers=self.config.moderation_workers,
+                batch_size=self.config.moderation_batch_size,
+                queue_size=self.config.moderation_queue_size,
+                backpressure=self.config.moderation_backpressure
+            )
+            if self._loaded:
+                self._moderation_pipeline.start()
+        return self._moderation_pipeline
+    
+    @property
+    def auto_response(self) -> AIAutoResponse:
+        if self._auto_response is None:
+            auto_response = AIAutoResponse(self.config, self.keywords, self.state)
+            auto_response.faq = self.faq
+            self._auto_response = auto_response
+        return self._auto_response
+    
+    @property
+    def faq(self) -> Optional[FAQResponder]:
+        """FAQ answers from the index at faq_index_path, None when disabled or unavailable"""
+        if self._faq is None and self.config.faq_index_path:
+            try:
+                embedder = self._load_embedder()
+            except (ImportError, AttributeError, TypeError, ValueError) as e:
+                logger.error(f"Error loading FAQ embedder {self.config.faq_embedder}: {e}")
+                self.config.faq_index_path = ""
+                return None
+            try:
+                index = FAQIndex(
+                    embedder,
+                    getattr(embedder, 'dim', self.config.faq_dimensions),
+                    path=self.config.faq_index_path,
+                    embedder_name=getattr(embedder, 'name', '') or self.config.faq_embedder
+                )
+            except ImportError:
+                logger.warning("NumPy is not installed, FAQ answers are disabled")
+                self.config.faq_index_path = ""
+                return None
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Error opening FAQ index: {e}")
+                self.config.faq_index_path = ""
+                return None
+            self._faq = FAQResponder(
+                index,
+                threshold=self.config.faq_threshold,
+                top_k=self.config.faq_top_k,
+                batch_size=self.config.faq_batch_size,
+                batch_delay=self.config.faq_batch_delay
+            )
+        return self._faq
+    
+    def _load_embedder(self) -> Callable[[List[str]], Any]:
+        """
+        Embedder for the FAQ index
+        
+        ``faq_embedder`` names a factory as ``module:attribute``; it is called
+        with ``faq_dimensions`` and must return a callable mapping a list of
+        texts to an (n, dim) array. The embedder's ``dim`` attribute, when it
+        has one, overrides ``faq_dimensions``, and its ``name`` (or the
+        factory path) is recorded in the index so a different embedder is
+        refused on reopen.
+        
+        Raises:
+            ValueError: If faq_embedder is not ``module:attribute``
+        """
+        if not self.config.faq_embedder:
+            return HashingEmbedder(self.config.faq_dimensions)
+        module_name, _, attribute = self.config.faq_embedder.partition(':')
+        if not module_name or not attribute:
+            raise ValueError("expected module:attribute")
+        factory = importlib.import_module(module_name)
+        for name in attribute.split('.'):
+            factory = getattr(factory, name)
+        return factory(self.config.faq_dimensions)
+    
+    @property
+    def image_gen(self) -> ImageGeneration:
+        if self._image_gen is None:
+            self._image_gen = ImageGeneration(self.config, self.http)
+        return self._image_gen
+    
+    @property
+    def image_jobs(self) -> ImageJobScheduler:
+        if self._image_jobs is None:
+            self._image_jobs = ImageJobScheduler(
+                self.image_gen.generate_image,
+                max_concurrency=self.config.image_max_concurrency,
+                per_guild_concurrency=self.config.image_per_guild_concurrency,
+                max_queue=self.config.image_queue_size,
+                job_timeout=self.config.image_job_timeout
+            )
+        return self._image_jobs
+    
+    @property
+    def advanced_ai(self) -> AdvancedAIFeatures:
+        if self._advanced_ai is None:
+            advanced_ai = AdvancedAIFeatures(
+                self.config,
+                self.persistence,
+                self.http,
+                keywords=self.keywords,
+                state=self.state
+            )
+            advanced_ai.analyzer = self.analyzer
+            self._advanced_ai = advanced_ai
+        return self._advanced_ai
+    
+    def warm_up(self):
+        """
+        Build the subsystems whose features are enabled, compiling the rule
+        engine and keyword trie, and index persisted state keys; cog_load
+        runs this in a worker thread
+        """
+        for name, enabled in (
+            ('moderation', self.config.enable_ai_moderation),
+            ('auto_response', self.config.enable_auto_response),
+            ('image_jobs', self.config.enable_image_generation),
+        ):
+            if enabled:
+                getattr(self, name)
+        if self.persistence:
+            self.persistence.warm()
+    
+    async def cog_load(self):
+        """Warm up enabled subsystems off the event loop, then start background workers"""
+        started = time.perf_counter()
+        await asyncio.to_thread(self.warm_up)
+        self._loaded = True
+        self.guild_config.start()
+        if self.state:
+            await self.state.start()
+        self.loop_lag.start()
+        if self._moderation_pipeline is not None or self.config.enable_ai_moderation:
+            self.moderation_pipeline.start()
+        if self.metrics_server:
+            await self.metrics_server.start()
+        logger.info(f"AI Integration module loaded in {(time.perf_counter() - started) * 1000:.1f}ms")
+    
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """Monitor messages for moderation and auto-response"""
         if message.author.bot:
             return
         
-        # AI Moderation
-        if self.config.enable_ai_moderation:
-            moderation_result = await self.moderation.check_content(
-                message.content,
-                message.author.id
-            )
-            
-            if moderation_result['is_violation']:
-                action = moderation_result['action']
-                
-                if action == 'delete':
-                    await message.delete()
-                    await message.channel.send(
-                        f"{message.author.mention} Your message was removed for policy violations."
-                    )
-                
-                elif action == 'delete_and_warn':
-                    await message.delete()
-                    await message.channel.send(
-                        f"{message.author.mention} ⚠️ Warning: Your message violates community guidelines."
-                    )
-                
-                elif action == 'delete_and_kick':
-                    await message.delete()
-                    try:
-                        await message.author.kick(reason="Repeated policy violations")
-                        await message.channel.send(
-                            f"{message.author.mention} has been kicked for repeated violations."
-                        )
-                    except discord.Forbidden:
-                        await message.channel.send(
-                            f"Unable to kick {message.author.mention}. Insufficient permissions."
-                        )
-        
-        # Auto-response
-        if self.config.enable_auto_response and not message.author.bot:
-            response = await self.auto_response.get_response(
-                message.content,
-                message.author.id
-            )
+        settings = self.guild_config.get(message.guild.id if message.guild else None)
+        self.metrics.inc('messages_total')
+        
+        # AI Moderation (scored and enforced by the pipeline workers)
+        verdict = None
+        if settings.enable_ai_moderation:
+            with self.metrics.timer('message_stage_seconds', stage='moderation'):
+                if settings.enable_auto_response:
+                    verdict = self.moderation_pipeline.hold(message)
+                self.moderation_pipeline.submit(message, settings.moderation_threshold)
+        
+        # Auto-response (held until moderation has scored the message)
+        if settings.enable_auto_response and not message.author.bot:
+            with self.metrics.timer('message_stage_seconds', stage='auto_response'):
+                response = await self.auto_response.get_response(
+                    message.content,
+                    message.author.id,
+                    settings.response_cooldown,
+                    message.guild.id if message.guild else 0
+                )
+            if response and verdict is not None:
+                with self.metrics.timer('message_stage_seconds', stage='verdict'):
+                    result = await verdict
+                if result and result['is_violation']:
+                    self.metrics.inc('auto_responses_withheld_total')
+                    response = None
             if response:
-                await message.reply(response)
+                self.metrics.inc('auto_responses_total')
+                with self.metrics.timer('message_stage_seconds', stage='reply'):
+                    await message.reply(response)
         
-        await self.bot.process_commands(message)
+        with self.metrics.timer('message_stage_seconds', stage='commands'):
+            await self.bot.process_commands(message)
+    
+    async def cog_before_invoke(self, ctx: commands.Context):
+        """Start timing a command"""
+        ctx.ai_started = time.perf_counter()
+    
+    async def cog_after_invoke(self, ctx: commands.Context):
+        """Record a command's duration"""
+        started = getattr(ctx, 'ai_started', None)
+        if started is not None:
+            self.metrics.observe(
+                'command_duration_seconds',
+                time.perf_counter() - started,
+                command=ctx.command.qualified_name,
+                failed=str(ctx.command_failed).lower()
+            )
+    
+    def _collect_metrics(self) -> Iterable[tuple]:
+        """Expose component stats as gauges (subsystems not built yet are skipped)"""
+        pipeline = self._moderation_pipeline
+        if pipeline:
+            for name, value in pipeline.stats.items():
+                yield f"moderation_pipeline_{name}", {}, value
+            for action, count in pipeline.actions.items():
+                yield "moderation_actions", {'action': action}, count
+            for name, value in pipeline.executor.stats.items():
+                yield f"moderation_executor_{name}", {}, value
+            yield "moderation_queue_depth", {}, pipeline.queue.qsize()
+        if self._moderation:
+            for name, value in self._moderation.flood.report().items():
+                yield "flood_tracked", {'kind': name}, value
+            if self._moderation.classifier:
+                for name, value in self._moderation.classifier.report().items():
+                    yield f"classifier_{name}", {}, value
+            for name, value in self._analyzer.report().items():
+                yield f"analysis_{name}", {}, value
+        if self._http:
+            for name, value in self._http.stats.items():
+                yield f"http_{name}", {}, value
+            for host, breaker in self._http.breakers.items():
+                yield "http_breaker_open", {'host': host}, breaker.state != 'closed'
+        if self._image_gen:
+            for name, value in self._image_gen.cache.report().items():
+                if isinstance(value, (int, float)):
+                    yield f"image_cache_{name}", {}, value
+        if self._image_jobs:
+            for name, value in self._image_jobs.report().items():
+                if isinstance(value, (int, float)):
+                    yield f"image_jobs_{name}", {}, value
+        for name, value in self.loop_lag.report().items():
+            yield f"event_loop_lag_{name}", {}, value
+        yield "guild_config_version", {}, self.guild_config.version
+        if self._faq:
+            for name, value in self._faq.report().items():
+                yield f"faq_{name}", {}, value
+        for name, value in self.delivery.stats.items():
+            yield f"delivery_{name}", {}, value
+        for name, value in self.delivery.limiter.stats.items():
+            yield f"channel_send_{name}", {}, value
+        if self._advanced_ai:
+            yield "conversations", {}, len(self._advanced_ai.conversation_history)
+        if self.state:
+            for name, value in self.state.report().items():
+                yield f"shared_state_{name}", {}, value
+            for stores in self.state._stores.values():
+                for store in stores:
+                    for name, value in store.stats.items():
+                        yield f"near_cache_{name}", {'namespace': store.namespace}, value
     
     @commands.command(name='ai_generate', help='Generate an image using AI')
     @commands.cooldown(1, 30, commands.BucketType.user)
     async def generate_image(self, ctx: commands.Context, *, prompt: str):
-        """Generate image from prompt"""
-        if not self.config.enable_image_generation:
+        """Queue an image generation job and reply when it finishes"""
+        if not self.guild_config.get(ctx.guild.id if ctx.guild else None).enable_image_generation:
             await ctx.send("Image generation is currently disabled.")
             return
         
-        async with ctx.typing():
-            image_data = await self.image_gen.generate_image(prompt)
-            
+        job = self.image_jobs.submit(ctx.guild.id if ctx.guild else 0, ctx.author.id, prompt)
+        if job is None:
+            await ctx.send("The image queue is full. Please try again in a few minutes.")
+            return
+        
+        position = self.image_jobs.position(job)
+        if position:
+            await ctx.reply(f"🎨 Queued image job #{job.id} (position {position}). Use `ai_cancel {job.id}` to cancel.")
+        else:
+            await ctx.reply(f"🎨 Generating image job #{job.id}...")
+        
+        task = asyncio.create_task(self._deliver_image(ctx, job))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+    
+    async def _deliver_image(self, ctx: commands.Context, job: ImageJob):
+        """Send the follow-up message once a job settles"""
+        image_data = await job.future
+        try:
             if image_data:
-                # Send image (base64 would need conversion to file/URL)
-                await ctx.send(f"Generated image for: {prompt}")
-            else:
-                await ctx.send("Failed to generate image. Please check API configuration.")
+                file = await self.image_gen.to_file(image_data, f"ai_image_{job.id}")
+                await ctx.reply(f"Generated image for: {job.prompt}", file=file)
+            elif job.status == 'timed_out':
+                await ctx.reply(f"Image job #{job.id} timed out. Please try again later.")
+            elif job.status != 'cancelled':
+                await ctx.reply("Failed to generate image. Please check API configuration.")
+        except discord.HTTPException as e:
+            logger.error(f"Error delivering image job {job.id}: {e}")
+    
+    @commands.command(name='ai_cancel', help='Cancel a queued image job')
+    async def cancel_image(self, ctx: commands.Context, job_id: int):
+        """Cancel one of your image jobs (admins can cancel any in their guild)"""
+        if ctx.guild is not None and ctx.author.guild_permissions.administrator:
+            cancelled = self.image_jobs.cancel(job_id, guild_id=ctx.guild.id)
+        else:
+            cancelled = self.image_jobs.cancel(job_id, ctx.author.id)
+        if cancelled:
+            await ctx.send(f"✅ Cancelled image job #{job_id}")
+        else:
+            await ctx.send(f"❌ No active job #{job_id} of yours")
     
     @commands.command(name='ai_ask', help='Ask the AI a question')
     @commands.cooldown(1, 5, commands.BucketType.user)
     async def ask_ai(self, ctx: commands.Context, *, question: str):
-        """Get AI response to question"""
+        """Get AI response to question, editing it in as it streams"""
+        limit = MessageDelivery.CONTENT_LIMIT
+        channel_id = ctx.channel.id
+        message: Optional[discord.Message] = None
+        buffer = ""
+        shown = ""
+        last_edit = 0.0
+        
         async with ctx.typing():
-            response = await self.advanced_ai.generate_response(
+            async for delta in self.advanced_ai.stream_response(
                 question,
                 ctx.author.id,
                 "You are a helpful Discord bot assistant."
-            )
-            
-            if response:
-                # Split long responses
-                if len(response) > 2000:
-                    chunks = [response[i:i+2000] for i in range(0, len(response), 2000)]
-                    for chunk in chunks:
-                        await ctx.send(chunk)
-                else:
-                    await ctx.send(response)
-            else:
+            ):
+                buffer += delta
+                
+                # Short answers stream in place; long ones show progress and are delivered at the end.
+                # Progress updates are skipped rather than awaited when the channel is busy, so
+                # the upstream stream is never held open waiting on Discord.
+                view = buffer if len(buffer) <= limit else f"✍️ Writing a long answer… ({len(buffer):,} characters)"
+                now = time.monotonic()
+                if view == shown or (message is not None and now - last_edit < self.config.stream_edit_interval):
+                    continue
+                if message is None:
+                    message = await self.delivery.limiter.call_nowait(channel_id, ctx.send, view)
+                    if message is not None:
+                        shown, last_edit = view, now
+                elif await self.delivery.limiter.call_nowait(channel_id, message.edit, content=view) is not None:
+                    shown, last_edit = view, now
+        
+        if not buffer.strip():
+            if message is None:
                 await ctx.send("Unable to generate response. Please try again later.")
+        elif len(buffer) > limit:
+            await self.delivery.deliver(ctx, buffer, reuse=message)
+        elif message is None:
+            await self.delivery.limiter.call(channel_id, ctx.send, buffer)
+        elif buffer != shown:
+            await self.delivery.limiter.call(channel_id, message.edit, content=buffer)
     
     @commands.command(name='ai_sentiment', help='Analyze sentiment of text')
     async def analyze_sentiment(self, ctx: commands.Context, *, text: str):
@@ -511,7 +5702,7 @@ class AICog(commands.Cog):
     @commands.command(name='ai_entities', help='Extract entities from text')
     async def extract_entities_cmd(self, ctx: commands.Context, *, text: str):
         """Extract entities from text"""
-        entities = await self.advanced_ai.extract_entities(text)
+        entities = await self.advanced_ai.extract_entities(text, ctx.message.id)
         
         embed = discord.Embed(
             title="Entity Extraction",
@@ -522,37 +5713,225 @@ class AICog(commands.Cog):
             if values:
                 embed.add_field(
                     name=entity_type.capitalize(),
-                    value=", ".join(values),
+                    value=", ".join(values)[:1024],
                     inline=False
                 )
         
         await ctx.send(embed=embed)
     
-    @commands.command(name='ai_config', help='Configure AI settings')
+    @commands.command(name='ai_config', help='Configure AI settings for this server')
+    @commands.guild_only()
     @commands.has_permissions(administrator=True)
     async def configure_ai(self, ctx: commands.Context, setting: str, value: str):
-        """Configure AI settings (admin only)"""
-        settings = {
-            'enable_auto_response': lambda v: v.lower() == 'true',
-            'enable_image_generation': lambda v: v.lower() == 'true',
-            'enable_ai_moderation': lambda v: v.lower() == 'true',
-            'moderation_threshold': lambda v: float(v),
-            'response_cooldown': lambda v: int(v),
-        }
+        """Configure AI settings for the current guild (admin only)"""
+        if setting not in GUILD_SETTING_PARSERS:
+            await ctx.send(f"❌ Unknown setting: {setting}")
+            return
+        
+        try:
+            self.guild_config.update(ctx.guild.id, {setting: value})
+        except ValueError:
+            await ctx.send(f"❌ Invalid value for {setting}")
+            return
+        
+        try:
+            await asyncio.to_thread(self.guild_config.save)
+        except OSError as e:
+            logger.error(f"Error saving guild config: {e}")
+        await ctx.send(f"✅ {setting} set to {value}")
+    
+    @commands.command(name='ai_rules', help='Manage moderation rule patterns')
+    @commands.is_owner()
+    async def manage_rules(self, ctx: commands.Context, action: str = 'list', *, pattern: str = ""):
+        """
+        List, add or remove moderation rule patterns (bot owner only)
+        
+        The rule engine is shared by every guild, and a pathological pattern
+        would slow moderation for all of them.
+        """
+        action = action.lower()
+        if action == 'list':
+            rules = "\n".join(f"`{p}`" for p in self.moderation.blocked_patterns) or "No rules configured."
+            await self.delivery.deliver(ctx, rules)
+        elif action == 'add' and pattern:
+            try:
+                self.moderation.add_pattern(pattern)
+                await ctx.send(f"✅ Added rule `{pattern}`")
+            except re.error as e:
+                await ctx.send(f"❌ Invalid pattern: {e}")
+        elif action == 'remove' and pattern:
+            if self.moderation.remove_pattern(pattern):
+                await ctx.send(f"✅ Removed rule `{pattern}`")
+            else:
+                await ctx.send(f"❌ Unknown rule: `{pattern}`")
+        else:
+            await ctx.send("❌ Usage: ai_rules <list|add|remove> [pattern]")
+    
+    @commands.command(name='ai_lexicon', help='Load keyword lexicon terms from an attached file')
+    @commands.is_owner()
+    async def load_lexicon(self, ctx: commands.Context):
+        """
+        Load tab-separated category/term/weight lines from an attachment (bot owner only)
+        
+        The lexicon drives auto-responses and sentiment in every guild. Added
+        terms are appended to lexicon_path, when set, and reloaded at startup.
+        """
+        if not ctx.message.attachments:
+            await ctx.send(f"ℹ️ {len(self.keywords)} terms loaded. Attach a file of `category<TAB>term[<TAB>weight]` lines to add more.")
+            return
+        
+        try:
+            raw = await ctx.message.attachments[0].read()
+            entries = KeywordIndex.parse_lines(raw.decode('utf-8').splitlines())
+        except (UnicodeDecodeError, ValueError) as e:
+            await ctx.send(f"❌ Invalid lexicon file: {e}")
+            return
+        added = await asyncio.to_thread(self.keywords.extend, entries)
+        if self.config.lexicon_path:
+            try:
+                await asyncio.to_thread(KeywordIndex.append_file, self.config.lexicon_path, entries)
+            except OSError as e:
+                logger.error(f"Error saving lexicon {self.config.lexicon_path}: {e}")
+                await ctx.send(f"⚠️ Added {added} terms ({len(self.keywords)} total), but they could not be saved")
+                return
+        await ctx.send(f"✅ Added {added} terms ({len(self.keywords)} total)")
+    
+    @commands.command(name='ai_faq', help='Manage semantic FAQ answers')
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def manage_faq(self, ctx: commands.Context, action: str = 'status', *, text: str = ""):
+        """Load this guild's FAQ entries from an attachment, remove them by id, or test a question (admin only)"""
+        faq = self.faq
+        if faq is None:
+            await ctx.send("❌ FAQ answers are disabled. Set faq_index_path (requires NumPy).")
+            return
         
-        if setting in settings:
+        action = action.lower()
+        if ctx.message.attachments:
             try:
-                setattr(self.config, setting, settings[setting](value))
-                await ctx.send(f"✅ {setting} set to {value}")
+                raw = await ctx.message.attachments[0].read()
+                ids = await asyncio.to_thread(faq.index.load_lines, raw.decode('utf-8').splitlines(), ctx.guild.id)
+                await ctx.send(f"✅ Added {len(ids)} entries ({faq.index.count(ctx.guild.id)} total)")
+            except (UnicodeDecodeError, ValueError) as e:
+                await ctx.send(f"❌ Invalid FAQ file: {e}")
+        elif action == 'remove' and text:
+            try:
+                ids = [int(value) for value in text.replace(',', ' ').split()]
             except ValueError:
-                await ctx.send(f"❌ Invalid value for {setting}")
+                await ctx.send("❌ Usage: ai_faq remove <id> [id...]")
+                return
+            removed = await asyncio.to_thread(faq.index.remove, ids, ctx.guild.id)
+            await ctx.send(f"✅ Removed {removed} entries ({faq.index.count(ctx.guild.id)} total)")
+        elif action == 'test' and text:
+            matches = await faq.search(text, ctx.guild.id)
+            lines = [
+                f"{'✅' if score >= faq.threshold else '▫️'} `{score:.3f}` #{entry_id} {question}"
+                for score, entry_id, question, _ in matches
+            ]
+            await self.delivery.deliver(ctx, "\n".join(lines) or "No entries match.")
         else:
-            await ctx.send(f"❌ Unknown setting: {setting}")
+            report = faq.report()
+            await ctx.send(
+                f"ℹ️ {faq.index.count(ctx.guild.id)} FAQ entries, threshold {faq.threshold:g}, "
+                f"{report['answered']}/{report['lookups']} lookups answered, p99 {report['p99_ms']:.1f}ms. "
+                "Attach `question<TAB>answer` or JSON lines to add entries; "
+                "usage: ai_faq <status|test|remove> [question|ids]"
+            )
+    
+    @commands.command(name='ai_stats', help='Show AI module performance statistics')
+    @commands.is_owner()
+    async def show_stats(self, ctx: commands.Context):
+        """Summarize stage timings, upstream latency and queue health (bot owner only)"""
+        embed = discord.Embed(title="AI Module Stats", color=discord.Color.blue())
+        
+        for title, name in (
+            ("Message stages", 'message_stage_seconds'),
+            ("Commands", 'command_duration_seconds'),
+            ("Upstream HTTP", 'http_request_duration_seconds'),
+        ):
+            rows = []
+            for key, histogram in sorted(self.metrics.histograms.get(name, {}).items()):
+                label = ", ".join(str(value) for _, value in key) or "all"
+                rows.append(
+                    f"`{label}` n={histogram.count} "
+                    f"avg={histogram.sum / histogram.count * 1000:.1f}ms "
+                    f"p95≤{histogram.quantile(0.95) * 1000:g}ms"
+                )
+            embed.add_field(name=title, value="\n".join(rows[:10]) or "No data", inline=False)
+        
+        pipeline = self._moderation_pipeline
+        if pipeline:
+            actions = ", ".join(f"{action}={count}" for action, count in sorted(pipeline.actions.items())) or "none"
+            embed.add_field(
+                name="Moderation",
+                value=(
+                    f"processed={pipeline.stats['processed']} dropped={pipeline.stats['dropped']} "
+                    f"queue={pipeline.queue.qsize()} p99={pipeline.latency_percentile(99) * 1000:.1f}ms\n"
+                    f"actions: {actions}"
+                ),
+                inline=False
+            )
+        caches = []
+        if self._image_gen:
+            caches.append(f"image hit rate {self._image_gen.cache.report().get('hit_rate', 0.0):.0%}")
+        if self._moderation and self._moderation.classifier:
+            caches.append(f"verdict hit rate {self._moderation.classifier.report()['cache_hit_rate']:.0%}")
+        embed.add_field(name="Caches", value=", ".join(caches) or "Not in use", inline=False)
+        lag = self.loop_lag.report()
+        embed.add_field(
+            name="Event loop lag",
+            value=f"p50 {lag['p50_ms']:.1f}ms, p99 {lag['p99_ms']:.1f}ms, max {lag['max_ms']:.1f}ms",
+            inline=False
+        )
+        await ctx.send(embed=embed)
+    
+    @commands.command(name='ai_profile', help='Toggle the sampling profiler')
+    @commands.is_owner()
+    async def toggle_profile(self, ctx: commands.Context, state: str = ""):
+        """
+        Start or stop writing collapsed stacks for flamegraphs (bot owner only)
+        
+        The profiler samples the whole process, every guild included, and
+        writes to a file on the host.
+        """
+        state = state.lower()
+        if state == 'on' and not self.profiler.running:
+            self.profiler.start()
+            await ctx.send(f"🔬 Profiling the event loop, writing stacks to `{self.profiler.path}`")
+        elif state == 'off' and self.profiler.running:
+            await asyncio.to_thread(self.profiler.stop)
+            await ctx.send(f"✅ Profile written to `{self.profiler.path}` ({sum(self.profiler.samples.values())} samples)")
+        else:
+            await ctx.send(f"ℹ️ Profiler is {'on' if self.profiler.running else 'off'}. Usage: ai_profile <on|off>")
     
     async def cog_unload(self):
         """Clean up resources"""
-        await self.image_gen.close()
-        await self.advanced_ai.close()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        if self.profiler.running:
+            await asyncio.to_thread(self.profiler.stop)
+        await self.guild_config.stop()
+        if self._moderation_pipeline:
+            await self._moderation_pipeline.stop()
+        if self._moderation:
+            if self._moderation.classifier:
+                await self._moderation.classifier.close()
+            await self._analyzer.shutdown()
+        await self.loop_lag.stop()
+        if self._image_jobs:
+            await self._image_jobs.stop()
+        if self._image_gen:
+            await self._image_gen.close()
+        if self._advanced_ai:
+            await self._advanced_ai.close()
+        if self._faq:
+            await asyncio.to_thread(self._faq.index.close)
+        if self._http:
+            await self._http.close()
+        if self.state:
+            await self.state.close()
+        if self.persistence:
+            await asyncio.to_thread(self.persistence.close)
         logger.info("AI Integration module unloaded")
 
 
@@ -0,0 +1,11 @@
+"""
+Shared setup for the AI integration tests
+
+Discord objects and upstream services are the local stand-ins from
+ai_benchmark, so tests run without a bot token or network access.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
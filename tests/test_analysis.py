@@ -0,0 +1,47 @@
+"""Text analysis offloading"""
+
+import asyncio
+
+from ai_integration import DEFAULT_LEXICON, AIConfig, AIModeration, KeywordIndex, TextAnalysisExecutor
+
+LONG_TEXT = "hello there, thank you for the help! " * 40 + "contact admin@example.com"
+
+
+def make_executor(workers):
+    config = AIConfig()
+    return TextAnalysisExecutor(
+        AIModeration(config).engine,
+        KeywordIndex.from_lexicon(DEFAULT_LEXICON),
+        workers=workers,
+        inline_chars=config.analysis_inline_chars
+    )
+
+
+def test_pool_is_opt_in():
+    assert AIConfig().analysis_workers == 0
+    
+    async def scenario():
+        executor = make_executor(AIConfig().analysis_workers)
+        result = await executor.run('keywords', LONG_TEXT)
+        await executor.shutdown()
+        return executor, result
+    
+    executor, result = asyncio.run(scenario())
+    assert executor._pool is None
+    assert executor.stats['inline'] == 1
+    assert result == executor.analyze('keywords', LONG_TEXT)
+
+
+def test_pool_results_match_inline_analysis():
+    async def scenario():
+        executor = make_executor(1)
+        kinds = ('moderation', 'keywords', 'entities')
+        results = await asyncio.gather(*(executor.run(kind, LONG_TEXT) for kind in kinds))
+        await executor.shutdown()
+        return executor, dict(zip(kinds, results))
+    
+    executor, results = asyncio.run(scenario())
+    assert executor.stats['offloaded'] == 3
+    assert executor.stats['fallbacks'] == 0
+    for kind, result in results.items():
+        assert result == executor.analyze(kind, LONG_TEXT)
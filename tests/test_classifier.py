@@ -0,0 +1,98 @@
+"""Batched moderation classifier against the local stand-in /moderations server"""
+
+import asyncio
+import time
+
+import pytest
+
+from ai_benchmark import FakeChannel, FakeGuild, FakeMessage, FakeUser, MockUpstream
+from ai_integration import (
+    AIConfig, AIHTTPClient, AIModeration, BatchedHTTPClassifier, ModerationActionExecutor, ModerationClassifier,
+    ModerationPipeline
+)
+
+
+async def start_classifier(latency: float, **kwargs) -> tuple:
+    upstream = MockUpstream(latency=latency)
+    await upstream.start()
+    http = AIHTTPClient()
+    classifier = BatchedHTTPClassifier(http, f"{upstream.base_url}/moderations", **kwargs)
+    return upstream, http, classifier
+
+
+async def stop_classifier(upstream: MockUpstream, http: AIHTTPClient, classifier: BatchedHTTPClassifier):
+    await classifier.close()
+    await http.close()
+    await upstream.stop()
+
+
+def test_concurrent_texts_share_requests_and_cache():
+    async def scenario():
+        upstream, http, classifier = await start_classifier(0.01, batch_size=16, batch_delay=0.01)
+        texts = [f"message {index}" for index in range(40)] + ["you idiot"] * 5
+        scores = await asyncio.gather(*(classifier.score(text) for text in texts))
+        cached = await classifier.score("you idiot")
+        await stop_classifier(upstream, http, classifier)
+        return scores, cached, upstream.requests['moderation'], classifier.stats
+    
+    scores, cached, requests, stats = asyncio.run(scenario())
+    assert scores[:40] == [0.01] * 40
+    assert scores[40:] == [0.8] * 5 and cached == 0.8
+    assert requests <= 4
+    assert stats['coalesced'] == 4 and stats['cache_hits'] == 1
+
+
+def test_slow_backend_falls_back_to_heuristics():
+    async def scenario():
+        upstream, http, classifier = await start_classifier(0.5, batch_delay=0.0, timeout=0.05, max_in_flight=1)
+        first = await classifier.score("you idiot")
+        # The timed-out request is still outstanding on the stand-in, then the slot frees up
+        slow = asyncio.create_task(classifier.score("still waiting"))
+        await asyncio.sleep(0.01)
+        saturated = await classifier.score("no room")
+        await slow
+        await stop_classifier(upstream, http, classifier)
+        return first, saturated, classifier.stats
+    
+    first, saturated, stats = asyncio.run(scenario())
+    assert first is None and saturated is None
+    assert stats['fallbacks'] == 2
+    assert stats['saturated'] == 1
+
+
+def test_pipeline_enforces_before_the_classifier_answers():
+    async def scenario():
+        upstream, http, classifier = await start_classifier(0.3, batch_delay=0.01)
+        moderation = AIModeration(AIConfig())
+        moderation.classifier = classifier
+        pipeline = ModerationPipeline(moderation, ModerationActionExecutor())
+        channel = FakeChannel(1)
+        spam = FakeMessage("SPAM SPAM SPAM buy now", FakeUser(1), channel, FakeGuild(1))
+        insult = FakeMessage("you idiot", FakeUser(2), channel, FakeGuild(1))
+        started = time.perf_counter()
+        pipeline.submit(spam)
+        pipeline.submit(insult)
+        await pipeline.queue.join()
+        heuristic_s = time.perf_counter() - started
+        heuristic_actions = dict(pipeline.actions)
+        await pipeline.join()
+        await pipeline.executor.queue.join()
+        await pipeline.stop()
+        await stop_classifier(upstream, http, classifier)
+        return heuristic_s, heuristic_actions, pipeline, insult
+    
+    heuristic_s, heuristic_actions, pipeline, insult = asyncio.run(scenario())
+    assert heuristic_s < 0.3
+    assert 'delete_and_warn' not in heuristic_actions
+    assert pipeline.stats['reviewed'] == 2 and pipeline.stats['escalated'] == 1
+    assert pipeline.actions['delete_and_warn'] == 1
+    assert insult.deleted
+
+
+def test_classifiers_must_implement_score():
+    class Silent(ModerationClassifier):
+        async def close(self):
+            pass
+    
+    with pytest.raises(TypeError, match="score"):
+        Silent()
@@ -0,0 +1,11 @@
+"""Permission checks on process-wide commands"""
+
+import pytest
+
+from ai_integration import AICog
+
+
+@pytest.mark.parametrize('command', ['ai_rules', 'ai_lexicon', 'ai_profile', 'ai_stats'])
+def test_process_wide_commands_are_owner_only(command):
+    checks = next(cmd for cmd in AICog.__cog_commands__ if cmd.name == command).checks
+    assert [check.__qualname__.split('.')[0] for check in checks] == ['is_owner']
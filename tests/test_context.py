@@ -0,0 +1,113 @@
+"""Token-budgeted conversation context: trimming, the rolling summary and rollover"""
+
+import pytest
+
+from ai_integration import Conversation, ConversationContextManager
+
+SYSTEM = "You are a helpful Discord bot."
+HEADER = "\n\nEarlier in this conversation:\n"
+
+
+def drive(manager: ConversationContextManager, turns: int) -> tuple:
+    """Alternate user and assistant turns, recording the payload after each one"""
+    conversation = Conversation()
+    reserved = manager.count_tokens(SYSTEM)
+    payloads = []
+    for index in range(turns):
+        role = 'user' if index % 2 == 0 else 'assistant'
+        content = f"turn {index} " + "lorem ipsum dolor sit amet " * (1 + index % 7)
+        manager.append(conversation, role, content, reserved)
+        payloads.append(manager.build(conversation, SYSTEM))
+    return conversation, payloads
+
+
+def payload_tokens(manager: ConversationContextManager, messages: list) -> int:
+    return sum(manager.count_tokens(message['content']) for message in messages)
+
+
+@pytest.mark.parametrize('turns', [100, 2000])
+def test_payload_stays_under_the_token_budget(turns):
+    manager = ConversationContextManager(token_budget=512, summary_budget=100)
+    conversation, payloads = drive(manager, turns)
+    # The joined summary costs no more than its lines did separately
+    limit = manager.token_budget + manager.count_tokens(HEADER)
+    assert max(payload_tokens(manager, messages) for messages in payloads) <= limit
+    assert conversation.tokens + conversation.summary_tokens <= manager.token_budget - manager.count_tokens(SYSTEM)
+    assert conversation.summary_tokens <= manager.summary_budget
+    assert conversation.tokens == sum(turn.tokens for turn in conversation.turns)
+    assert max(len(messages) for messages in payloads) <= 20
+    assert payloads[-1][0]['role'] == 'system'
+    assert payloads[-1][-1]['content'].startswith(f"turn {turns - 1} ")
+
+
+def test_message_count_plateaus_instead_of_growing():
+    manager = ConversationContextManager(token_budget=512, summary_budget=100)
+    _, short = drive(manager, 100)
+    _, long = drive(manager, 2000)
+    assert max(len(messages) for messages in long) == max(len(messages) for messages in short)
+    assert max(len(str(messages)) for messages in long) <= 2 * max(len(str(messages)) for messages in short)
+
+
+def test_folded_turns_are_summarized_in_the_system_message():
+    manager = ConversationContextManager(token_budget=120, summary_budget=200)
+    conversation = Conversation()
+    for index in range(6):
+        manager.append(conversation, 'user', f"question number {index} " + "x" * 80)
+    system = manager.build(conversation, SYSTEM)[0]['content']
+    assert system.startswith(SYSTEM + HEADER)
+    assert "user: question number 0 " in system
+    assert len(conversation.summary) + len(conversation.turns) == 6
+    # Without a system prompt the summary is the whole system message
+    assert manager.build(conversation)[0]['content'] == "\n".join(conversation.summary)
+
+
+def test_long_turns_are_shortened_in_the_summary():
+    manager = ConversationContextManager(token_budget=50, summary_budget=500)
+    conversation = Conversation()
+    manager.append(conversation, 'user', "word " * 200)
+    manager.append(conversation, 'assistant', "reply")
+    (line,) = conversation.summary
+    assert line.endswith("...")
+    assert len(line) <= len("user: ") + manager.SUMMARY_LINE_CHARS + len("...")
+
+
+def test_summary_rolls_over_oldest_lines_first():
+    manager = ConversationContextManager(token_budget=64, summary_budget=60)
+    conversation, _ = drive(manager, 2000)
+    lines = list(conversation.summary)
+    numbers = [int(line.split()[2]) for line in lines]
+    assert numbers == sorted(numbers)
+    assert numbers[0] > 1900
+    # The newest summary line is the turn folded just before the oldest kept turn
+    assert numbers[-1] + 1 == int(conversation.turns[0].message['content'].split()[1])
+    assert conversation.summary_tokens == sum(manager.count_tokens(line) for line in lines)
+
+
+def test_oversized_turn_is_kept_on_its_own():
+    manager = ConversationContextManager(token_budget=32, summary_budget=16)
+    conversation = Conversation()
+    manager.append(conversation, 'user', "short")
+    manager.append(conversation, 'user', "y" * 1000)
+    assert [turn.message['content'] for turn in conversation.turns] == ["y" * 1000]
+    assert list(conversation.summary) == ["user: short"]
+
+
+def test_system_message_is_rebuilt_only_when_the_summary_changes():
+    manager = ConversationContextManager(token_budget=512, summary_budget=100)
+    conversation, _ = drive(manager, 100)
+    first = manager.build(conversation, SYSTEM)[0]
+    assert manager.build(conversation, SYSTEM)[0] is first
+    assert manager.build(conversation, "Another prompt")[0] is not first
+    manager.append(conversation, 'user', "z" * 2000, manager.count_tokens(SYSTEM))
+    assert manager.build(conversation, SYSTEM)[0]['content'] != first['content']
+
+
+def test_restore_round_trips_and_reads_plain_message_lists():
+    manager = ConversationContextManager(token_budget=512, summary_budget=100)
+    conversation, payloads = drive(manager, 2000)
+    restored = manager.restore(conversation.to_dict())
+    assert manager.build(restored, SYSTEM) == payloads[-1]
+    assert restored.summary_tokens == conversation.summary_tokens
+    
+    legacy = manager.restore([{'role': 'user', 'content': "hi"}, {'role': 'assistant', 'content': "hello"}])
+    assert manager.build(legacy) == [{'role': 'user', 'content': "hi"}, {'role': 'assistant', 'content': "hello"}]
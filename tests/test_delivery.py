@@ -0,0 +1,131 @@
+"""Message splitting, delivery call counts and per-channel pacing"""
+
+import asyncio
+import random
+import re
+import time
+from collections import Counter
+
+import pytest
+
+from ai_benchmark import FakeChannel
+from ai_integration import ChannelRateLimiter, MessageDelivery, MessageSplitter
+
+FENCE = MessageSplitter._FENCE
+PIECES = [
+    "word", "another", "sentence.", "ends!", "really?", "(aside)", "snake_case", "x" * 300,
+    "👍🏽", "👨‍👩‍👧‍👦", "🇫🇷🇩🇪", "é", "नमस्ते", "🏳️‍🌈", "#️⃣",
+]
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    """Prose, long unbroken words, emoji sequences and fenced code"""
+    parts = []
+    size = 0
+    while size < length:
+        roll = rng.random()
+        if roll < 0.05:
+            lines = "\n".join(f"    line_{n} = {n} * 2" for n in range(rng.randint(1, 120)))
+            part = f"\n```{rng.choice(['', 'python', 'js'])}\n{lines}\n```\n"
+        elif roll < 0.15:
+            part = rng.choice(["\n", "\n\n"])
+        else:
+            part = rng.choice(PIECES) + rng.choice([" ", " ", ""])
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def visible(text: str) -> str:
+    """Text without fence lines or whitespace, which the splitter may add or drop at cuts"""
+    return re.sub(r'\s', '', "".join(line for line in text.split("\n") if not FENCE.match(line)))
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_fuzzed_chunks_fit_and_keep_all_content(seed):
+    rng = random.Random(seed)
+    text = random_text(rng, rng.choice([1500, 5000, 20000, 60000]))
+    chunks = MessageSplitter(2000).split(text)
+    assert all(0 < len(chunk) <= 2000 for chunk in chunks)
+    assert visible("\n".join(chunks)) == visible(text)
+    for chunk in chunks:
+        assert MessageSplitter._fence_state(chunk, None) is None
+        assert not MessageSplitter._EXTENDERS.match(chunk[0])
+        assert not chunk.startswith('́')
+
+
+def test_cuts_prefer_natural_boundaries():
+    paragraph = "This is a sentence. " * 60
+    chunks = MessageSplitter(2000).split(f"{paragraph}\n\n{paragraph}\n\n{paragraph}")
+    assert [chunk.strip() for chunk in chunks] == [paragraph.strip()] * 3
+    code = "```python\n" + "print('hello world')\n" * 300 + "```"
+    chunks = MessageSplitter(2000).split(code)
+    assert len(chunks) > 1
+    assert all(chunk.startswith("```python\n") and chunk.endswith("\n```") for chunk in chunks)
+
+
+@pytest.mark.parametrize('text', [
+    "```" + "a" * 1990 + "\n" + "code line\n" * 500,
+    "```" + "b" * 5000,
+    "`" * 12 + "py\n" + "x = 1\n" * 600,
+    "~" * 30 + "\n" + "y = 2\n" * 600,
+    "`" * 300 + "\n" + "z\n" * 2000,
+    "```py\n" + "q = 1\n" * 100 + "```\n" + "`" * 200 + "\n" + "w = 2\n" * 600,
+])
+def test_long_fences_and_info_strings_terminate_within_the_limit(text):
+    chunks = MessageSplitter(2000).split(text)
+    assert all(0 < len(chunk) <= 2000 for chunk in chunks)
+    # Only fence markers and reopened languages are added; nothing else is lost
+    kept = Counter(re.sub(r'[\s`~]', '', "".join(chunks)))
+    assert not Counter(re.sub(r'[\s`~]', '', text)) - kept
+
+
+def delivered(text: str, mode: str = 'auto', reuse: bool = False) -> tuple:
+    async def scenario():
+        channel = FakeChannel(1)
+        delivery = MessageDelivery(ChannelRateLimiter(rate=1000, burst=1000), mode=mode)
+        first = await channel.send("thinking...") if reuse else None
+        channel.stats['sends'] = 0
+        calls = await delivery.deliver(channel, text, reuse=first)
+        return calls, channel.stats, delivery.plan(text)[0]
+    
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('length, calls', [
+    (1500, {'text': 1, 'embed': 1, 'file': 1, 'auto': 1}),
+    (5000, {'text': 3, 'embed': 1, 'file': 1, 'auto': 3}),
+    (10000, {'text': 6, 'embed': 2, 'file': 1, 'auto': 2}),
+    (15000, {'text': 9, 'embed': 4, 'file': 1, 'auto': 1}),
+    (50000, {'text': 27, 'embed': 10, 'file': 1, 'auto': 1}),
+])
+def test_api_calls_per_answer(length, calls):
+    text = random_text(random.Random(length), length)[:length]
+    for mode, expected in calls.items():
+        made, stats, _ = delivered(text, mode)
+        assert made == stats['sends'] == expected, mode
+    # auto prefers plain messages, then embeds, while they fit in max_messages; then the file
+    assert calls['auto'] == next((calls[mode] for mode in ('text', 'embed') if calls[mode] <= 3), calls['file'])
+
+
+def test_progress_message_is_edited_into_the_first_payload():
+    calls, stats, _ = delivered("word " * 1000, 'text', reuse=True)
+    assert calls == 3
+    assert (stats['edits'], stats['sends']) == (1, 2)
+
+
+def test_rate_limit_hold_outlives_idle_time(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    limiter = ChannelRateLimiter(rate=1.0, burst=5)
+    sent = []
+    
+    async def send():
+        sent.append(clock[0])
+    
+    limiter.hold(1, 60)
+    for offset in (15, 45, 61):
+        clock[0] = 1000.0 + offset
+        asyncio.run(limiter.call_nowait(1, send))
+    assert sent == [1061.0]
+    assert limiter.stats['skipped'] == 2
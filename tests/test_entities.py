@@ -0,0 +1,85 @@
+"""Single-scan entity extraction"""
+
+import asyncio
+
+from ai_benchmark import entity_messages
+from ai_integration import AdvancedAIFeatures, AIConfig, Entity, EntityExtractor
+
+USER = "<@123456789012345678>"
+
+
+def texts(text: str) -> dict:
+    return {kind: [entity.text for entity in spans] for kind, spans in EntityExtractor.scan(text).items() if spans}
+
+
+def test_urls_drop_trailing_punctuation_and_invites_are_their_own_kind():
+    found = texts(
+        "docs at https://example.com/a_b?q=1&x=2, "
+        "(see http://example.org/page). join discord.gg/abc-123 or https://discord.com/invite/xyz!"
+    )
+    assert found == {
+        'urls': ["https://example.com/a_b?q=1&x=2", "http://example.org/page"],
+        'invites': ["discord.gg/abc-123", "https://discord.com/invite/xyz"],
+    }
+
+
+def test_mentions_are_classified_and_not_confused_with_emails_or_numbers():
+    text = (
+        f"hi {USER} <@!123456789012345679> <@&223456789012345678> <#323456789012345678> "
+        "@here mail a.b+c@mail.example.com"
+    )
+    assert texts(text) == {
+        'users': [USER, "<@!123456789012345679>"],
+        'roles': ["<@&223456789012345678>"],
+        'channels': ["<#323456789012345678>"],
+        'emails': ["a.b+c@mail.example.com"],
+        'mentions': ["@here"],
+    }
+
+
+def test_custom_emoji_timestamps_snowflakes_and_numbers():
+    text = "<:pepe:423456789012345678> <a:dance:523456789012345678> <t:1700000000:R> id 623456789012345678 x 42"
+    assert texts(text) == {
+        'emoji': ["<:pepe:423456789012345678>", "<a:dance:523456789012345678>"],
+        'timestamps': ["<t:1700000000:R>"],
+        'snowflakes': ["623456789012345678"],
+        'numbers': ["42"],
+    }
+
+
+def test_code_spans_and_blocks_are_skipped():
+    text = (
+        f"run `ping {USER}` then ``a ` {USER}`` and\n"
+        f"```py\nurl = 'https://example.com'  # 1234\n```\n"
+        f"thanks {USER}, see `unclosed 99"
+    )
+    spans = EntityExtractor.scan(text)
+    assert texts(text) == {'users': [USER], 'numbers': ["99"]}
+    assert spans['users'] == [Entity('users', USER, text.index(f"thanks {USER}") + 7, text.index(", see"))]
+
+
+def test_spans_are_deduplicated_at_their_first_offset():
+    text = f"{USER} 42 {USER} 42 see https://example.com and https://example.com"
+    spans = EntityExtractor.scan(text)
+    assert spans['users'] == [Entity('users', USER, 0, len(USER))]
+    assert [(entity.start, entity.end) for entity in spans['numbers']] == [(22, 24)]
+    for entities in spans.values():
+        for entity in entities:
+            assert text[entity.start:entity.end] == entity.text and type(entity) is Entity
+
+
+def test_dense_messages_keep_every_entity_and_results_are_cached_per_message():
+    text = entity_messages(1, 4000, seed=3)['entities'][0]
+    spans = EntityExtractor.scan(text)
+    assert sum(len(entities) for entities in spans.values()) > 100
+    # No entity is also reported as a smaller one inside it
+    ordered = sorted((entity.start, entity.end) for entities in spans.values() for entity in entities)
+    assert all(end <= start for (_, end), (start, _) in zip(ordered, ordered[1:]))
+    
+    features = AdvancedAIFeatures(AIConfig())
+    first = asyncio.run(features.extract_spans(text, message_id=1))
+    assert asyncio.run(features.extract_spans(text, message_id=1)) is first
+    assert asyncio.run(features.extract_spans(text + " 7", message_id=1)) is not first
+    assert asyncio.run(features.extract_entities("ping @mod")) == {
+        **{kind: [] for kind in EntityExtractor.KINDS}, 'mentions': ["@mod"]
+    }
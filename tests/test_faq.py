@@ -0,0 +1,89 @@
+"""FAQ index guild scoping, edit-log persistence and the embedder setting"""
+
+import asyncio
+import json
+import os
+
+from ai_integration import AICog, AIConfig, FAQIndex, FAQResponder, HashingEmbedder
+
+QUESTION = "how do I reset my password"
+
+
+def small_embedder(dim):
+    """Factory used through AIConfig.faq_embedder"""
+    return HashingEmbedder(dim // 2)
+
+
+def test_searches_only_match_the_querying_guild():
+    index = FAQIndex(HashingEmbedder(64), 64)
+    index.add([(QUESTION, "guild one answer")], guild_id=1)
+    index.add([(QUESTION, "guild two answer")], guild_id=2)
+    one, two, three = index.search([QUESTION] * 3, 3, [1, 2, 3])
+    assert [match[3] for match in one] == ["guild one answer"]
+    assert [match[3] for match in two] == ["guild two answer"]
+    assert three == []
+    assert len(index.search([QUESTION], 3)[0]) == 2
+    
+    # Another guild cannot remove the entry
+    assert index.remove([one[0][1]], guild_id=2) == 0
+    assert index.remove([one[0][1]], guild_id=1) == 1
+    assert (index.count(1), index.count(2)) == (0, 1)
+    
+    async def scenario():
+        responder = FAQResponder(index, threshold=0.5)
+        return await asyncio.gather(responder.answer(QUESTION, 1), responder.answer(QUESTION, 2))
+    
+    assert [match and match[3] for match in asyncio.run(scenario())] == [None, "guild two answer"]
+
+
+def test_edits_append_to_a_log_and_survive_reopening(tmp_path):
+    path = str(tmp_path / 'faq.f32')
+    index = FAQIndex(HashingEmbedder(64), 64, path=path)
+    snapshot = os.path.getmtime(f"{path}.json"), os.path.getsize(f"{path}.json")
+    ids = [index.add([(f"{QUESTION} number {n}", f"answer {n}")], guild_id=n % 3)[0] for n in range(20)]
+    index.remove(ids[:5], guild_id=None)
+    # No rewrite of the entries file below the compaction threshold
+    assert (os.path.getmtime(f"{path}.json"), os.path.getsize(f"{path}.json")) == snapshot
+    with open(f"{path}.log", encoding='utf-8') as f:
+        assert len(f.readlines()) == 21
+    # A crash mid-append leaves a torn final line
+    with open(f"{path}.log", 'a', encoding='utf-8') as f:
+        f.write('{"add":[[99,"torn')
+    
+    # Reopened without close(), as after a crash
+    reopened = FAQIndex(HashingEmbedder(64), 64, path=path)
+    assert reopened.entries == index.entries
+    assert (reopened.count(0), reopened.count(1), reopened.count(2)) == (index.count(0), index.count(1), index.count(2))
+    match = reopened.search([f"{QUESTION} number 7"], 1, [1])[0][0]
+    assert (match[1], match[3]) == (ids[7], "answer 7")
+    assert reopened.add([("new question here", "new answer")], guild_id=1) == [ids[0]]
+    
+    reopened.close()
+    assert os.path.getsize(f"{path}.log") == 0
+    with open(f"{path}.json", encoding='utf-8') as f:
+        assert len([entry for entry in json.load(f)['entries'] if entry]) == 16
+
+
+def test_log_is_compacted_once_it_outgrows_the_entries(tmp_path):
+    path = str(tmp_path / 'faq.f32')
+    index = FAQIndex(HashingEmbedder(64), 64, path=path)
+    for n in range(200):
+        index.add([(f"question {n}", f"answer {n}")])
+        with open(f"{path}.log", encoding='utf-8') as f:
+            assert len(f.readlines()) <= max(len(index.entries), 64)
+    assert FAQIndex(HashingEmbedder(64), 64, path=path).entries == index.entries
+
+
+def test_embedder_factory_from_config(tmp_path):
+    config = AIConfig()
+    config.faq_index_path = str(tmp_path / 'faq.f32')
+    config.faq_dimensions = 64
+    config.faq_embedder = "test_faq:small_embedder"
+    faq = AICog(object(), config).faq
+    assert faq.index.dim == 32
+    assert faq.index.embedder_name == "hashing-32"
+    
+    config = AIConfig()
+    config.faq_index_path = str(tmp_path / 'other.f32')
+    config.faq_embedder = "test_faq:missing"
+    assert AICog(object(), config).faq is None
@@ -0,0 +1,91 @@
+"""FloodDetector: MinHash near-duplicates, raids and bounded per-user state"""
+
+import random
+import time
+
+from ai_integration import FloodDetector
+
+COPYPASTA = "FREE NITRO click here to claim your gift before it expires"
+
+
+def shares_band(first: str, second: str) -> bool:
+    bands = FloodDetector.fingerprint(FloodDetector.words(first))
+    return bool(set(bands).intersection(FloodDetector.fingerprint(FloodDetector.words(second))))
+
+
+def test_reformatted_copies_have_the_same_fingerprint():
+    original = FloodDetector.fingerprint(FloodDetector.words(COPYPASTA))
+    for variant in (
+        COPYPASTA.lower(),
+        "free nitro!!! click here, to claim your gift before it expires...",
+        "expires it before gift your claim to here click nitro free",
+        COPYPASTA + " " + COPYPASTA,
+    ):
+        assert FloodDetector.fingerprint(FloodDetector.words(variant)) == original
+    assert FloodDetector.fingerprint(set()) == ()
+
+
+def test_one_word_edits_are_near_duplicates_and_unrelated_text_is_not():
+    rng = random.Random(1)
+    vocabulary = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=8)) for _ in range(2000)]
+    base = rng.sample(vocabulary, 40)
+    edited = [" ".join(base + [word]) for word in rng.sample(vocabulary, 50)]
+    unrelated = [" ".join(rng.sample(vocabulary, 40)) for _ in range(50)]
+    # Adding a word only changes both bands when it hashes below the two smallest
+    assert sum(shares_band(" ".join(base), text) for text in edited) >= 30
+    assert sum(shares_band(" ".join(base), text) for text in unrelated) <= 3
+
+
+def test_repeats_and_floods_from_one_user():
+    detector = FloodDetector(max_messages=6, max_duplicates=3)
+    results = [detector.observe(1, 10, f"{COPYPASTA}!" * (i % 2 + 1), now=100.0 + i) for i in range(3)]
+    assert [violations for _, violations in results] == [[], [], ["Repeated message"]]
+    assert results[-1][0] == FloodDetector.REPEAT_WEIGHT
+    
+    for i in range(6):
+        text = " ".join(str(i * 10 + word) for word in range(5))
+        score, violations = detector.observe(2, 10, text, now=100.0 + i)
+    assert violations == ["Message flood"] and score == FloodDetector.FLOOD_WEIGHT
+    # Outside the window the user starts over
+    assert detector.observe(2, 10, "back again later", now=200.0) == (0.0, [])
+
+
+def test_join_raid_needs_several_users_and_enough_words():
+    detector = FloodDetector(raid_duplicates=5)
+    verdicts = [detector.observe(user, 10, COPYPASTA, now=100.0 + user / 10)[1] for user in range(1, 7)]
+    assert verdicts[:4] == [[]] * 4
+    assert verdicts[4] == verdicts[5] == [FloodDetector.RAID_VIOLATION]
+    
+    # The same copypasta spread over other channels does not add up
+    spread = [detector.observe(user, 100 + user, COPYPASTA, now=101.0)[1] for user in range(7, 17)]
+    assert spread == [[]] * 10
+    # Short replies everyone posts ("lol", "gg") are not a raid
+    short = [detector.observe(user, 20, "gg wp", now=101.0)[1] for user in range(1, 11)]
+    assert short == [[]] * 10
+
+
+def test_one_user_repeating_in_a_channel_is_not_a_raid():
+    detector = FloodDetector(raid_duplicates=3, max_duplicates=10, max_messages=10)
+    verdicts = [detector.observe(1, 10, COPYPASTA, now=100.0 + i)[1] for i in range(5)]
+    assert FloodDetector.RAID_VIOLATION not in sum(verdicts, [])
+
+
+def test_idle_users_are_evicted():
+    detector = FloodDetector(window=0.05, max_entries=1000)
+    for user in range(500):
+        detector.observe(user, user % 10, f"hello from user {user}")
+    assert detector.report() == {'users': 500, 'channels': 10}
+    time.sleep(0.1)
+    detector.observe(1000, 1, "still here")
+    assert detector.report() == {'users': 1, 'channels': 1}
+    assert detector.users.expirations == 500
+
+
+def test_tracked_users_are_capped():
+    detector = FloodDetector(max_entries=100)
+    for user in range(1000):
+        detector.observe(user, 1, "hi there")
+    assert len(detector.users) == 100
+    assert detector.users.evictions == 900
+    # The most recent users keep their windows
+    assert 999 in detector.users and 0 not in detector.users
@@ -0,0 +1,77 @@
+"""Per-guild settings snapshots under concurrent reads and reloads"""
+
+import json
+import os
+import sys
+import threading
+
+from ai_integration import GuildConfigStore, GuildSettings
+
+GUILDS = range(1, 201)
+
+
+def write_version(path: str, version: int):
+    """Every setting that changes encodes the version, so a mixed snapshot is detectable"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'defaults': {'response_cooldown': version},
+            'guilds': {
+                str(guild_id): {'response_cooldown': version, 'moderation_threshold': version / 1000}
+                for guild_id in GUILDS
+            },
+        }, f)
+    # Distinct mtimes even on coarse filesystem clocks
+    os.utime(path, ns=(version * 10**9, version * 10**9))
+
+
+def test_readers_never_see_a_torn_or_older_snapshot(tmp_path):
+    path = str(tmp_path / 'guilds.json')
+    write_version(path, 1)
+    store = GuildConfigStore(GuildSettings(), path=path)
+    assert store.load()
+    
+    done = threading.Event()
+    failures = []
+    reads = [0]
+    
+    def reader(offset):
+        seen = 0
+        while not done.is_set():
+            for guild_id in GUILDS:
+                # Offset guilds are unconfigured and read the defaults of the same file
+                settings = store.get(guild_id + offset)
+                if not offset and settings.moderation_threshold != settings.response_cooldown / 1000:
+                    failures.append(f"torn settings {settings}")
+                    return
+                version = settings.response_cooldown
+                if version < seen:
+                    failures.append(f"went back from v{seen} to v{version}")
+                    return
+                seen = max(seen, version)
+                reads[0] += 1
+    
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    threads = [threading.Thread(target=reader, args=(offset,)) for offset in (0, 0, 1000)]
+    try:
+        for thread in threads:
+            thread.start()
+        for version in range(2, 60):
+            write_version(path, version)
+            assert store.load()
+            if version == 30:
+                # A broken file keeps the current snapshot
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write('{"guilds": {"1": {"moderation_threshold": "high"}}}')
+                os.utime(path, ns=(version * 10**9 + 1, version * 10**9 + 1))
+                assert not store.load()
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
+    
+    assert failures == []
+    assert reads[0] > len(GUILDS)
+    assert store.stats == {'reloads': 59, 'reload_errors': 1, 'updates': 0}
+    assert store.get(1).response_cooldown == 59
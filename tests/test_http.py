@@ -0,0 +1,107 @@
+"""Pooled HTTP client, retries and circuit breaking against a local aiohttp server"""
+
+import asyncio
+
+from aiohttp import web
+
+from ai_integration import AIHTTPClient, CircuitBreaker
+
+
+class Upstream:
+    """Local server whose responses are scripted per request"""
+    
+    def __init__(self):
+        self.statuses = []
+        self.delay = 0.0
+        self.requests = 0
+        self.url = ""
+        self._runner = None
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/v1"
+    
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        status = self.statuses.pop(0) if self.statuses else 200
+        return web.Response(status=status, text="ok", headers={'Retry-After': '0'})
+    
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+async def with_client(scenario, **kwargs):
+    upstream = Upstream()
+    await upstream.start()
+    client = AIHTTPClient(backoff_base=0.0, **kwargs)
+    try:
+        return await scenario(upstream, client)
+    finally:
+        await client.close()
+        await upstream.stop()
+
+
+def test_retries_retryable_statuses_on_one_pooled_session():
+    async def scenario(upstream, client):
+        upstream.statuses = [503, 429]
+        result = await client.request('GET', upstream.url)
+        return result.status, upstream.requests, client.stats['retries']
+    
+    assert asyncio.run(with_client(scenario)) == (200, 3, 2)
+
+
+def test_breaker_opens_then_half_open_trial_closes_it():
+    async def scenario(upstream, client):
+        upstream.statuses = [500, 500]
+        assert (await client.request('GET', upstream.url, retries=1)).status == 500
+        breaker = client.breakers[client._host(upstream.url)]
+        assert breaker.state == 'open'
+        assert await client.request('GET', upstream.url) is None
+        breaker.opened_at -= breaker.reset_timeout
+        result = await client.request('GET', upstream.url)
+        return result.status, breaker.state, client.stats['rejected']
+    
+    assert asyncio.run(with_client(scenario, breaker_threshold=2, breaker_reset=60)) == (200, 'closed', 1)
+
+
+def test_cancelled_half_open_trial_reopens_the_breaker():
+    async def scenario(upstream, client):
+        breaker = client.breakers.setdefault(client._host(upstream.url), CircuitBreaker(1, 60))
+        states = []
+        for open_call in (
+            lambda: requested(client, upstream.url),
+            lambda: streamed(client, upstream.url),
+        ):
+            breaker.record_failure()
+            breaker.opened_at -= breaker.reset_timeout
+            upstream.delay = 1.0
+            trial = asyncio.create_task(open_call())
+            await asyncio.sleep(0.1)
+            assert breaker.state == 'half_open'
+            trial.cancel()
+            await asyncio.gather(trial, return_exceptions=True)
+            states.append(breaker.state)
+            # Once the reset timeout passes again a new trial goes through
+            upstream.delay = 0.0
+            breaker.opened_at -= breaker.reset_timeout
+            assert await open_call() == 200
+            states.append(breaker.state)
+        return states
+    
+    assert asyncio.run(with_client(scenario)) == ['open', 'closed', 'open', 'closed']
+
+
+async def streamed(client: AIHTTPClient, url: str) -> int:
+    async with client.stream('GET', url) as resp:
+        await resp.read()
+        return resp.status
+
+
+async def requested(client: AIHTTPClient, url: str) -> int:
+    return (await client.request('GET', url)).status
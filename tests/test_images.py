@@ -0,0 +1,83 @@
+"""Image job scheduling and single-flight generation"""
+
+import asyncio
+import base64
+import io
+import json
+import os
+import tracemalloc
+
+import pytest
+
+from ai_integration import Base64ArtifactDecoder, ImageCache, ImageJobScheduler
+
+
+def test_cancel_is_scoped_to_owner_or_guild():
+    async def scenario():
+        never = asyncio.Event()
+        
+        async def generator(prompt, style):
+            await never.wait()
+        
+        scheduler = ImageJobScheduler(generator, max_concurrency=1)
+        running = scheduler.submit(guild_id=1, user_id=10, prompt="a")
+        queued = scheduler.submit(guild_id=2, user_id=20, prompt="b")
+        outcomes = [
+            scheduler.cancel(queued.id, user_id=10),
+            scheduler.cancel(queued.id, guild_id=1),
+            scheduler.cancel(queued.id, guild_id=2),
+            scheduler.cancel(running.id, user_id=10),
+        ]
+        await scheduler.stop()
+        return outcomes
+    
+    assert asyncio.run(scenario()) == [False, False, True, True]
+
+
+def test_waiters_take_over_when_the_leader_is_cancelled():
+    async def scenario():
+        cache = ImageCache()
+        calls = []
+        
+        async def generate(prompt, style):
+            async def factory():
+                calls.append(prompt)
+                await asyncio.sleep(0.05)
+                return b"png:" + prompt.encode()
+            return await cache.get_or_create(ImageCache.key({'prompt': prompt}), factory)
+        
+        scheduler = ImageJobScheduler(generate, max_concurrency=3, per_guild_concurrency=3)
+        jobs = [scheduler.submit(guild_id, guild_id, "same prompt") for guild_id in (1, 2, 3)]
+        await asyncio.sleep(0.01)
+        scheduler.cancel(jobs[0].id)
+        results = await asyncio.gather(*(job.future for job in jobs))
+        return results, calls, cache.stats
+    
+    results, calls, stats = asyncio.run(scenario())
+    assert results == [None, b"png:same prompt", b"png:same prompt"]
+    assert len(calls) == 2
+    assert stats['handoffs'] == 2
+
+
+@pytest.mark.parametrize('size', [512 * 512 * 3, 2048 * 2048 * 3])
+def test_decoder_peak_allocation_stays_near_the_decoded_size(size):
+    artifact = os.urandom(size)
+    # Escaped the way some JSON encoders write '/'
+    body = json.dumps({'artifacts': [{'base64': base64.b64encode(artifact).decode()}]}).encode().replace(b'/', b'\\/')
+    chunks = [body[offset:offset + 64 * 1024] for offset in range(0, len(body), 64 * 1024)]
+    
+    tracemalloc.start()
+    try:
+        sink = io.BytesIO()
+        decoder = Base64ArtifactDecoder(sink)
+        for chunk in chunks:
+            decoder.feed(chunk)
+        data = sink.getvalue()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    
+    assert decoder.done and data == artifact
+    # The decoded bytes plus BytesIO's growth slack and a few chunks, never the encoded payload
+    assert peak <= size * 1.25 + 4 * 64 * 1024
+    assert peak < len(body)
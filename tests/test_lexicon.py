@@ -0,0 +1,49 @@
+"""Keyword lexicon loading and persistence"""
+
+import asyncio
+
+from ai_benchmark import FakeChannel, FakeContext, FakeGuild, FakeMessage, FakeUser
+from ai_integration import AICog, AIConfig
+
+
+class FakeAttachment:
+    def __init__(self, data: bytes):
+        self.data = data
+    
+    async def read(self) -> bytes:
+        return self.data
+
+
+def upload(cog, data: bytes):
+    message = FakeMessage("!ai_lexicon", FakeUser(1), FakeChannel(1), FakeGuild(1))
+    message.attachments.append(FakeAttachment(data))
+    asyncio.run(cog.load_lexicon.callback(cog, FakeContext(message, 'ai_lexicon')))
+
+
+def test_uploaded_terms_survive_a_restart(tmp_path):
+    config = AIConfig()
+    config.lexicon_path = str(tmp_path / 'lexicon.tsv')
+    cog = AICog(object(), config)
+    assert 'faq' not in cog.keywords.scan("where is the wiki")
+    upload(cog, b"faq\twiki\nfaq\tdocs\t2\n")
+    upload(cog, b"faq\twiki\t3\n")
+    upload(cog, b"faq\tbroken\tweight\n")
+    assert cog.keywords.scan("wiki and docs")['faq'] == 5.0
+    
+    restarted = AICog(object(), config)
+    assert restarted.keywords.entries() == cog.keywords.entries()
+    assert restarted.keywords.scan("hello, wiki and docs") == {'greeting': 1.0, 'faq': 5.0}
+
+
+def test_missing_or_invalid_lexicon_falls_back_to_defaults(tmp_path):
+    config = AIConfig()
+    config.lexicon_path = str(tmp_path / 'missing.tsv')
+    assert AICog(object(), config).keywords.scan("hello")['greeting'] == 1.0
+    with open(config.lexicon_path, 'w', encoding='utf-8') as f:
+        f.write("just one field\n")
+    assert AICog(object(), config).keywords.scan("hello")['greeting'] == 1.0
+
+
+def test_lexicon_command_is_owner_only():
+    predicates = [check.__qualname__ for check in AICog.load_lexicon.checks]
+    assert any(name.startswith('is_owner') for name in predicates)
@@ -0,0 +1,188 @@
+"""Moderation scoring, the batched pipeline and enforcement"""
+
+import asyncio
+import threading
+import time
+
+from ai_benchmark import FakeBot, FakeChannel, FakeGuild, FakeMessage, FakeUser, synthetic_corpus
+from ai_integration import (
+    AICog, AIConfig, AIModeration, ModerationActionExecutor, ModerationClassifier, ModerationPipeline, StatePersistence
+)
+
+COPYPASTA = "FREE NITRO click here to claim your gift before it expires"
+
+
+def test_raid_verdict_deletes_and_bans():
+    async def scenario():
+        moderation = AIModeration(AIConfig())
+        pipeline = ModerationPipeline(moderation, ModerationActionExecutor())
+        channel = FakeChannel(42)
+        guild = FakeGuild(1)
+        raiders = [FakeUser(user_id) for user_id in range(1, 6)]
+        messages = []
+        # Everyone posts the copypasta, then the first raider floods it too
+        for author in raiders + [raiders[0]] * 5:
+            message = FakeMessage(COPYPASTA, author, channel, guild)
+            messages.append(message)
+            pipeline.submit(message)
+            await pipeline.queue.join()
+        await pipeline.executor.queue.join()
+        await pipeline.stop()
+        return pipeline, messages, raiders
+    
+    pipeline, messages, raiders = asyncio.run(scenario())
+    assert pipeline.actions.get('delete_and_ban')
+    assert messages[-1].deleted
+    assert raiders[0].removed == 'ban'
+    assert pipeline.executor.stats['actions'] == sum(pipeline.actions.values())
+    assert pipeline.executor.stats['errors'] == 0
+
+
+class SevereClassifier(ModerationClassifier):
+    async def score(self, text: str):
+        return 0.95
+
+
+def test_severe_content_alone_warns_instead_of_banning():
+    async def scenario():
+        moderation = AIModeration(AIConfig())
+        moderation.classifier = SevereClassifier()
+        pipeline = ModerationPipeline(moderation, ModerationActionExecutor())
+        author = FakeUser(7)
+        message = FakeMessage("a first message the model hates", author, FakeChannel(42), FakeGuild(1))
+        result = await moderation.check_content(message.content, author.id, channel_id=42)
+        pipeline.submit(message)
+        await pipeline.queue.join()
+        await pipeline.executor.queue.join()
+        await pipeline.stop()
+        return result, pipeline, message, author
+    
+    result, pipeline, message, author = asyncio.run(scenario())
+    assert result['score'] >= AIModeration.ACTION_BANDS[2]
+    assert result['action'] == 'delete_and_warn'
+    assert not pipeline.actions.get('delete_and_ban')
+    assert message.deleted and author.removed != 'ban'
+
+
+def test_degraded_messages_read_sqlite_off_the_event_loop(tmp_path):
+    persistence = StatePersistence(str(tmp_path / 'state.db'))
+    persistence.save('warnings', 7, [2, time.time()])
+    persistence.flush()
+    # As AICog.cog_load does, so users without a row never reach SQLite
+    persistence.warm()
+    read = persistence.load
+    threads = []
+    
+    def load(namespace, key):
+        reads = persistence.stats['loads']
+        row = read(namespace, key)
+        if persistence.stats['loads'] > reads:
+            threads.append(threading.get_ident())
+        return row
+    
+    persistence.load = load
+    
+    async def scenario():
+        moderation = AIModeration(AIConfig(), persistence)
+        pipeline = ModerationPipeline(moderation, ModerationActionExecutor(), queue_size=1, backpressure='degrade')
+        channel, guild = FakeChannel(42), FakeGuild(1)
+        repeat, newcomer = FakeUser(7), FakeUser(8)
+        # Nothing yields between submissions, so all but the first overflow the queue
+        for author in (newcomer, repeat, newcomer):
+            pipeline.submit(FakeMessage("THAT IS A SCAM I HATE IT!!!!!!", author, channel, guild))
+        await pipeline.join()
+        await pipeline.executor.queue.join()
+        await pipeline.stop()
+        return threading.get_ident(), pipeline.stats, repeat, newcomer
+    
+    loop_thread, stats, repeat, newcomer = asyncio.run(scenario())
+    persistence.close()
+    assert stats['degraded'] == 2
+    assert len(threads) == 1 and loop_thread not in threads
+    # The persisted strikes still count on the degraded path
+    assert repeat.removed == 'kick' and newcomer.removed is None
+
+
+def test_auto_responses_wait_for_the_moderation_verdict():
+    async def scenario():
+        config = AIConfig()
+        config.response_cooldown = 0
+        cog = AICog(FakeBot(), config)
+        guild = FakeGuild(1)
+        clean = FakeMessage("hello everyone", FakeUser(7), FakeChannel(41), guild)
+        hostile = FakeMessage("hello THIS IS A SCAM I HATE IT!!!!!!", FakeUser(8), FakeChannel(42), guild)
+        for message in (clean, hostile):
+            await cog.on_message(message)
+        await cog.moderation_pipeline.executor.queue.join()
+        await cog.cog_unload()
+        return cog, clean, hostile
+    
+    cog, clean, hostile = asyncio.run(scenario())
+    # Only the clean greeting gets a reply; the other is deleted unanswered
+    assert cog.metrics.counters['auto_responses_total'] == {(): 1.0}
+    assert cog.metrics.counters['auto_responses_withheld_total'] == {(): 1.0}
+    assert hostile.deleted and not clean.deleted
+    # The hostile message's channel only gets the warning notice
+    assert clean.channel.stats['sends'] == hostile.channel.stats['sends'] == 1
+    assert not cog.moderation_pipeline._held
+
+
+def test_every_determined_action_is_enforceable():
+    moderation = AIModeration(AIConfig())
+    for score in (0.5, 0.7, 0.9, 1.0):
+        for raid in (False, True):
+            action = moderation._determine_action(score, user_id=1, raid=raid)
+            assert action in ModerationActionExecutor.ACTIONS
+    assert moderation._determine_action(0.9, user_id=2) != 'delete_and_ban'
+    assert moderation._determine_action(0.9, user_id=2, raid=True) == 'delete_and_ban'
+
+
+def test_5k_message_burst_is_fully_moderated_in_submission_order():
+    """A 5000-message burst paced at 5k msg/s, with 20 ms fake REST calls for enforcement"""
+    records = synthetic_corpus(5000, users=2000, channels=50, seed=2)
+    
+    async def scenario():
+        moderation = AIModeration(AIConfig())
+        executor = ModerationActionExecutor(workers=32)
+        pipeline = ModerationPipeline(moderation, executor)
+        dispatched = []
+        submit = executor.submit
+        
+        def recording(message, action):
+            dispatched.append((message.id, action))
+            return submit(message, action)
+        
+        executor.submit = recording
+        channels = {channel_id: FakeChannel(channel_id, api_delay=0.02) for channel_id in range(1, 51)}
+        guild = FakeGuild(1)
+        messages = []
+        started = time.perf_counter()
+        # 50 messages every 10 ms
+        for tick in range(0, len(records), 50):
+            delay = started + tick / 5000 - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            for record in records[tick:tick + 50]:
+                message = FakeMessage(record['content'], FakeUser(record['user']), channels[record['channel']], guild)
+                messages.append(message)
+                pipeline.submit(message)
+        await pipeline.join()
+        await executor.queue.join()
+        await pipeline.stop()
+        return pipeline, messages, dispatched
+    
+    pipeline, messages, dispatched = asyncio.run(scenario())
+    assert pipeline.stats['processed'] == pipeline.stats['submitted'] == 5000
+    assert pipeline.stats['dropped'] == 0
+    assert pipeline.executor.stats['errors'] == 0
+    # Verdicts match scoring the corpus one message at a time, in the order it arrived
+    reference = AIModeration(AIConfig())
+    expected = []
+    for message, record in zip(messages, records):
+        result = reference.evaluate(record['content'], record['user'], None, record['channel'])
+        if result['is_violation']:
+            expected.append((message.id, result['action']))
+    assert expected and dispatched == expected
+    # Every violation was enforced and nothing else was touched
+    assert pipeline.executor.stats['actions'] == len(expected) == sum(pipeline.actions.values())
+    assert {message.id for message in messages if message.deleted} == {message_id for message_id, _ in expected}
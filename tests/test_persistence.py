@@ -0,0 +1,139 @@
+"""Write-behind SQLite persistence: crash recovery, throughput, retries and off-loop loads"""
+
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from ai_integration import StatePersistence, StateStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WRITER = """
+import itertools, sys
+sys.path.insert(0, sys.argv[1])
+from ai_integration import StatePersistence
+persistence = StatePersistence(sys.argv[2], flush_interval=0.01, batch_size=200)
+for round in itertools.count():
+    for key in range(200):
+        persistence.save('crash', round * 200 + key, {'round': round, 'padding': 'x' * 200})
+    persistence.flush()
+    print(round, flush=True)
+"""
+
+
+def test_killed_writer_keeps_every_flushed_batch(tmp_path):
+    path = str(tmp_path / 'state.db')
+    child = subprocess.Popen([sys.executable, '-c', WRITER, ROOT, path], stdout=subprocess.PIPE, text=True)
+    try:
+        acknowledged = -1
+        while acknowledged < 20:
+            acknowledged = int(child.stdout.readline())
+    finally:
+        # Killed while the next round is being queued or committed
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+    
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ('ok',)
+    rounds = dict(conn.execute(
+        "SELECT json_extract(value, '$.round'), COUNT(*) FROM state WHERE namespace = 'crash' GROUP BY 1"
+    ))
+    conn.close()
+    # Every acknowledged round is complete, and an unacknowledged one is all or nothing
+    assert all(rounds.get(round) == 200 for round in range(acknowledged + 1))
+    assert set(rounds.values()) == {200}
+    
+    reopened = StatePersistence(path)
+    assert reopened.load('crash', acknowledged * 200 + 199) == {'round': acknowledged, 'padding': 'x' * 200}
+    reopened.close()
+
+
+def test_write_throughput_coalesces_into_few_transactions(tmp_path):
+    persistence = StatePersistence(str(tmp_path / 'state.db'), flush_interval=0.05, batch_size=500)
+    started = time.perf_counter()
+    for n in range(50000):
+        persistence.save('warnings', n % 5000, [n, 0.0])
+    queued = time.perf_counter() - started
+    assert persistence.flush(30)
+    elapsed = time.perf_counter() - started
+    persistence.close()
+    
+    assert persistence.stats['committed'] <= 50000
+    assert persistence.stats['coalesced'] >= 50000 - persistence.stats['committed']
+    assert persistence.stats['transactions'] <= persistence.stats['committed'] // 500 + 50
+    # Queueing never waits on disk
+    assert queued < elapsed
+    assert 50000 / elapsed > 5000
+    conn = sqlite3.connect(str(tmp_path / 'state.db'))
+    assert conn.execute("SELECT value FROM state WHERE key = 4999").fetchone() == ('[49999,0.0]',)
+    conn.close()
+
+
+def test_failed_batch_is_retried_behind_newer_writes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    persistence = StatePersistence(path, flush_interval=0.01)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("CREATE TABLE fail (flag INTEGER)")
+    conn.execute("INSERT INTO fail VALUES (1)")
+    conn.execute(
+        "CREATE TRIGGER fail_insert BEFORE INSERT ON state WHEN EXISTS (SELECT 1 FROM fail) "
+        "BEGIN SELECT RAISE(ABORT, 'injected failure'); END"
+    )
+    for key in range(10):
+        persistence.save('warnings', key, [1, 0.0])
+    assert not persistence.flush(0.2)
+    assert persistence.stats['errors'] > 0
+    assert persistence.stats['requeued'] >= 10
+    persistence.save('warnings', 3, [2, 0.0])
+    conn.execute("DELETE FROM fail")
+    assert persistence.flush(5)
+    persistence.close()
+    
+    rows = dict(conn.execute("SELECT key, value FROM state"))
+    conn.close()
+    assert sorted(rows) == list(range(10))
+    assert rows[3] == '[2,0.0]'
+
+
+def test_warm_index_skips_sqlite_for_unknown_keys(tmp_path):
+    path = str(tmp_path / 'state.db')
+    persistence = StatePersistence(path)
+    persistence.save('warnings', 1, [1, 0.0])
+    persistence.flush()
+    persistence.warm()
+    persistence.save('warnings', 2, [2, 0.0])
+    persistence.delete('warnings', 1)
+    persistence.flush()
+    
+    assert persistence.load('warnings', 1) is None
+    assert persistence.load('warnings', 3) is None
+    assert persistence.stats['loads'] == 0
+    assert persistence.load('warnings', 2) == [2, 0.0]
+    assert persistence.stats['loads'] == 1
+    persistence.close()
+
+
+def test_fetch_runs_the_loader_off_the_event_loop():
+    threads = []
+    
+    def loader(key):
+        threads.append(threading.get_ident())
+        return key * 10 if key < 5 else None
+    
+    async def scenario():
+        store = StateStore(loader=loader)
+        loaded = await store.fetch(1)
+        missing = await store.fetch(7, 'default')
+        # Cached after the first fetch
+        cached = await store.fetch(1)
+        return threading.get_ident(), loaded, missing, cached
+    
+    loop_thread, loaded, missing, cached = asyncio.run(scenario())
+    assert (loaded, missing, cached) == (10, 'default', 10)
+    assert len(threads) == 2
+    assert loop_thread not in threads
@@ -0,0 +1,38 @@
+"""Compiled moderation rules give the same verdicts as one re.search per rule"""
+
+import random
+
+import pytest
+
+from ai_benchmark import reference_scan, synthetic_corpus
+from ai_integration import AIConfig, AIModeration, ModerationRuleEngine
+
+
+@pytest.mark.parametrize('patterns, content', [
+    ([r'(?i)(spam|scam)', r'(?i)spa.'], "spam"),
+    ([r'(?i)(ab)', r'(?i)(bc)'], "abc"),
+    ([r'\d{3}', r'(?i)(12)'], "123"),
+    ([r'(?i)(free nitro)', r'(?i)(nitro)', r'nitro click'], "FREE nitro click here"),
+    ([r'(a)\1', r'(?i)(aa)', r'a+b'], "aab"),
+])
+def test_overlapping_rules_all_match(patterns, content):
+    assert ModerationRuleEngine(patterns).scan(content) == reference_scan(patterns, content)
+
+
+def test_matches_reference_on_random_rules_and_corpus():
+    rng = random.Random(7)
+    alphabet = "abcs12 "
+    patterns = AIModeration(AIConfig()).blocked_patterns + [
+        rng.choice([r'(?i)({}|{})', r'{}{}', r'(?i){}.{}', r'\b{}\w*{}']).format(
+            "".join(rng.choices(alphabet[:-1], k=rng.randint(1, 3))),
+            "".join(rng.choices(alphabet[:-1], k=rng.randint(1, 3)))
+        )
+        for _ in range(30)
+    ]
+    engine = ModerationRuleEngine(patterns)
+    texts = ["".join(rng.choices(alphabet, k=rng.randint(1, 40))) for _ in range(2000)]
+    # Non-ASCII text takes the (?i) path, where e.g. "ſ" matches "s"
+    texts += ["".join(rng.choices(alphabet + "ſSÉß🙂", k=rng.randint(1, 40))) for _ in range(2000)]
+    texts += [record['content'] for record in synthetic_corpus(500, 50, 5, seed=3)]
+    for text in texts:
+        assert engine.scan(text) == reference_scan(patterns, text), text
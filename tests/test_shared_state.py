@@ -0,0 +1,164 @@
+"""SharedStateStore near-caches over RESPStateBackend, against the RESP stand-in"""
+
+import asyncio
+
+import pytest
+
+from ai_benchmark import RESPStandIn
+from ai_integration import RESPStateBackend, SharedStateBackend, SharedStateStore
+
+
+async def eventually(condition, timeout: float = 2.0):
+    """Wait for an invalidation or reconnect to land"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.005)
+
+
+async def start_process(url: str, **kwargs) -> tuple:
+    """One bot process: its own backend connections and near-cache"""
+    backend = SharedStateBackend.from_url(url)
+    store = SharedStateStore(backend, 'warnings', flush_delay=0.001, **kwargs)
+    await backend.start()
+    await backend.execute(('PING',))
+    return backend, store
+
+
+async def subscribed(standin: RESPStandIn, processes: int):
+    """Wait until every process listens for invalidations"""
+    await eventually(lambda: sum(len(writers) for writers in standin.subscribers.values()) == processes)
+
+
+def test_two_processes_agree_after_a_write():
+    async def scenario():
+        standin = RESPStandIn()
+        await standin.start()
+        first, a = await start_process(standin.url)
+        second, b = await start_process(standin.url)
+        await subscribed(standin, 2)
+        
+        assert await b.fetch(1) is None
+        a[1] = 3
+        await a.flush()
+        # b remembered the miss, and the write's invalidation makes it read again
+        await eventually(lambda: 1 not in b._absent)
+        seen = await b.fetch(1)
+        b[1] = seen + 1
+        await b.flush()
+        await eventually(lambda: 1 not in a._entries)
+        result = (seen, await a.fetch(1), await b.fetch(1), standin.get(b'discord_ai:warnings:1'))
+        await first.close()
+        await second.close()
+        await standin.stop()
+        return result
+    
+    seen, first_view, second_view, stored = asyncio.run(scenario())
+    assert seen == 3
+    assert first_view == second_view == 4
+    assert stored == b'4'
+
+
+def test_near_cache_serves_hits_and_drops_invalidated_keys():
+    async def scenario():
+        standin = RESPStandIn()
+        await standin.start()
+        first, a = await start_process(standin.url)
+        second, b = await start_process(standin.url)
+        await subscribed(standin, 2)
+        for key in range(5):
+            a[key] = key * 10
+        await a.flush()
+        
+        values = [await b.fetch(key) for key in range(5)]
+        reads = second.stats['reads']
+        again = [await b.fetch(key) for key in range(5)]
+        cached_reads = second.stats['reads'] - reads
+        a[2] = 99
+        await a.flush()
+        await eventually(lambda: 2 not in b._entries)
+        kept = sorted(b._entries)
+        refreshed = await b.fetch(2)
+        await first.close()
+        await second.close()
+        await standin.stop()
+        return values, again, cached_reads, kept, refreshed, b.stats, second.stats
+    
+    values, again, cached_reads, kept, refreshed, stats, backend_stats = asyncio.run(scenario())
+    assert values == again == [0, 10, 20, 30, 40]
+    assert cached_reads == 0
+    assert kept == [0, 1, 3, 4]
+    assert refreshed == 99
+    assert stats['hits'] == 5 and stats['misses'] == 6
+    assert backend_stats['invalidations'] >= 2
+
+
+def test_backend_outage_drops_the_near_cache_and_falls_back_to_the_loader():
+    async def scenario():
+        standin = RESPStandIn()
+        await standin.start()
+        backend = RESPStateBackend(port=int(standin.url.rsplit(':', 1)[1]), timeout=0.2)
+        store = SharedStateStore(backend, 'warnings', loader=lambda key: ('loaded', key), flush_delay=0.001)
+        await backend.start()
+        await subscribed(standin, 1)
+        store[1] = 'cached'
+        await store.flush()
+        stored = standin.get(b'discord_ai:warnings:1')
+        await standin.stop()
+        
+        # Invalidations can no longer arrive, so cached values may already be stale
+        await eventually(lambda: 1 not in store._entries)
+        values = [await store.fetch(1), await store.fetch(2)]
+        store[3] = 'unsent'
+        await store.flush()
+        await backend.close()
+        return stored, values, store.stats, backend.stats
+    
+    stored, values, stats, backend_stats = asyncio.run(scenario())
+    assert stored == b'"cached"'
+    assert values == [('loaded', 1), ('loaded', 2)]
+    assert stats['errors'] >= 2 and stats['remote_writes'] == 1
+    assert backend_stats['errors'] >= 3
+
+
+def test_concurrent_commands_are_pipelined_and_reconnect_after_a_drop():
+    async def scenario():
+        standin = RESPStandIn()
+        await standin.start()
+        backend, store = await start_process(standin.url)
+        await subscribed(standin, 1)
+        for key in range(50):
+            store[key] = key
+        await store.flush()
+        store.clear()
+        
+        round_trips = backend.stats['round_trips']
+        values = await asyncio.gather(*(store.fetch(key) for key in range(50)))
+        batched = backend.stats['round_trips'] - round_trips
+        replies = await asyncio.gather(*(backend.execute(('PING',)) for _ in range(20)))
+        
+        standin.disconnect()
+        await eventually(lambda: backend._writer is None)
+        assert await backend.execute(('SET', 'k', 'v')) == ['OK']
+        await subscribed(standin, 1)
+        store.clear()
+        after = await asyncio.gather(*(store.fetch(key) for key in range(10)))
+        await backend.close()
+        await standin.stop()
+        return values, batched, replies, after, backend.stats
+    
+    values, batched, replies, after, stats = asyncio.run(scenario())
+    assert values == list(range(50))
+    assert batched == 1
+    assert replies == [['OK']] * 20
+    assert after == list(range(10))
+    assert stats['connects'] == 2
+
+
+def test_backends_must_implement_read_and_write():
+    class ReadOnly(SharedStateBackend):
+        async def read(self, namespace, keys):
+            return [None] * len(keys)
+    
+    with pytest.raises(TypeError, match="write"):
+        ReadOnly()
@@ -0,0 +1,139 @@
+"""Streaming completions against a local SSE stand-in server"""
+
+import asyncio
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from ai_integration import AIConfig, AIHTTPClient, CompletionBackend, OpenAICompatibleBackend, SSEParser
+
+
+def event(payload) -> bytes:
+    data = payload if isinstance(payload, str) else json.dumps(payload)
+    return f"data: {data}\n\n".encode('utf-8')
+
+
+def delta(text: str) -> bytes:
+    return event({'choices': [{'delta': {'content': text}}]})
+
+
+class SSEStandIn:
+    """Serves a scripted body as raw chunks, optionally hanging or dropping the connection afterwards"""
+    
+    def __init__(self):
+        self.chunks = []
+        self.then = 'close'  # 'close', 'hang' or 'drop'
+        self.url = ""
+        self._runner = None
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/v1"
+    
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await resp.prepare(request)
+        for chunk in self.chunks:
+            await resp.write(chunk)
+            # Separate writes so the client sees separate reads
+            await asyncio.sleep(0.005)
+        if self.then == 'hang':
+            await asyncio.sleep(3600)
+        elif self.then == 'drop':
+            request.transport.close()
+            return resp
+        await resp.write_eof()
+        return resp
+    
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+def collect(chunks, then='close'):
+    """Deltas streamed by the backend, and the error that ended the stream if any"""
+    async def scenario():
+        server = SSEStandIn()
+        server.chunks = chunks
+        server.then = then
+        await server.start()
+        config = AIConfig()
+        config.openai_api_key = "test"
+        config.openai_base_url = server.url
+        http = AIHTTPClient(backoff_base=0.0)
+        deltas = []
+        error = None
+        try:
+            async with asyncio.timeout(5):
+                async for text in OpenAICompatibleBackend(config, http).stream([], 50):
+                    deltas.append(text)
+        except Exception as e:
+            error = e
+        finally:
+            await http.close()
+            await server.stop()
+        return deltas, error
+    
+    return asyncio.run(scenario())
+
+
+def test_frames_split_anywhere_reassemble():
+    body = delta("Hé") + b": comment\r\n\r\n" + delta("llo 👋") + event({'choices': []}) + delta(" world") + event("[DONE]")
+    # Every cut point, including inside multi-byte characters and CRLF pairs
+    for cut in range(1, len(body)):
+        parser = SSEParser()
+        events = parser.feed(body[:cut]) + parser.feed(body[cut:])
+        assert events[0] == json.dumps({'choices': [{'delta': {'content': "Hé"}}]})
+        assert events[-1] == "[DONE]"
+        assert len(events) == 5
+    
+    # Byte-at-a-time over the wire
+    deltas, error = collect([body[index:index + 1] for index in range(len(body))])
+    assert ("".join(deltas), error) == ("Héllo 👋 world", None)
+
+
+def test_done_ends_the_stream_while_the_connection_stays_open():
+    deltas, error = collect([delta("one"), delta(" two"), event("[DONE]"), delta(" ignored")], then='hang')
+    assert (deltas, error) == (["one", " two"], None)
+
+
+def test_malformed_events_are_skipped():
+    deltas, error = collect([delta("a"), event("{not json"), delta("b"), event("[DONE]")])
+    assert (deltas, error) == (["a", "b"], None)
+
+
+def test_error_event_mid_stream_stops_after_the_partial_answer():
+    deltas, error = collect([
+        delta("partial"),
+        event({'error': {'message': "overloaded", 'type': "server_error"}}),
+        delta(" never sent"),
+    ], then='hang')
+    assert (deltas, error) == (["partial"], None)
+
+
+def test_dropped_connection_mid_stream_raises_after_the_partial_answer():
+    deltas, error = collect([delta("partial"), b"data: {\"choi"], then='drop')
+    assert deltas == ["partial"]
+    # Callers (stream_response, _call_ai_api) log it and keep what arrived
+    assert isinstance(error, aiohttp.ClientPayloadError)
+
+
+def test_backends_must_implement_stream():
+    class Unfinished(CompletionBackend):
+        pass
+    
+    class Delegating(CompletionBackend):
+        async def stream(self, messages, max_tokens):
+            async for text in super().stream(messages, max_tokens):
+                yield text
+    
+    with pytest.raises(TypeError, match="stream"):
+        Unfinished()
+    with pytest.raises(NotImplementedError):
+        asyncio.run(Delegating().complete([], 16))